@@ -0,0 +1,69 @@
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+
+from django.conf import settings
+from rest_framework.renderers import JSONRenderer
+
+from api.serializers import IngredientSerializer, TagSerializer
+from recipes.constants import BUNDLE_VERSION_LENGTH
+from recipes.models import Ingredient, Tag
+
+BUNDLES = {
+    'tags': (Tag, TagSerializer),
+    'ingredients': (Ingredient, IngredientSerializer),
+}
+MANIFEST = 'manifest.json'
+
+
+def write_file(path, data):
+    handle, temp = tempfile.mkstemp(dir=settings.BUNDLE_ROOT)
+    with os.fdopen(handle, 'wb') as file:
+        file.write(data)
+    os.chmod(temp, 0o644)
+    os.replace(temp, path)
+
+
+def read_manifest():
+    try:
+        with open(os.path.join(settings.BUNDLE_ROOT, MANIFEST)) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def publish():
+    """Записывает справочники тегов и ингредиентов в BUNDLE_ROOT.
+
+    Имя файла содержит хеш содержимого, поэтому шлюз может кешировать
+    его навсегда. Рядом лежит сжатая копия для gzip_static. Файлы
+    текущей и предыдущей версий остаются, остальные удаляются.
+    """
+    os.makedirs(settings.BUNDLE_ROOT, exist_ok=True)
+    previous = read_manifest() or {}
+    manifest = {}
+    for name, (model, serializer) in BUNDLES.items():
+        data = JSONRenderer().render(
+            serializer(model.objects.all(), many=True).data
+        )
+        version = hashlib.sha256(data).hexdigest()[:BUNDLE_VERSION_LENGTH]
+        filename = f'{name}.{version}.json'
+        path = os.path.join(settings.BUNDLE_ROOT, filename)
+        if not os.path.exists(path):
+            write_file(f'{path}.gz', gzip.compress(data, mtime=0))
+            write_file(path, data)
+        manifest[name] = {'version': version, 'size': len(data),
+                          'url': f'{settings.BUNDLE_URL}{filename}'}
+    if manifest == previous:
+        return manifest
+    write_file(os.path.join(settings.BUNDLE_ROOT, MANIFEST),
+               json.dumps(manifest).encode())
+    keep = {os.path.basename(bundle['url'])
+            for bundle in (*manifest.values(), *previous.values())}
+    for filename in os.listdir(settings.BUNDLE_ROOT):
+        if (filename.split('.')[0] in BUNDLES
+                and filename.removesuffix('.gz') not in keep):
+            os.remove(os.path.join(settings.BUNDLE_ROOT, filename))
+    return manifest
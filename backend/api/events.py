@@ -0,0 +1,283 @@
+import asyncio
+import json
+import logging
+import select
+import threading
+import time
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.db import close_old_connections, connection, connections
+from rest_framework.authtoken.models import Token
+
+from api import metrics
+from recipes.constants import (EVENTS_HEARTBEAT_SECONDS, EVENTS_QUEUE_SIZE,
+                               EVENTS_TICKET_SECONDS)
+from recipes.models import Subscription
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'foodgram_recipes'
+TICKET_SALT = 'api.events.ticket'
+
+
+class EventBroker:
+    """Раздаёт события открытым SSE-соединениям этого процесса.
+
+    У каждого соединения своя очередь ограниченного размера: если клиент
+    не успевает читать, старые события выбрасываются.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connections = {}
+
+    @property
+    def connection_count(self):
+        with self.lock:
+            return sum(len(queues) for queues in self.connections.values())
+
+    def connect(self, user_id):
+        queue = asyncio.Queue(maxsize=EVENTS_QUEUE_SIZE)
+        with self.lock:
+            self.connections.setdefault(user_id, {})[queue] = (
+                asyncio.get_running_loop()
+            )
+        return queue
+
+    def disconnect(self, user_id, queue):
+        with self.lock:
+            queues = self.connections.get(user_id, {})
+            queues.pop(queue, None)
+            if not queues:
+                self.connections.pop(user_id, None)
+
+    def put(self, queue, event):
+        if queue.full():
+            queue.get_nowait()
+            metrics.increment('events.dropped')
+        queue.put_nowait(event)
+
+    def publish(self, user_ids, event):
+        with self.lock:
+            targets = [
+                (queue, loop)
+                for user_id in user_ids
+                for queue, loop in self.connections.get(user_id, {}).items()
+            ]
+        for queue, loop in targets:
+            try:
+                loop.call_soon_threadsafe(self.put, queue, event)
+            except RuntimeError:
+                continue
+        metrics.increment('events.published', len(targets))
+
+    def publish_recipe(self, event):
+        with self.lock:
+            connected = list(self.connections)
+        if not connected:
+            return
+        followers = Subscription.objects.filter(
+            author=event['author'], user__in=connected
+        ).values_list('user_id', flat=True)
+        self.publish(list(followers), event)
+
+
+broker = EventBroker()
+metrics.register_gauge('events.connections',
+                       lambda: broker.connection_count)
+
+
+def recipe_event(recipe):
+    return {
+        'id': recipe.id,
+        'name': recipe.name,
+        'image': recipe.image.url,
+        'author': recipe.author_id,
+        'pub_date': recipe.pub_date.isoformat(),
+    }
+
+
+def notify_new_recipe(recipe):
+    """Сообщает подписчикам автора о новом рецепте после коммита.
+
+    Событие уходит через NOTIFY и доходит до сервиса events, который
+    работает в отдельном процессе. Без PostgreSQL события не рассылаются.
+    """
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_notify(%s, %s)',
+                       (CHANNEL, json.dumps(recipe_event(recipe))))
+
+
+def listen_notifications():
+    import psycopg2
+    from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+    while True:
+        try:
+            listener = psycopg2.connect(
+                **connections['default'].get_connection_params()
+            )
+            listener.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            listener.cursor().execute(f'LISTEN {CHANNEL}')
+            while True:
+                if not select.select([listener], [], [],
+                                     EVENTS_HEARTBEAT_SECONDS)[0]:
+                    continue
+                listener.poll()
+                while listener.notifies:
+                    notify = listener.notifies.pop(0)
+                    close_old_connections()
+                    broker.publish_recipe(json.loads(notify.payload))
+        except Exception:
+            logger.exception('Соединение LISTEN %s прервано', CHANNEL)
+            time.sleep(EVENTS_HEARTBEAT_SECONDS)
+
+
+listener_started = threading.Event()
+
+
+def start_listener():
+    if listener_started.is_set():
+        return
+    listener_started.set()
+    threading.Thread(target=listen_notifications, daemon=True).start()
+
+
+def get_user(key):
+    try:
+        token = Token.objects.select_related('user').get(key=key)
+    except Token.DoesNotExist:
+        return None
+    finally:
+        close_old_connections()
+    return token.user if token.user.is_active else None
+
+
+def get_ticket_user(user_id):
+    try:
+        return get_user_model().objects.get(id=user_id, is_active=True)
+    except get_user_model().DoesNotExist:
+        return None
+    finally:
+        close_old_connections()
+
+
+def make_ticket(user):
+    """Выдаёт короткоживущий билет для подключения к потоку.
+
+    EventSource не умеет передавать заголовки, а токен в адресе попал бы
+    в журналы nginx. Билет живёт EVENTS_TICKET_SECONDS секунд.
+    """
+    return signing.dumps(user.id, salt=TICKET_SALT)
+
+
+def read_ticket(ticket):
+    try:
+        return signing.loads(ticket, salt=TICKET_SALT,
+                             max_age=EVENTS_TICKET_SECONDS)
+    except signing.BadSignature:
+        return None
+
+
+def get_token_key(scope):
+    for name, value in scope['headers']:
+        if name == b'authorization':
+            keyword, _, key = value.decode().partition(' ')
+            if keyword == 'Token':
+                return key
+    return None
+
+
+async def authenticate(scope, allow_ticket=True):
+    key = get_token_key(scope)
+    if key:
+        return await sync_to_async(get_user)(key)
+    if not allow_ticket:
+        return None
+    ticket = parse_qs(scope['query_string'].decode()).get('ticket', [None])[0]
+    user_id = ticket and read_ticket(ticket)
+    return user_id and await sync_to_async(get_ticket_user)(user_id)
+
+
+async def send_json(send, status, data):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json')],
+    })
+    await send({'type': 'http.response.body',
+                'body': json.dumps(data, ensure_ascii=False).encode()})
+
+
+async def wait_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def events_application(scope, receive, send):
+    issue_ticket = scope['path'].endswith('/ticket/')
+    user = await authenticate(scope, allow_ticket=not issue_ticket)
+    if not user:
+        await send_json(send, 401, {
+            'detail': 'Учетные данные не были предоставлены.'
+        })
+        return
+    if issue_ticket:
+        if scope['method'] != 'POST':
+            await send_json(send, 405, {
+                'detail': f'Метод "{scope["method"]}" не разрешен.'
+            })
+            return
+        await send_json(send, 200, {'ticket': make_ticket(user)})
+        return
+    if scope['path'].endswith('/metrics/'):
+        if not user.is_staff:
+            await send_json(send, 403, {
+                'detail': 'У вас недостаточно прав для выполнения данного '
+                          'действия.'
+            })
+            return
+        await send_json(send, 200, metrics.snapshot())
+        return
+    if connection.vendor != 'postgresql':
+        await send_json(send, 503, {
+            'detail': 'События доступны только с базой PostgreSQL.'
+        })
+        return
+    start_listener()
+    queue = broker.connect(user.id)
+    disconnected = asyncio.ensure_future(wait_disconnect(receive))
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream; charset=utf-8'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+        while True:
+            event = asyncio.ensure_future(queue.get())
+            await asyncio.wait((event, disconnected),
+                               timeout=EVENTS_HEARTBEAT_SECONDS,
+                               return_when=asyncio.FIRST_COMPLETED)
+            if disconnected.done():
+                event.cancel()
+                break
+            if event.done():
+                body = (f'event: recipe\n'
+                        f'data: {json.dumps(event.result())}\n\n')
+            else:
+                event.cancel()
+                body = ': ping\n\n'
+            await send({'type': 'http.response.body',
+                        'body': body.encode(), 'more_body': True})
+    finally:
+        disconnected.cancel()
+        broker.disconnect(user.id, queue)
@@ -1,12 +1,18 @@
+from django.db.models import F
 from django_filters.rest_framework import FilterSet, filters
 
-from recipes.models import Recipe, Tag
+from recipes.models import Recipe, Tag, tags_mask
 
 
 class RecipeFilter(FilterSet):
     tags = filters.ModelMultipleChoiceFilter(field_name='tags__slug',
                                              queryset=Tag.objects.all(),
-                                             to_field_name='slug')
+                                             to_field_name='slug',
+                                             method='filter_tags')
+    tags_mode = filters.ChoiceFilter(choices=(('any', 'any'), ('all', 'all')),
+                                     method='filter_tags_mode')
+    ordering = filters.ChoiceFilter(choices=(('trending', 'trending'),),
+                                    method='filter_ordering')
     is_favorited = filters.BooleanFilter(method='filter_is_favorited')
     is_in_shopping_cart = filters.BooleanFilter(
         method='filter_is_in_shopping_cart')
@@ -15,6 +21,24 @@ class RecipeFilter(FilterSet):
         model = Recipe
         fields = ('tags', 'author',)
 
+    def filter_tags(self, queryset, name, value):
+        if not value:
+            return queryset
+        # Побитовое условие не использует индекс, поэтому tags_mask
+        # не индексируется: фильтр проверяет маску в уже отобранных
+        # строках без join по recipe_tags.
+        mask = tags_mask(value)
+        queryset = queryset.alias(tags_match=F('tags_mask').bitand(mask))
+        if self.form.cleaned_data.get('tags_mode') == 'all':
+            return queryset.filter(tags_match=mask)
+        return queryset.exclude(tags_match=0)
+
+    def filter_tags_mode(self, queryset, name, value):
+        return queryset
+
+    def filter_ordering(self, queryset, name, value):
+        return queryset.order_by('-trending_score', '-pub_date')
+
     def filter_is_favorited(self, queryset, name, value):
         if value and self.request.user.is_authenticated:
             return queryset.filter(favorites__user=self.request.user)
@@ -0,0 +1,24 @@
+import os
+import threading
+from collections import Counter
+
+lock = threading.Lock()
+counters = Counter()
+gauges = {}
+
+
+def increment(name, value=1):
+    with lock:
+        counters[name] += value
+
+
+def register_gauge(name, callback):
+    gauges[name] = callback
+
+
+def snapshot():
+    with lock:
+        values = dict(counters)
+    values.update({name: callback() for name, callback in gauges.items()})
+    values['pid'] = os.getpid()
+    return values
@@ -0,0 +1,42 @@
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+from recipes.constants import MULTI_GET_MAX_IDS
+
+
+class SparseFieldsViewMixin:
+    def requested_fields(self, param):
+        value = self.request.query_params.get(param)
+        if value is None:
+            return None
+        return set(filter(None, value.split(',')))
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['fields'] = self.requested_fields('fields')
+        context['expand'] = self.requested_fields('expand') or set()
+        return context
+
+
+class MultiGetMixin:
+    def list(self, request, *args, **kwargs):
+        if 'ids' not in request.query_params:
+            return super().list(request, *args, **kwargs)
+        try:
+            ids = list(dict.fromkeys(
+                int(id) for id in request.query_params['ids'].split(',') if id
+            ))
+        except ValueError:
+            raise ValidationError({'errors': 'id должны быть целыми числами'})
+        if len(ids) > MULTI_GET_MAX_IDS:
+            raise ValidationError(
+                {'errors': f'Можно запросить не больше {MULTI_GET_MAX_IDS} id'}
+            )
+        objects = self.filter_queryset(self.get_queryset()).in_bulk(ids)
+        serializer = self.get_serializer(
+            [objects[id] for id in ids if id in objects], many=True
+        )
+        return Response({
+            'results': serializer.data,
+            'missing': [id for id in ids if id not in objects],
+        })
@@ -1,6 +1,106 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime, timedelta
+
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.utils.urls import replace_query_param
+
+from recipes.constants import CHANGES_PAGE_SIZE, MAX_PAGE_SIZE
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
 
 
 class PageNumberLimitPagination(PageNumberPagination):
     page_size_query_param = 'limit'
     page_size = 6
+    max_page_size = MAX_PAGE_SIZE
+
+
+def to_micro(moment):
+    return (moment - EPOCH) // timedelta(microseconds=1)
+
+
+def from_micro(value):
+    return EPOCH + timedelta(microseconds=value)
+
+
+class ChangesPagination:
+    """Курсорная пагинация ленты изменений.
+
+    Лента — это несколько потоков (обновлённые и удалённые объекты
+    каждой модели), каждый упорядочен по времени изменения и id. Курсор
+    хранит токен первой страницы, since и место в потоках, поэтому
+    записи между запросами не сдвигают страницы.
+    """
+
+    page_size = CHANGES_PAGE_SIZE
+    cursor_query_param = 'cursor'
+
+    def __init__(self, request, since):
+        self.request = request
+        value = request.query_params.get(self.cursor_query_param)
+        if value is None:
+            self.cursor = {'token': timezone.now(), 'since': since,
+                           'stream': 0, 'after': None}
+        else:
+            self.cursor = self.decode(value)
+
+    @property
+    def since(self):
+        return self.cursor['since']
+
+    @property
+    def token(self):
+        return str(to_micro(self.cursor['token']))
+
+    def decode(self, value):
+        try:
+            cursor = json.loads(urlsafe_b64decode(value.encode()))
+            token, since, stream = (cursor['token'], cursor['since'],
+                                    cursor['stream'])
+            after = cursor['after'] and (from_micro(cursor['after'][0]),
+                                         int(cursor['after'][1]))
+            return {'token': from_micro(token),
+                    'since': since and from_micro(since),
+                    'stream': int(stream), 'after': after}
+        except (ValueError, TypeError, KeyError, IndexError,
+                OverflowError):
+            raise ValidationError({'cursor': 'Неверный курсор'})
+
+    def encode(self, stream, row, field):
+        return urlsafe_b64encode(json.dumps({
+            'token': to_micro(self.cursor['token']),
+            'since': self.cursor['since'] and to_micro(self.cursor['since']),
+            'stream': stream,
+            'after': [to_micro(getattr(row, field)), row.pk],
+        }).encode()).decode()
+
+    def paginate(self, streams):
+        """streams — список пар (queryset, поле времени); возвращает
+        строки каждого потока, попавшие на страницу."""
+        pages, remaining, self.next = [], self.page_size, None
+        for index, (queryset, field) in enumerate(streams):
+            if index < self.cursor['stream'] or not remaining:
+                pages.append([])
+                continue
+            queryset = queryset.order_by(field, 'pk')
+            if index == self.cursor['stream'] and self.cursor['after']:
+                at, pk = self.cursor['after']
+                queryset = queryset.filter(
+                    Q(**{f'{field}__gt': at}) | Q(**{field: at, 'pk__gt': pk})
+                )
+            rows = list(queryset[:remaining])
+            pages.append(rows)
+            remaining -= len(rows)
+            if not remaining:
+                self.next = self.encode(index, rows[-1], field)
+        return pages
+
+    def get_next_link(self):
+        if self.next is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(),
+                                   self.cursor_query_param, self.next)
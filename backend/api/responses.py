@@ -0,0 +1,75 @@
+import os
+import re
+
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.http import http_date, quote_etag
+
+from recipes.constants import DATA_EXPORT_COPY_BUFFER
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def read_range(path, start, length):
+    with open(path, 'rb') as file:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(length, DATA_EXPORT_COPY_BUFFER))
+            if not chunk:
+                return
+            length -= len(chunk)
+            yield chunk
+
+
+def parse_range(header, size):
+    """Возвращает (начало, конец) для одного диапазона из заголовка Range.
+
+    None означает, что заголовок нужно проигнорировать и отдать файл
+    целиком, а ValueError — что диапазон за пределами файла.
+    """
+    match = RANGE_RE.match(header.replace(' ', ''))
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        start, end = max(size - int(last), 0), size - 1
+        if not int(last):
+            start = size
+    if start > end:
+        raise ValueError(header)
+    return start, end
+
+
+def range_file_response(request, path, filename, content_type):
+    """Отдаёт файл потоком с поддержкой докачки по заголовку Range."""
+    stat = os.stat(path)
+    etag = quote_etag(f'{stat.st_mtime_ns:x}-{stat.st_size:x}')
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        'Content-Disposition': f'attachment; filename="{filename}"',
+    }
+    header = request.headers.get('Range')
+    if_range = request.headers.get('If-Range')
+    if header and if_range not in (None, etag, headers['Last-Modified']):
+        header = None
+    try:
+        bounds = parse_range(header, stat.st_size) if header else None
+    except ValueError:
+        return HttpResponse(status=416, headers={
+            'Content-Range': f'bytes */{stat.st_size}'
+        })
+    start, end = bounds or (0, stat.st_size - 1)
+    response = StreamingHttpResponse(
+        read_range(path, start, end - start + 1),
+        status=206 if bounds else 200,
+        content_type=content_type,
+        headers=headers,
+    )
+    response['Content-Length'] = str(end - start + 1)
+    if bounds:
+        response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+    return response
@@ -1,14 +1,24 @@
 import base64
+from datetime import timedelta
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError as DjangoValidationError
 from django.core.files.base import ContentFile
 from django.db import transaction
+from django.db.models import Exists, F, OuterRef
+from django.utils import timezone
 from djoser.serializers import UserSerializer
 from rest_framework import serializers
+from rest_framework.relations import MANY_RELATION_KWARGS
 
-from recipes.constants import MAX_VALUE, MIN_VALUE
-from recipes.models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
-                            ShoppingList, Subscription, Tag)
+from api.events import notify_new_recipe
+from api.paginators import from_micro
+from recipes.constants import (DOCUMENTS_CHUNK_SIZE, MAX_VALUE, MIN_VALUE,
+                               SYNC_OVERLAP_SECONDS)
+from recipes.models import (DataExport, Favorite, Household, Ingredient,
+                            IngredientInRecipe, Recipe, RecipeDocument,
+                            ShoppingList, Tag, tags_mask)
 
 User = get_user_model()
 
@@ -22,7 +32,116 @@ class Base64ImageField(serializers.ImageField):
         return super().to_internal_value(data)
 
 
-class FoodgramUserSerializer(UserSerializer):
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """PrimaryKeyRelatedField, который внутри списка получает все
+    объекты одним запросом in_bulk вместо get() на каждый id."""
+
+    resolved = None
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        return BulkManyRelatedField(
+            child_relation=cls(*args, **kwargs),
+            **{key: value for key, value in kwargs.items()
+               if key in MANY_RELATION_KWARGS},
+        )
+
+    def to_pk(self, data):
+        if self.pk_field is not None:
+            data = self.pk_field.to_internal_value(data)
+        try:
+            if isinstance(data, bool):
+                raise TypeError
+            return self.get_queryset().model._meta.pk.to_python(data)
+        except (TypeError, ValueError, DjangoValidationError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+    def resolve(self, values):
+        pks = set()
+        for value in values:
+            try:
+                pks.add(self.to_pk(value))
+            except serializers.ValidationError:
+                pass
+        self.resolved = self.get_queryset().in_bulk(pks)
+
+    def to_internal_value(self, data):
+        if self.resolved is None:
+            return super().to_internal_value(data)
+        pk = self.to_pk(data)
+        if pk not in self.resolved:
+            self.fail('does_not_exist', pk_value=data)
+        return self.resolved[pk]
+
+
+class BulkManyRelatedField(serializers.ManyRelatedField):
+    """Возвращает ошибки сразу по всем несуществующим id."""
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+        objects, errors = [], []
+        self.child_relation.resolve(data)
+        try:
+            for item in data:
+                try:
+                    objects.append(self.child_relation.to_internal_value(item))
+                except serializers.ValidationError as error:
+                    errors.extend(error.detail)
+        finally:
+            self.child_relation.resolved = None
+        if errors:
+            raise serializers.ValidationError(errors)
+        return objects
+
+
+class BulkRelatedListSerializer(serializers.ListSerializer):
+    """Перед проверкой элементов получает объекты для всех полей
+    BulkPrimaryKeyRelatedField дочернего сериализатора."""
+
+    def to_internal_value(self, data):
+        fields = [field for field in self.child.fields.values()
+                  if isinstance(field, BulkPrimaryKeyRelatedField)]
+        for field in fields:
+            if isinstance(data, list):
+                field.resolve(item[field.field_name] for item in data
+                              if isinstance(item, dict)
+                              and field.field_name in item)
+        try:
+            return super().to_internal_value(data)
+        finally:
+            for field in fields:
+                field.resolved = None
+
+
+class SparseFieldsMixin:
+    """Оставляет в корневом сериализаторе только поля из ?fields=.
+
+    Связанные объекты, не перечисленные в ?expand=, выводятся как id.
+    """
+
+    compact_fields = {}
+
+    def get_fields(self):
+        fields = super().get_fields()
+        requested = self.context.get('fields')
+        parent = self.parent
+        if isinstance(parent, serializers.ListSerializer):
+            parent = parent.parent
+        if requested is None or parent is not None:
+            return fields
+        expand = self.context.get('expand', set())
+        return {
+            name: (self.compact_fields[name]()
+                   if name in self.compact_fields and name not in expand
+                   else field)
+            for name, field in fields.items() if name in requested
+        }
+
+
+class FoodgramUserSerializer(SparseFieldsMixin, UserSerializer):
     is_subscribed = serializers.SerializerMethodField()
     avatar = Base64ImageField(read_only=True)
 
@@ -32,10 +151,15 @@ class FoodgramUserSerializer(UserSerializer):
                   'avatar', 'is_subscribed')
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+        subscribed_authors = self.context.get('subscribed_authors')
+        if subscribed_authors is not None:
+            return obj.id in subscribed_authors
         user = self.context['request'].user
         return (
-            user.subscriptions.filter(author=obj.id).exists()
-            and user.is_authenticated
+            user.is_authenticated
+            and user.subscriptions.filter(author=obj.id).exists()
         )
 
 
@@ -47,16 +171,22 @@ class AvatarSerializer(serializers.ModelSerializer):
         fields = ('avatar', )
 
 
+class DataExportSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DataExport
+        fields = ('id', 'size', 'created_at', 'finished_at')
+
+
 class IngredientSerializer(serializers.ModelSerializer):
     class Meta:
         model = Ingredient
-        fields = '__all__'
+        fields = ('id', 'name', 'measurement_unit')
 
 
 class TagSerializer(serializers.ModelSerializer):
     class Meta:
         model = Tag
-        fields = '__all__'
+        fields = ('id', 'name', 'slug')
 
 
 class IngredientInRecipeGetSerializer(serializers.ModelSerializer):
@@ -72,14 +202,13 @@ class IngredientInRecipeGetSerializer(serializers.ModelSerializer):
 
 
 class IngredientInRecipePostSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(
-        queryset=Ingredient.objects.all()
-    )
+    id = BulkPrimaryKeyRelatedField(queryset=Ingredient.objects.all())
     amount = serializers.IntegerField(min_value=MIN_VALUE, max_value=MAX_VALUE)
 
     class Meta:
         model = IngredientInRecipe
         fields = ('id', 'amount')
+        list_serializer_class = BulkRelatedListSerializer
 
 
 class RecipeShortSerializer(serializers.ModelSerializer):
@@ -90,7 +219,17 @@ class RecipeShortSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'image', 'cooking_time')
 
 
-class RecipeGetSerializer(serializers.ModelSerializer):
+class PantryRecipeSerializer(RecipeShortSerializer):
+    coverage = serializers.SerializerMethodField()
+
+    class Meta(RecipeShortSerializer.Meta):
+        fields = RecipeShortSerializer.Meta.fields + ('coverage',)
+
+    def get_coverage(self, obj):
+        return round(self.context['coverage'][obj.id], 2)
+
+
+class RecipeGetSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     ingredients = IngredientInRecipeGetSerializer(
         source='ingridients_in_recipe', many=True
     )
@@ -100,6 +239,15 @@ class RecipeGetSerializer(serializers.ModelSerializer):
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
 
+    compact_fields = {
+        'author': lambda: serializers.PrimaryKeyRelatedField(read_only=True),
+        'tags': lambda: serializers.PrimaryKeyRelatedField(many=True,
+                                                           read_only=True),
+        'ingredients': lambda: serializers.PrimaryKeyRelatedField(
+            many=True, read_only=True
+        ),
+    }
+
     class Meta:
         model = Recipe
         fields = ('id', 'name', 'ingredients', 'tags', 'image', 'text',
@@ -107,24 +255,112 @@ class RecipeGetSerializer(serializers.ModelSerializer):
                   'is_in_shopping_cart')
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         user = self.context['request'].user
         return (
-            user.favorites.filter(recipe=obj.id).exists()
-            and user.is_authenticated
+            user.is_authenticated
+            and user.favorites.filter(recipe=obj.id).exists()
         )
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         user = self.context['request'].user
         return (
-            user.shopping_list.filter(recipe=obj.id).exists()
-            and user.is_authenticated
+            user.is_authenticated
+            and user.shopping_list.filter(recipe=obj.id).exists()
         )
 
 
+class RecipeDocumentSerializer(RecipeGetSerializer):
+    is_favorited = None
+    is_in_shopping_cart = None
+
+    class Meta(RecipeGetSerializer.Meta):
+        fields = ('id', 'name', 'ingredients', 'tags', 'image', 'text',
+                  'cooking_time', 'author')
+
+
+def render_document(recipe):
+    return RecipeDocumentSerializer(
+        recipe, context={'subscribed_authors': frozenset()}
+    ).data
+
+
+def refresh_documents(recipes):
+    """Пересобирает документы рецептов пачками в текущей транзакции."""
+    recipes = recipes.select_related('author').prefetch_related(
+        'tags', 'ingridients_in_recipe__ingredient'
+    ).order_by('id')
+    last_id = 0
+    while True:
+        chunk = list(recipes.filter(id__gt=last_id)[:DOCUMENTS_CHUNK_SIZE])
+        if not chunk:
+            return
+        with transaction.atomic():
+            RecipeDocument.objects.filter(recipe__in=chunk).delete()
+            RecipeDocument.objects.bulk_create([
+                RecipeDocument(recipe=recipe, data=render_document(recipe))
+                for recipe in chunk
+            ])
+        last_id = chunk[-1].id
+
+
+def annotate_user_flags(queryset, user, fields=None):
+    """Добавляет признаки избранного и списка покупок из fields."""
+    if not user.is_authenticated:
+        return queryset
+    flags = {
+        'is_favorited': Favorite,
+        'is_in_shopping_cart': ShoppingList,
+    }
+    return queryset.annotate(**{
+        name: Exists(model.objects.filter(user=user, recipe=OuterRef('pk')))
+        for name, model in flags.items() if fields is None or name in fields
+    })
+
+
+def pick(data, fields):
+    return {name: data[name] for name in fields}
+
+
+class RecipeDocumentReadSerializer(serializers.BaseSerializer):
+    """Отдаёт сохранённый документ рецепта.
+
+    Ссылки на файлы становятся абсолютными, а поля, зависящие от
+    пользователя, берутся из аннотаций и контекста запроса.
+    """
+
+    def to_representation(self, instance):
+        document = getattr(instance, 'document_data', None)
+        if document is None:
+            document = render_document(instance)
+        request = self.context['request']
+        data = pick(document, RecipeDocumentSerializer.Meta.fields)
+        data['ingredients'] = [
+            pick(ingredient, IngredientInRecipeGetSerializer.Meta.fields)
+            for ingredient in document['ingredients']
+        ]
+        data['tags'] = [pick(tag, TagSerializer.Meta.fields)
+                        for tag in document['tags']]
+        data['image'] = request.build_absolute_uri(document['image'])
+        author = pick(document['author'], FoodgramUserSerializer.Meta.fields)
+        if author['avatar']:
+            author['avatar'] = request.build_absolute_uri(author['avatar'])
+        author['is_subscribed'] = author['id'] in self.context.get(
+            'subscribed_authors', ()
+        )
+        data['author'] = author
+        data['is_favorited'] = getattr(instance, 'is_favorited', False)
+        data['is_in_shopping_cart'] = getattr(instance,
+                                              'is_in_shopping_cart', False)
+        return data
+
+
 class RecipePostSerializer(serializers.ModelSerializer):
     ingredients = IngredientInRecipePostSerializer(many=True)
-    tags = serializers.PrimaryKeyRelatedField(many=True,
-                                              queryset=Tag.objects.all())
+    tags = BulkPrimaryKeyRelatedField(many=True, queryset=Tag.objects.all())
     author = FoodgramUserSerializer(read_only=True)
     image = Base64ImageField()
     cooking_time = serializers.IntegerField(min_value=MIN_VALUE,
@@ -156,7 +392,7 @@ class RecipePostSerializer(serializers.ModelSerializer):
         IngredientInRecipe.objects.bulk_create(
             [IngredientInRecipe(
                 recipe=recipe,
-                ingredient=Ingredient.objects.get(id=ingredient['id'].id),
+                ingredient=ingredient['id'],
                 amount=ingredient.get('amount')
             ) for ingredient in ingredients_data]
         )
@@ -166,9 +402,13 @@ class RecipePostSerializer(serializers.ModelSerializer):
         ingredients_data = validated_data.pop('ingredients')
         tags_data = validated_data.pop('tags')
         author = self.context['request'].user
-        recipe = Recipe.objects.create(author=author, **validated_data)
+        recipe = Recipe.objects.create(
+            author=author, tags_mask=tags_mask(tags_data), **validated_data
+        )
         recipe.tags.set(tags_data)
         self.create_ingredients(recipe, ingredients_data)
+        refresh_documents(Recipe.objects.filter(id=recipe.id))
+        notify_new_recipe(recipe)
         return recipe
 
     @transaction.atomic
@@ -181,19 +421,28 @@ class RecipePostSerializer(serializers.ModelSerializer):
         instance.cooking_time = validated_data.get(
             'cooking_time', instance.cooking_time
         )
-        instance.ingridients_in_recipe.delete()
+        instance.ingridients_in_recipe.all().delete()
         self.create_ingredients(instance, ingredients_data)
         instance.tags.set(tags_data)
+        instance.tags_mask = tags_mask(tags_data)
         instance.save()
         return instance
 
     def to_representation(self, instance):
-        return RecipeGetSerializer(
-            instance, context={'request': self.context.get('request')}
+        # Документ уже пересобран при сохранении: ответ строится из него
+        # одним запросом, сколько бы ни было ингредиентов и тегов.
+        request = self.context['request']
+        recipe = annotate_user_flags(
+            Recipe.objects.annotate(document_data=F('document__data')),
+            request.user,
+        ).get(id=instance.id)
+        return RecipeDocumentReadSerializer(
+            recipe, context={'request': request}
         ).data
 
 
-class SubscriptionGetSerializer(serializers.ModelSerializer):
+class SubscriptionGetSerializer(SparseFieldsMixin,
+                                serializers.ModelSerializer):
     is_subscribed = serializers.SerializerMethodField()
     recipes = serializers.SerializerMethodField()
     recipes_count = serializers.SerializerMethodField()
@@ -218,74 +467,70 @@ class SubscriptionGetSerializer(serializers.ModelSerializer):
         return serializer.data
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         user = self.context['request'].user
         return (
-            user.subscriptions.filter(author=obj.id).exists()
-            and user.is_authenticated
+            user.is_authenticated
+            and user.subscriptions.filter(author=obj.id).exists()
         )
 
     def get_recipes_count(self, obj):
+        if hasattr(obj, 'recipes_count'):
+            return obj.recipes_count
         return obj.recipes.count()
 
 
-class SubscriptionPostSerializer(serializers.ModelSerializer):
-    user = serializers.HiddenField(default=serializers.CurrentUserDefault())
-    author = serializers.PrimaryKeyRelatedField(
-        queryset=User.objects.all())
+class HouseholdSerializer(serializers.ModelSerializer):
+    author = serializers.PrimaryKeyRelatedField(read_only=True)
+    members = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
 
     class Meta:
-        model = Subscription
-        fields = ('user', 'author')
+        model = Household
+        fields = ('id', 'name', 'code', 'author', 'members')
+        read_only_fields = ('code',)
 
-    def to_representation(self, instance):
-        return SubscriptionGetSerializer(
-            instance.author, context={'request': self.context.get('request')}
-        ).data
+    def create(self, validated_data):
+        household = super().create(validated_data)
+        household.members.add(household.author)
+        return household
 
-    def validate(self, data):
-        user = data['user']
-        author = data['author']
-        if user.subscriptions.filter(author=author).exists():
-            raise serializers.ValidationError(
-                {'errors': f'Вы уже подписаны на {author}!'}
-            )
-        if user == author:
-            raise serializers.ValidationError(
-                {'errors': 'Вы не можете подписаться на себя!'}
-            )
-        return data
 
+class HouseholdJoinSerializer(serializers.Serializer):
+    code = serializers.SlugRelatedField(slug_field='code',
+                                        queryset=Household.objects.all())
 
-class BaseSerializer(serializers.ModelSerializer):
-    user = serializers.HiddenField(default=serializers.CurrentUserDefault())
 
-    class Meta:
-        abstract = True
-        fields = ('user', 'recipe')
+class ShoppingCartSerializer(serializers.Serializer):
+    servings = serializers.IntegerField(min_value=MIN_VALUE,
+                                        max_value=MAX_VALUE, default=1)
 
-    def to_representation(self, instance):
-        return RecipeShortSerializer(
-            instance.recipe, context={'request': self.context.get('request')}
-        ).data
 
-    def validate(self, data):
-        user = data['user']
-        related_queryset = (user.favorites if self.Meta.model == Favorite
-                            else user.shopping_list
-                            )
-        if related_queryset.filter(recipe=data['recipe']).exists():
+class ShoppingCartDownloadSerializer(serializers.Serializer):
+    household = serializers.IntegerField(required=False)
+
+    def validate_household(self, value):
+        household = self.context['request'].user.households.filter(
+            pk=value
+        ).first()
+        if household is None:
             raise serializers.ValidationError(
-                {'errors': f'Рецепт уже добавлен в '
-                 f'{self.Meta.model._meta.verbose_name}!'}
+                'Вы не состоите в этом списке покупок'
             )
-        return data
+        return household
 
 
-class FavoriteSerializer(BaseSerializer):
-    class Meta(BaseSerializer.Meta):
-        model = Favorite
+class ChangesSerializer(serializers.Serializer):
+    since = serializers.IntegerField(required=False, min_value=0)
 
-
-class ShoppingListSerializer(BaseSerializer):
-    class Meta(BaseSerializer.Meta):
-        model = ShoppingList
+    def validate_since(self, value):
+        try:
+            since = from_micro(value)
+        except OverflowError:
+            raise serializers.ValidationError('Неверный токен синхронизации')
+        if since < timezone.now() - timedelta(
+                days=settings.TOMBSTONE_RETENTION_DAYS):
+            raise serializers.ValidationError(
+                'Токен устарел, начните синхронизацию заново'
+            )
+        return since - timedelta(seconds=SYNC_OVERLAP_SECONDS)
@@ -0,0 +1,54 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from api import bundles
+from api.serializers import refresh_documents
+from recipes.models import Ingredient, Recipe, Tag
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=Recipe)
+def refresh_recipe_document(sender, instance, created, **kwargs):
+    # Новому рецепту документ собирают после сохранения тегов
+    # и ингредиентов, иначе он записывался бы дважды.
+    if not created:
+        refresh_documents(Recipe.objects.filter(id=instance.id))
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_save, sender=Tag)
+def refresh_related_documents(sender, instance, created, **kwargs):
+    if not created:
+        refresh_documents(instance.recipes.all())
+
+
+@receiver(post_save, sender=User)
+def refresh_author_documents(sender, instance, created, update_fields,
+                             **kwargs):
+    if not created and update_fields != frozenset(('last_login',)):
+        refresh_documents(instance.recipes.all())
+
+
+@receiver(pre_delete, sender=Ingredient)
+@receiver(pre_delete, sender=Tag)
+def remember_related_recipes(sender, instance, **kwargs):
+    instance.related_recipes = list(
+        instance.recipes.values_list('id', flat=True)
+    )
+
+
+@receiver(post_delete, sender=Ingredient)
+@receiver(post_delete, sender=Tag)
+def refresh_deleted_related_documents(sender, instance, **kwargs):
+    refresh_documents(Recipe.objects.filter(id__in=instance.related_recipes))
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+@receiver(post_delete, sender=Tag)
+def publish_bundles(sender, **kwargs):
+    transaction.on_commit(bundles.publish)
@@ -0,0 +1,738 @@
+import asyncio
+import io
+import json
+import os
+import select
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock, skipIf, skipUnless
+
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from api import events, throttling
+from api.paginators import ChangesPagination
+from api.serializers import RecipePostSerializer, render_document
+from recipes.constants import (EVENTS_TICKET_SECONDS, MAX_PAGE_SIZE,
+                               MULTI_GET_MAX_IDS)
+from recipes.db import take_tokens
+from recipes.models import (DataExport, Favorite, FoodgramUser, Household,
+                            Ingredient, IngredientInRecipe, Recipe,
+                            RecipeDocument, ShoppingList, Subscription, Tag,
+                            ThrottleBucket, Tombstone, tags_mask)
+
+
+class ChangesTests(APITestCase):
+    def setUp(self):
+        self.user = FoodgramUser.objects.create(
+            email='user@example.com', username='user',
+            first_name='Имя', last_name='Фамилия',
+        )
+        self.client.force_authenticate(self.user)
+        self.tag = Tag.objects.create(name='Завтрак', slug='breakfast')
+        self.ingredient = Ingredient.objects.create(name='Мука',
+                                                    measurement_unit='г')
+
+    def create_recipes(self, count):
+        for number in range(count):
+            recipe = Recipe.objects.create(
+                author=self.user, name=f'Рецепт {number}', text='Текст',
+                cooking_time=10, image='recipes/image.png',
+            )
+            recipe.tags.add(self.tag)
+            IngredientInRecipe.objects.create(
+                recipe=recipe, ingredient=self.ingredient, amount=100
+            )
+            recipe.save()
+
+    def sync(self, **params):
+        """Проходит все страницы ленты и возвращает токен и ответы."""
+        response = self.client.get('/api/changes/', params)
+        self.assertEqual(response.status_code, 200, response.data)
+        pages = [response.data]
+        while pages[-1]['next']:
+            pages.append(self.client.get(pages[-1]['next']).data)
+        self.assertEqual({page['token'] for page in pages},
+                         {pages[0]['token']})
+        return pages[0]['token'], pages
+
+    def updated(self, pages, name):
+        return [item['id'] for page in pages
+                for item in page[name]['updated']]
+
+    def test_full_sync_is_paginated(self):
+        self.create_recipes(5)
+        with mock.patch.object(ChangesPagination, 'page_size', 2):
+            _, pages = self.sync()
+        self.assertEqual(len(pages), 4)
+        self.assertEqual(sorted(self.updated(pages, 'recipes')),
+                         sorted(Recipe.objects.values_list('id', flat=True)))
+        self.assertEqual(self.updated(pages, 'tags'), [self.tag.id])
+        self.assertEqual(self.updated(pages, 'ingredients'),
+                         [self.ingredient.id])
+
+    def test_query_count_does_not_depend_on_rows(self):
+        counts = []
+        for count in (1, 5):
+            self.create_recipes(count)
+            with CaptureQueriesContext(connection) as queries:
+                self.sync()
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_nested_changes_bump_recipes(self):
+        self.create_recipes(1)
+        recipe = Recipe.objects.get()
+        Recipe.objects.update(updated_at=timezone.now() - timedelta(days=1))
+        token, _ = self.sync()
+        Ingredient.objects.filter(pk=self.ingredient.pk).update(
+            updated_at=timezone.now() - timedelta(days=1)
+        )
+        self.tag.name = 'Ужин'
+        self.tag.save()
+        _, pages = self.sync(since=token)
+        self.assertEqual(self.updated(pages, 'recipes'), [recipe.id])
+        self.assertEqual(pages[0]['recipes']['updated'][0]['tags'][0]['name'],
+                         'Ужин')
+
+    def test_deleted_objects_and_retention(self):
+        token, _ = self.sync()
+        tag_id = self.tag.id
+        self.tag.delete()
+        _, pages = self.sync(since=token)
+        self.assertEqual(pages[0]['tags']['deleted'], [tag_id])
+        Tombstone.objects.update(deleted_at=timezone.now()
+                                 - timedelta(days=31))
+        call_command('prunetombstones', stdout=io.StringIO())
+        self.assertFalse(Tombstone.objects.exists())
+        old = int(token) - 31 * 24 * 3600 * 1_000_000
+        self.assertEqual(
+            self.client.get('/api/changes/', {'since': old}).status_code, 400
+        )
+
+
+class TagFilterTests(APITestCase):
+    def setUp(self):
+        author = FoodgramUser.objects.create(
+            email='author@example.com', username='author',
+            first_name='Имя', last_name='Фамилия',
+        )
+        self.tags = [Tag.objects.create(name=slug, slug=slug)
+                     for slug in ('breakfast', 'dinner')]
+        self.recipes = []
+        for tags in (self.tags[:1], self.tags):
+            recipe = Recipe.objects.create(
+                author=author, name='Рецепт', text='Текст', cooking_time=10,
+                image='recipes/image.png', tags_mask=tags_mask(tags),
+            )
+            recipe.tags.set(tags)
+            self.recipes.append(recipe.id)
+
+    def found(self, **params):
+        response = self.client.get(
+            '/api/recipes/', {'tags': ['breakfast', 'dinner'], **params}
+        )
+        return sorted(recipe['id'] for recipe in response.data['results'])
+
+    def test_any_and_all_modes(self):
+        self.assertEqual(self.found(), self.recipes)
+        self.assertEqual(self.found(tags_mode='all'), self.recipes[1:])
+
+
+IMAGE = ('data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJ'
+         'AAAADUlEQVR42mP8/5+hHgAHggJ/PchI7wAAAABJRU5ErkJggg==')
+
+
+class MediaRootMixin:
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(MEDIA_ROOT=directory.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+
+class RecipeDocumentTests(MediaRootMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = FoodgramUser.objects.create(
+            email='user@example.com', username='user',
+            first_name='Имя', last_name='Фамилия',
+        )
+        self.client.force_authenticate(self.user)
+        self.tag = Tag.objects.create(name='Завтрак', slug='breakfast')
+        self.ingredient = Ingredient.objects.create(name='Мука',
+                                                    measurement_unit='г')
+
+    def payload(self, amount=100):
+        return {'name': 'Блины', 'text': 'Текст', 'cooking_time': 10,
+                'image': IMAGE, 'tags': [self.tag.id],
+                'ingredients': [{'id': self.ingredient.id,
+                                 'amount': amount}]}
+
+    def create(self):
+        response = self.client.post('/api/recipes/', self.payload(),
+                                    format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.data['id']
+
+    def assert_document_is_fresh(self, recipe_id):
+        self.assertEqual(
+            RecipeDocument.objects.get(recipe=recipe_id).data,
+            render_document(Recipe.objects.get(id=recipe_id)),
+        )
+
+    def test_create_writes_document_once(self):
+        with CaptureQueriesContext(connection) as queries:
+            recipe_id = self.create()
+        inserts = [query for query in queries if query['sql'].startswith(
+            'INSERT INTO "recipes_recipedocument"')]
+        self.assertEqual(len(inserts), 1)
+        self.assert_document_is_fresh(recipe_id)
+        self.assertEqual(
+            RecipeDocument.objects.get(recipe=recipe_id).data['tags'][0][
+                'slug'], 'breakfast'
+        )
+
+    def test_document_follows_changes(self):
+        recipe_id = self.create()
+        response = self.client.patch(f'/api/recipes/{recipe_id}/',
+                                     self.payload(amount=250), format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assert_document_is_fresh(recipe_id)
+        self.tag.name = 'Ужин'
+        self.tag.save()
+        self.ingredient.name = 'Сахар'
+        self.ingredient.save()
+        self.assert_document_is_fresh(recipe_id)
+        document = RecipeDocument.objects.get(recipe=recipe_id).data
+        self.assertEqual(document['tags'][0]['name'], 'Ужин')
+        self.assertEqual(document['ingredients'][0]['name'], 'Сахар')
+        self.assertEqual(document['ingredients'][0]['amount'], 250)
+        self.assertEqual(self.client.get(f'/api/recipes/{recipe_id}/').data[
+            'ingredients'][0]['name'], 'Сахар')
+
+
+class RecipeWriteTests(MediaRootMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = FoodgramUser.objects.create(
+            email='user@example.com', username='user',
+            first_name='Имя', last_name='Фамилия',
+        )
+        self.client.force_authenticate(self.user)
+        self.tags = [Tag.objects.create(name=f'Тег {number}',
+                                        slug=f'tag{number}')
+                     for number in range(2)]
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {number}', measurement_unit='г')
+            for number in range(40)
+        )
+        self.ingredients = list(Ingredient.objects.order_by('id'))
+
+    def payload(self, ingredients, tags=None):
+        return {'name': 'Блины', 'text': 'Текст', 'cooking_time': 10,
+                'image': IMAGE,
+                'tags': tags or [tag.id for tag in self.tags],
+                'ingredients': [{'id': ingredient, 'amount': 10}
+                                for ingredient in ingredients]}
+
+    def create(self, payload):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/recipes/', payload,
+                                        format='json')
+        return response, len(queries)
+
+    def test_create_runs_constant_queries(self):
+        ids = [ingredient.id for ingredient in self.ingredients]
+        one, one_queries = self.create(self.payload(ids[:1]))
+        many, many_queries = self.create(self.payload(ids))
+        self.assertEqual((one.status_code, many.status_code), (201, 201))
+        self.assertEqual(one_queries, many_queries)
+        self.assertEqual(len(many.data['ingredients']), 40)
+        self.assertEqual(
+            many.data, self.client.get(f'/api/recipes/{many.data["id"]}/').data
+        )
+        counts = []
+        for ingredients in (ids[:1], ids):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.patch(
+                    f'/api/recipes/{one.data["id"]}/',
+                    self.payload(ingredients), format='json'
+                )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['ingredients']),
+                             len(ingredients))
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_validation_runs_constant_queries(self):
+        ids = [ingredient.id for ingredient in self.ingredients]
+        counts = []
+        for ingredients in (ids[:1], ids):
+            with CaptureQueriesContext(connection) as queries:
+                RecipePostSerializer(
+                    data=self.payload(ingredients),
+                    context={'request': mock.Mock(user=self.user)},
+                ).is_valid(raise_exception=True)
+            counts.append(len(queries))
+        self.assertEqual(counts, [2, 2])
+
+    def test_reports_every_invalid_id(self):
+        ids = [self.ingredients[0].id, 999999, 'x', 999998]
+        response, _ = self.create(
+            self.payload(ids, tags=[self.tags[0].id, 999999, 'x'])
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['tags'], [
+            'Недопустимый первичный ключ "999999" - объект не существует.',
+            'Некорректный тип. Ожидалось значение первичного ключа, '
+            'получен str.',
+        ])
+        self.assertEqual(response.data['ingredients'], [
+            {},
+            {'id': ['Недопустимый первичный ключ "999999" - объект не '
+                    'существует.']},
+            {'id': ['Некорректный тип. Ожидалось значение первичного '
+                    'ключа, получен str.']},
+            {'id': ['Недопустимый первичный ключ "999998" - объект не '
+                    'существует.']},
+        ])
+        self.assertFalse(Recipe.objects.exists())
+
+
+class SparseFieldsTests(APITestCase):
+    def setUp(self):
+        user = FoodgramUser.objects.create(
+            email='user@example.com', username='user',
+            first_name='Имя', last_name='Фамилия',
+        )
+        Recipe.objects.create(author=user, name='Рецепт', text='Текст',
+                              cooking_time=10, image='recipes/image.png')
+        self.client.force_authenticate(user)
+
+    def sql(self, path, fields):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path, {'fields': fields})
+        self.assertEqual(response.status_code, 200)
+        return ' '.join(query['sql'] for query in queries)
+
+    def test_only_requested_flags_are_annotated(self):
+        self.assertNotIn('recipes_favorite',
+                         self.sql('/api/recipes/', 'id,name'))
+        sql = self.sql('/api/recipes/', 'id,is_favorited')
+        self.assertIn('recipes_favorite', sql)
+        self.assertNotIn('recipes_shoppinglist', sql)
+        self.assertNotIn('recipes_subscription',
+                         self.sql('/api/users/', 'id,username'))
+
+
+class MultiGetTests(APITestCase):
+    def setUp(self):
+        user = FoodgramUser.objects.create(
+            email='user@example.com', username='user',
+            first_name='Имя', last_name='Фамилия',
+        )
+        self.ids = [
+            Recipe.objects.create(author=user, name=f'Рецепт {number}',
+                                  text='Текст', cooking_time=10,
+                                  image='recipes/image.png').id
+            for number in range(3)
+        ]
+        Recipe.objects.filter(id=self.ids[2]).update(
+            deleted_at=timezone.now()
+        )
+        self.client.force_authenticate(user)
+
+    def get(self, ids):
+        return self.client.get('/api/recipes/', {'ids': ids})
+
+    def test_keeps_order_and_reports_missing(self):
+        first, second, deleted = self.ids
+        response = self.get(f'{second},{first},{second},999999,{deleted}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([recipe['id'] for recipe in response.data['results']],
+                         [second, first])
+        self.assertEqual(response.data['missing'], [999999, deleted])
+        self.assertEqual(response.data['results'][0]['name'], 'Рецепт 1')
+
+    def test_limits_and_bad_ids(self):
+        ids = ','.join(str(id) for id in range(1, MULTI_GET_MAX_IDS + 1))
+        self.assertEqual(self.get(ids).status_code, 200)
+        self.assertEqual(self.get(f'{ids},{ids},1').status_code, 200)
+        response = self.get(f'{ids},{MULTI_GET_MAX_IDS + 1}')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('errors', response.data)
+        for ids in ('1,x', '1.5', '1;2'):
+            response = self.get(ids)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('errors', response.data)
+
+
+class ToggleTests(APITestCase):
+    def setUp(self):
+        self.user, self.author = [
+            FoodgramUser.objects.create(
+                email=f'{name}@example.com', username=name,
+                first_name='Имя', last_name='Фамилия',
+            )
+            for name in ('user', 'author')
+        ]
+        self.recipe = Recipe.objects.create(
+            author=self.author, name='Рецепт', text='Текст', cooking_time=10,
+            image='recipes/image.png',
+        )
+        self.client.force_authenticate(self.user)
+
+    def test_recipe_relations(self):
+        for relation, model in (('favorite', Favorite),
+                                ('shopping_cart', ShoppingList)):
+            path = f'/api/recipes/{self.recipe.id}/{relation}/'
+            response = self.client.post(path)
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(response.data['id'], self.recipe.id)
+            response = self.client.post(path)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('errors', response.data)
+            self.assertEqual(model.objects.filter(user=self.user).count(), 1)
+            self.assertEqual(self.client.delete(path).status_code, 204)
+            response = self.client.delete(path)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('errors', response.data)
+            self.assertFalse(model.objects.exists())
+            missing = f'/api/recipes/999999/{relation}/'
+            self.assertEqual(self.client.post(missing).status_code, 404)
+            self.assertEqual(self.client.delete(missing).status_code, 404)
+
+    def test_subscribe(self):
+        path = f'/api/users/{self.author.id}/subscribe/'
+        response = self.client.post(path)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['recipes_count'], 1)
+        self.assertTrue(response.data['is_subscribed'])
+        self.assertEqual(self.client.post(path).status_code, 400)
+        self.assertEqual(Subscription.objects.count(), 1)
+        self.assertEqual(self.client.delete(path).status_code, 204)
+        self.assertEqual(self.client.delete(path).status_code, 400)
+        response = self.client.post(f'/api/users/{self.user.id}/subscribe/')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('errors', response.data)
+        self.assertFalse(Subscription.objects.exists())
+        for method in (self.client.post, self.client.delete):
+            self.assertEqual(
+                method('/api/users/999999/subscribe/').status_code, 404
+            )
+
+
+class ListingTests(APITestCase):
+    def setUp(self):
+        user = FoodgramUser.objects.create(
+            email='user@example.com', username='user',
+            first_name='Имя', last_name='Фамилия',
+        )
+        Recipe.objects.bulk_create(
+            Recipe(author=user, name=f'Рецепт {number}', text='Текст',
+                   cooking_time=10, image='recipes/image.png')
+            for number in range(MAX_PAGE_SIZE + 5)
+        )
+        self.client.force_authenticate(user)
+
+    def test_limit_is_capped(self):
+        for limit, size in ((3, 3), (MAX_PAGE_SIZE, MAX_PAGE_SIZE),
+                            (MAX_PAGE_SIZE + 1, MAX_PAGE_SIZE),
+                            (10 ** 6, MAX_PAGE_SIZE)):
+            response = self.client.get('/api/recipes/', {'limit': limit})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['results']), size)
+            self.assertEqual(response.data['count'], MAX_PAGE_SIZE + 5)
+
+    def export(self, **params):
+        response = self.client.get('/api/recipes/export/', params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        body = b''.join(response.streaming_content).decode()
+        self.assertTrue(body.endswith('\n'))
+        return [json.loads(line) for line in body.splitlines()]
+
+    def test_export_streams_ndjson(self):
+        recipes = self.export()
+        self.assertEqual(len(recipes), MAX_PAGE_SIZE + 5)
+        self.assertEqual([recipe['id'] for recipe in recipes],
+                         sorted(Recipe.objects.values_list('id', flat=True)))
+        self.assertEqual(recipes[0], self.client.get(
+            f'/api/recipes/{recipes[0]["id"]}/').data)
+        recipes = self.export(fields='id,name,is_favorited')
+        self.assertEqual(len(recipes), MAX_PAGE_SIZE + 5)
+        self.assertEqual(recipes[0], {'id': recipes[0]['id'],
+                                      'name': 'Рецепт 0',
+                                      'is_favorited': False})
+
+
+class ShoppingCartDownloadTests(APITestCase):
+    def setUp(self):
+        self.users = [
+            FoodgramUser.objects.create(
+                email=f'user{number}@example.com', username=f'user{number}',
+                first_name='Имя', last_name='Фамилия',
+            )
+            for number in range(2)
+        ]
+        self.household = Household.objects.create(name='Дом',
+                                                  author=self.users[0])
+        self.household.members.set(self.users)
+        for user, unit, amount in ((self.users[0], 'кг', 2),
+                                   (self.users[1], 'г', 500)):
+            recipe = Recipe.objects.create(
+                author=user, name='Рецепт', text='Текст', cooking_time=10,
+                image='recipes/image.png',
+            )
+            IngredientInRecipe.objects.create(
+                recipe=recipe, amount=amount,
+                ingredient=Ingredient.objects.create(name='Мука',
+                                                     measurement_unit=unit),
+            )
+            ShoppingList.objects.create(user=user, recipe=recipe)
+        self.client.force_authenticate(self.users[0])
+
+    def download(self, **params):
+        response = self.client.get(
+            '/api/recipes/download_shopping_cart/', params
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode().splitlines()[1:]
+
+    def test_personal_list_keeps_units(self):
+        self.assertEqual(self.download(), ['Мука - 2 (кг)'])
+
+    def test_household_list_normalizes_units(self):
+        self.assertEqual(self.download(household=self.household.id),
+                         ['Мука - 2500 (г)'])
+
+
+class DataExportTests(APITestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(
+            EXPORT_ROOT=os.path.join(directory.name, 'exports'),
+            MEDIA_ROOT=directory.name,
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        os.makedirs(os.path.join(directory.name, 'recipes'))
+        with open(os.path.join(directory.name, 'recipes', 'image.png'),
+                  'wb') as file:
+            file.write(b'png')
+        self.user = FoodgramUser.objects.create(
+            email='user@example.com', username='user',
+            first_name='Имя', last_name='Фамилия',
+        )
+        Recipe.objects.create(author=self.user, name='Рецепт', text='Текст',
+                              cooking_time=10, image='recipes/image.png')
+        self.client.force_authenticate(self.user)
+
+    def export(self):
+        response = self.client.post('/api/users/me/export/')
+        self.assertEqual(response.status_code, 202)
+        return response.data
+
+    def download(self, **headers):
+        return self.client.get('/api/users/me/export/download/', **headers)
+
+    def test_job_lifecycle(self):
+        job = self.export()
+        self.assertIsNone(job['finished_at'])
+        self.assertEqual(self.export()['id'], job['id'])
+        self.assertEqual(self.download().status_code, 404)
+        call_command('exportuserdata', stdout=io.StringIO())
+        status = self.client.get('/api/users/me/export/').data
+        self.assertIsNotNone(status['finished_at'])
+        response = self.download()
+        self.assertEqual(response.status_code, 200)
+        body = b''.join(response.streaming_content)
+        self.assertEqual(len(body), status['size'])
+        with zipfile.ZipFile(io.BytesIO(body)) as archive:
+            self.assertEqual(archive.read('media/recipes/image.png'), b'png')
+            self.assertIn('"Рецепт"',
+                          archive.read('recipes.ndjson').decode())
+        old_path = DataExport.objects.get().path
+        self.assertNotEqual(self.export()['id'], job['id'])
+        call_command('exportuserdata', stdout=io.StringIO())
+        self.assertEqual(DataExport.objects.count(), 1)
+        self.assertFalse(os.path.exists(old_path))
+
+    def test_range_download(self):
+        self.export()
+        call_command('exportuserdata', stdout=io.StringIO())
+        body = b''.join(self.download().streaming_content)
+        response = self.download(HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'],
+                         f'bytes 10-19/{len(body)}')
+        self.assertEqual(b''.join(response.streaming_content), body[10:20])
+        response = self.download(HTTP_RANGE=f'bytes={len(body)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(body)}')
+
+
+@skipIf(connection.vendor == 'postgresql',
+        'Проверяется поведение без LISTEN/NOTIFY')
+class EventsWithoutPostgresTests(SimpleTestCase):
+    def test_stream_is_unavailable(self):
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {'headers': [(b'authorization', b'Token key')],
+                 'query_string': b'', 'path': '/api/events/'}
+        with mock.patch.object(events, 'get_user',
+                               return_value=FoodgramUser(id=1)):
+            asyncio.run(events.events_application(scope, None, send))
+        self.assertEqual(messages[0]['status'], 503)
+        self.assertEqual(events.broker.connection_count, 0)
+
+
+class EventsAuthTests(SimpleTestCase):
+    def call(self, path, query=b'', token=None, method='GET'):
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        headers = [(b'authorization', f'Token {token}'.encode())] if token \
+            else []
+        scope = {'headers': headers, 'query_string': query, 'path': path,
+                 'method': method}
+        asyncio.run(events.events_application(scope, None, send))
+        return messages[0]['status'], messages[1:]
+
+    @mock.patch.object(events, 'get_user', return_value=FoodgramUser(id=1))
+    def test_ticket_replaces_token_in_url(self, get_user):
+        status, messages = self.call('/api/events/ticket/', token='key',
+                                     method='POST')
+        self.assertEqual(status, 200)
+        ticket = json.loads(messages[0]['body'])['ticket']
+        get_user.assert_called_once_with('key')
+        scope = {'headers': [], 'path': '/api/events/',
+                 'query_string': f'ticket={ticket}'.encode()}
+        with mock.patch.object(events, 'get_ticket_user',
+                               return_value=FoodgramUser(id=1)) as get:
+            self.assertEqual(asyncio.run(events.authenticate(scope)).id, 1)
+        get.assert_called_once_with(1)
+        self.assertEqual(
+            self.call('/api/events/', query=b'token=key')[0], 401
+        )
+        self.assertEqual(
+            self.call('/api/events/ticket/',
+                      query=f'ticket={ticket}'.encode(), method='POST')[0],
+            401
+        )
+        self.assertEqual(self.call('/api/events/ticket/', token='key')[0],
+                         405)
+
+    def test_ticket_expires(self):
+        ticket = events.make_ticket(FoodgramUser(id=1))
+        self.assertEqual(events.read_ticket(ticket), 1)
+        self.assertIsNone(events.read_ticket(ticket + 'x'))
+        with mock.patch('time.time',
+                        return_value=time.time() + EVENTS_TICKET_SECONDS + 1):
+            self.assertIsNone(events.read_ticket(ticket))
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Нужен LISTEN/NOTIFY')
+class EventsNotifyTests(TransactionTestCase):
+    def test_notify_reaches_followers(self):
+        import psycopg2
+        from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+        author, follower, stranger = [
+            FoodgramUser.objects.create(
+                email=f'{name}@example.com', username=name,
+                first_name='Имя', last_name='Фамилия',
+            )
+            for name in ('author', 'follower', 'stranger')
+        ]
+        Subscription.objects.create(user=follower, author=author)
+        recipe = Recipe.objects.create(
+            author=author, name='Рецепт', text='Текст', cooking_time=10,
+            image='recipes/image.png',
+        )
+        listener = psycopg2.connect(
+            **connections['default'].get_connection_params()
+        )
+        self.addCleanup(listener.close)
+        listener.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        listener.cursor().execute(f'LISTEN {events.CHANNEL}')
+        events.notify_new_recipe(recipe)
+        self.assertTrue(select.select([listener], [], [], 5)[0])
+        listener.poll()
+        payload = json.loads(listener.notifies.pop(0).payload)
+        self.assertEqual(payload, events.recipe_event(recipe))
+
+        async def deliver():
+            queues = {user: events.broker.connect(user.id)
+                      for user in (follower, stranger)}
+            try:
+                await asyncio.get_running_loop().run_in_executor(
+                    None, events.broker.publish_recipe, payload
+                )
+                await asyncio.sleep(0)
+                return {user: queue.qsize()
+                        for user, queue in queues.items()}
+            finally:
+                for user, queue in queues.items():
+                    events.broker.disconnect(user.id, queue)
+
+        self.assertEqual(asyncio.run(deliver()), {follower: 1, stranger: 0})
+
+
+class ThrottleTests(APITestCase):
+    def test_bucket_refills(self):
+        for _ in range(3):
+            self.assertTrue(take_tokens('bucket', 3, 1, 1, 100.0)[1])
+        self.assertEqual(take_tokens('bucket', 3, 1, 2, 100.0), (0, False))
+        self.assertEqual(take_tokens('bucket', 3, 1, 2, 102.5), (0.5, True))
+        self.assertEqual(take_tokens('bucket', 3, 1, 1, 1000.0), (2, True))
+
+    def test_requests_over_limit_are_rejected(self):
+        with mock.patch.dict(throttling.CostThrottle.THROTTLE_RATES,
+                             {'anon': '2/min'}):
+            statuses = [self.client.get('/api/tags/').status_code
+                        for _ in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+
+    def test_prune_keeps_partial_buckets(self):
+        now = throttling.CostThrottle().timer()
+        ThrottleBucket.objects.create(key='old', tokens=0, updated=now - 3600,
+                                      allowed=True)
+        ThrottleBucket.objects.create(key='new', tokens=0, updated=now,
+                                      allowed=True)
+        self.assertEqual(throttling.prune(), 1)
+        self.assertEqual(
+            list(ThrottleBucket.objects.values_list('key', flat=True)),
+            ['new'],
+        )
+
+
+@skipUnless(connection.vendor == 'postgresql',
+            'Параллельные соединения проверяются на PostgreSQL')
+class ConcurrentThrottleTests(TransactionTestCase):
+    def take(self, _):
+        try:
+            return take_tokens('bucket', 10, 0.001, 1, 100.0)[1]
+        finally:
+            connections.close_all()
+
+    def test_concurrent_requests_do_not_overshoot(self):
+        with ThreadPoolExecutor(8) as executor:
+            allowed = list(executor.map(self.take, range(40)))
+        self.assertEqual(allowed.count(True), 10)
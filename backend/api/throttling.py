@@ -0,0 +1,73 @@
+import math
+
+from rest_framework.throttling import SimpleRateThrottle
+
+from api import metrics
+from recipes.db import take_tokens
+from recipes.models import ThrottleBucket
+
+
+class CostThrottle(SimpleRateThrottle):
+    """Корзина токенов на пользователя или IP-адрес в базе данных.
+
+    Корзина обновляется одним атомарным запросом, поэтому параллельные
+    запросы всех воркеров не превышают лимит.
+
+    Частота из DEFAULT_THROTTLE_RATES задаёт ёмкость корзины и скорость
+    её наполнения. Действие стоит столько токенов, сколько указано
+    в throttle_costs представления, а список ещё и пропорционально
+    размеру запрошенной страницы.
+    """
+
+    def __init__(self):
+        # Частота зависит от того, вошёл ли пользователь, и выбирается
+        # в allow_request.
+        pass
+
+    def get_cost(self, request, view):
+        cost = getattr(view, 'throttle_costs', {}).get(
+            getattr(view, 'action', None), 1
+        )
+        paginator = getattr(view, 'paginator', None)
+        if (getattr(view, 'action', None) == 'list' and paginator
+                and paginator.page_size):
+            page_size = paginator.get_page_size(request) or 1
+            cost *= math.ceil(page_size / paginator.page_size)
+        return cost
+
+    def get_cache_key(self, request, view):
+        if request.user.is_authenticated:
+            ident = request.user.pk
+        else:
+            ident = self.get_ident(request)
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
+
+    def allow_request(self, request, view):
+        self.scope = 'user' if request.user.is_authenticated else 'anon'
+        self.rate = self.get_rate()
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+        refill = self.num_requests / self.duration
+        key = self.get_cache_key(request, view)
+        cost = min(self.get_cost(request, view), self.num_requests)
+        tokens, allowed = take_tokens(key, self.num_requests, refill, cost,
+                                      self.timer())
+        if not allowed:
+            self.retry_after = (cost - tokens) / refill
+            metrics.increment(f'throttle.rejected.{self.scope}')
+        return allowed
+
+    def wait(self):
+        return self.retry_after
+
+
+def prune():
+    """Удаляет корзины, которые успели наполниться до ёмкости.
+
+    Такая корзина ничем не отличается от отсутствующей.
+    """
+    throttle = CostThrottle()
+    duration = max(throttle.parse_rate(rate)[1]
+                   for rate in throttle.THROTTLE_RATES.values() if rate)
+    return ThrottleBucket.objects.filter(
+        updated__lt=throttle.timer() - duration
+    ).delete()[0]
@@ -1,28 +1,50 @@
+import json
+from itertools import islice
+
 from django.contrib.auth import get_user_model
 from django.db import transaction
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.db.models import (BigIntegerField, Case, Count, Exists, F,
+                              OuterRef, Prefetch, Q, Sum, Value, When,
+                              prefetch_related_objects)
+from django.db.models.functions import Cast, Greatest
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.permissions import CurrentUserOrAdmin
+from djoser.utils import logout_user
 from djoser.views import UserViewSet
 from rest_framework import filters, status, viewsets
 from rest_framework.decorators import action
-from rest_framework.exceptions import ValidationError
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from urlshortner.utils import shorten_url
 
+from api import bundles, metrics
 from api.filters import RecipeFilter
-from api.paginators import PageNumberLimitPagination
+from api.mixins import MultiGetMixin, SparseFieldsViewMixin
+from api.paginators import ChangesPagination, PageNumberLimitPagination
 from api.permissions import IsAuthorOrReadOnly
-from api.serializers import (AvatarSerializer, FavoriteSerializer,
-                             IngredientSerializer, RecipeGetSerializer,
-                             RecipePostSerializer, ShoppingListSerializer,
-                             SubscriptionGetSerializer,
-                             SubscriptionPostSerializer, TagSerializer)
-from recipes.models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
-                            ShoppingList, Tag)
+from api.responses import range_file_response
+from api.serializers import (AvatarSerializer, ChangesSerializer,
+                             DataExportSerializer, HouseholdJoinSerializer,
+                             HouseholdSerializer, IngredientSerializer,
+                             PantryRecipeSerializer,
+                             RecipeDocumentReadSerializer, RecipeGetSerializer,
+                             RecipePostSerializer, RecipeShortSerializer,
+                             ShoppingCartDownloadSerializer,
+                             ShoppingCartSerializer, SubscriptionGetSerializer,
+                             TagSerializer, annotate_user_flags)
+from recipes import trending
+from recipes.constants import (EXPORT_CHUNK_SIZE, PANTRY_MIN_COVERAGE,
+                               SIMILAR_RECIPES_LIMIT, UNIT_CONVERSIONS)
+from recipes.db import delete_returning, insert_or_ignore
+from recipes.index import recipe_index
+from recipes.models import (DataExport, Favorite, Ingredient,
+                            IngredientInRecipe, Recipe, ShoppingList,
+                            Subscription, Tag, Tombstone)
+from recipes.purge import soft_delete
 
 User = get_user_model()
 
@@ -39,45 +61,188 @@ class TagViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = TagSerializer
 
 
-class FoodgramUserViewSet(UserViewSet):
+class HouseholdViewSet(viewsets.ModelViewSet):
+    serializer_class = HouseholdSerializer
+    permission_classes = [IsAuthenticated, IsAuthorOrReadOnly]
+    http_method_names = ['get', 'post', 'patch', 'delete']
+
+    def get_queryset(self):
+        return self.request.user.households.prefetch_related(
+            Prefetch('members', queryset=User.objects.only('id'))
+        )
+
+    def perform_create(self, serializer):
+        serializer.save(author=self.request.user)
+
+    @action(detail=False, methods=['post'],
+            permission_classes=[IsAuthenticated])
+    def join(self, request):
+        serializer = HouseholdJoinSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        household = serializer.validated_data['code']
+        household.members.add(request.user)
+        return Response(self.get_serializer(household).data)
+
+    @action(detail=True, methods=['post'],
+            permission_classes=[IsAuthenticated])
+    def leave(self, request, pk=None):
+        household = self.get_object()
+        if household.author == request.user:
+            raise ValidationError({'errors': [
+                'Создатель не может выйти из списка, его можно только удалить'
+            ]})
+        household.members.remove(request.user)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class BundleViewSet(viewsets.ViewSet):
+    permission_classes = [AllowAny]
+
+    def list(self, request):
+        return Response(bundles.read_manifest() or bundles.publish())
+
+
+class MetricsViewSet(viewsets.ViewSet):
+    """Счётчики ответившего воркера: каждый процесс считает своё."""
+
+    permission_classes = [IsAdminUser]
+
+    def list(self, request):
+        return Response(metrics.snapshot())
+
+
+def subscribed_authors(user):
+    return set(user.subscriptions.values_list('author_id', flat=True))
+
+
+class ChangesViewSet(viewsets.ViewSet):
+    throttle_costs = {'list': 10}
+
+    def list(self, request):
+        serializer = ChangesSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        paginator = ChangesPagination(request,
+                                      serializer.validated_data.get('since'))
+        since = paginator.since
+        context = {'request': request}
+        if request.user.is_authenticated:
+            context['subscribed_authors'] = subscribed_authors(request.user)
+        kinds = (
+            ('recipes',
+             annotate_user_flags(Recipe.objects.annotate(
+                 document_data=F('document__data')
+             ), request.user),
+             RecipeDocumentReadSerializer),
+            ('tags', Tag.objects.all(), TagSerializer),
+            ('ingredients', Ingredient.objects.all(), IngredientSerializer),
+        )
+        streams = []
+        for _, queryset, _ in kinds:
+            deleted = Tombstone.objects.filter(
+                model=queryset.model._meta.model_name
+            )
+            if since:
+                queryset = queryset.filter(updated_at__gte=since)
+                deleted = deleted.filter(deleted_at__gte=since)
+            else:
+                deleted = deleted.none()
+            streams += [(queryset, 'updated_at'), (deleted, 'deleted_at')]
+        pages = iter(paginator.paginate(streams))
+        changes = {'token': paginator.token,
+                   'next': paginator.get_next_link()}
+        for name, _, serializer_class in kinds:
+            updated, deleted = next(pages), next(pages)
+            changes[name] = {
+                'updated': serializer_class(updated, many=True,
+                                            context=context).data,
+                'deleted': [tombstone.object_id for tombstone in deleted],
+            }
+        return Response(changes)
+
+
+class FoodgramUserViewSet(MultiGetMixin, SparseFieldsViewMixin,
+                          UserViewSet):
     pagination_class = PageNumberLimitPagination
     http_method_names = ['get', 'post', 'put', 'delete']
+    throttle_costs = {'me_export': 10, 'me_export_download': 10}
+
+    def get_queryset(self):
+        queryset = super().get_queryset().filter(is_active=True)
+        if self.action not in ('list', 'retrieve'):
+            return queryset
+        fields = self.requested_fields('fields')
+        if fields is not None:
+            queryset = queryset.only('id', *fields.intersection(
+                ('email', 'username', 'first_name', 'last_name', 'avatar')
+            ))
+        if self.request.user.is_authenticated and (
+                fields is None or 'is_subscribed' in fields):
+            queryset = queryset.annotate(is_subscribed=Exists(
+                Subscription.objects.filter(user=self.request.user,
+                                            author=OuterRef('pk'))
+            ))
+        return queryset
 
     def get_permissions(self):
         if self.action == 'me':
             self.permission_classes = [CurrentUserOrAdmin]
         return super().get_permissions()
 
+    def perform_destroy(self, instance):
+        if instance == self.request.user:
+            logout_user(self.request)
+        soft_delete(instance)
+
     @action(detail=True,
             methods=['post', 'delete'],
             permission_classes=[IsAuthenticated]
             )
     @transaction.atomic
     def subscribe(self, request, id):
-        author = get_object_or_404(User, pk=id)
         if request.method == 'POST':
-            serializer = SubscriptionPostSerializer(
-                data={'author': author.id}, context={'request': request}
+            author = get_object_or_404(
+                User.objects.annotate(recipes_count=Count(
+                    'recipes', filter=Q(recipes__deleted_at__isnull=True)
+                )),
+                pk=id, is_active=True,
+            )
+            if author == request.user:
+                raise ValidationError(
+                    {'errors': ['Вы не можете подписаться на себя!']}
+                )
+            if not insert_or_ignore(Subscription, user=request.user,
+                                    author=author):
+                raise ValidationError(
+                    {'errors': [f'Вы уже подписаны на {author}!']}
+                )
+            author.is_subscribed = True
+            serializer = SubscriptionGetSerializer(
+                author, context={'request': request}
             )
-            serializer.is_valid(raise_exception=True)
-            serializer.save()
             return Response(serializer.data, status=status.HTTP_201_CREATED)
-        instance = request.user.subscriptions.filter(author=author)
-        if instance.exists():
-            instance.delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
-        raise ValidationError({'errors': f'Вы не подписаны на {author}!'})
+        deleted, _ = request.user.subscriptions.filter(author=id).delete()
+        if not deleted:
+            author = get_object_or_404(User, pk=id, is_active=True)
+            raise ValidationError({'errors': f'Вы не подписаны на {author}!'})
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(detail=False,
             permission_classes=[IsAuthenticated])
     def subscriptions(self, request):
         paginated_subscriptions = self.paginate_queryset(
-            User.objects.filter(subscribers__user=self.request.user)
+            User.objects.filter(
+                subscribers__user=self.request.user, is_active=True
+            ).annotate(
+                is_subscribed=Value(True),
+                recipes_count=Count(
+                    'recipes', filter=Q(recipes__deleted_at__isnull=True)
+                ),
+            )
         )
         serializer = SubscriptionGetSerializer(
             paginated_subscriptions,
             many=True,
-            context={'request': request},
+            context=self.get_serializer_context(),
         )
         return self.get_paginated_response(serializer.data)
 
@@ -103,35 +268,125 @@ class FoodgramUserViewSet(UserViewSet):
             {'avatar': request.user.avatar.url}, status=status.HTTP_200_OK
         )
 
+    @action(methods=['get', 'post'],
+            detail=False,
+            permission_classes=[CurrentUserOrAdmin],
+            url_path='me/export',
+            url_name='me-export',
+            )
+    def me_export(self, request):
+        if request.method == 'POST':
+            job = request.user.data_exports.filter(
+                finished_at__isnull=True
+            ).first() or DataExport.objects.create(user=request.user)
+            return Response(DataExportSerializer(job).data,
+                            status=status.HTTP_202_ACCEPTED)
+        job = request.user.data_exports.first()
+        if job is None:
+            raise NotFound('Выгрузка данных не запрашивалась.')
+        return Response(DataExportSerializer(job).data)
+
+    @action(detail=False,
+            permission_classes=[CurrentUserOrAdmin],
+            url_path='me/export/download',
+            url_name='me-export-download',
+            )
+    def me_export_download(self, request):
+        job = request.user.data_exports.filter(
+            finished_at__isnull=False
+        ).first()
+        if job is None:
+            raise NotFound('Готовой выгрузки данных нет.')
+        return range_file_response(
+            request, job.path, f'foodgram-{job.created_at:%Y-%m-%d}.zip',
+            'application/zip',
+        )
+
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(MultiGetMixin, SparseFieldsViewMixin,
+                    viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
     pagination_class = PageNumberLimitPagination
     permission_classes = [IsAuthorOrReadOnly]
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
     http_method_names = ['get', 'post', 'patch', 'delete']
+    throttle_costs = {'export': 100, 'download_shopping_cart': 20,
+                      'get_link': 10, 'pantry': 5, 'similar': 2}
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action not in ('list', 'retrieve', 'export'):
+            return queryset
+        fields = self.requested_fields('fields')
+        queryset = annotate_user_flags(queryset, self.request.user, fields)
+        if fields is None:
+            return queryset.annotate(document_data=F('document__data'))
+        expand = self.requested_fields('expand') or set()
+        queryset = queryset.only('id', *fields.intersection(
+            ('name', 'image', 'text', 'cooking_time', 'author')
+        ))
+        if 'author' in fields & expand:
+            queryset = queryset.select_related('author')
+        if 'tags' in fields:
+            queryset = queryset.prefetch_related('tags')
+        if 'ingredients' in fields:
+            queryset = queryset.prefetch_related(
+                'ingridients_in_recipe__ingredient'
+                if 'ingredients' in expand else 'ingredients'
+            )
+        return queryset
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        user = self.request.user
+        if (self.action in ('list', 'retrieve', 'export')
+                and user.is_authenticated
+                and (context['fields'] is None
+                     or 'author' in context['fields'] & context['expand'])):
+            context['subscribed_authors'] = subscribed_authors(user)
+        return context
 
     def get_serializer_class(self):
-        if self.action in ['list', 'retrieve']:
+        if self.action in ['list', 'retrieve', 'export']:
+            if self.requested_fields('fields') is None:
+                return RecipeDocumentReadSerializer
             return RecipeGetSerializer
         return RecipePostSerializer
 
-    def recipe_relation(self, request, pk, serializer, model):
-        recipe = get_object_or_404(Recipe, id=pk)
+    def perform_destroy(self, instance):
+        soft_delete(instance)
+
+    def recipe_relation(self, request, pk, model, **values):
         if request.method == 'POST':
-            serializer = serializer(
-                data={'recipe': recipe.id, 'user': request.user.id},
-                context={'request': request},
+            recipe = get_object_or_404(
+                Recipe.objects.only('id', 'name', 'image', 'cooking_time'),
+                id=pk,
+            )
+            if not insert_or_ignore(model, user=request.user, recipe=recipe,
+                                    **values):
+                raise ValidationError({'errors': [
+                    f'Рецепт уже добавлен в {model._meta.verbose_name}!'
+                ]})
+            Recipe.objects.filter(id=recipe.id).update(
+                trending_score=F('trending_score') + model.trending_weight
             )
-            serializer.is_valid(raise_exception=True)
-            serializer.save()
+            serializer = RecipeShortSerializer(recipe,
+                                               context={'request': request})
             return Response(serializer.data, status=status.HTTP_201_CREATED)
-        instance = model.objects.filter(recipe=recipe, user=request.user)
-        if instance.exists():
-            instance.delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
-        raise ValidationError({'errors': f'Рецепт не был добавлен в {model}'})
+        deleted = delete_returning(model, 'added_at', recipe=pk,
+                                   user=request.user.id)
+        if not deleted:
+            get_object_or_404(Recipe, id=pk)
+            raise ValidationError(
+                {'errors': f'Рецепт не был добавлен в {model}'}
+            )
+        # Вычитается только то, что осталось от вклада после затухания.
+        Recipe.objects.filter(id=pk).update(trending_score=Greatest(
+            F('trending_score')
+            - trending.contribution(model, deleted[0], timezone.now()), 0
+        ))
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(detail=True,
             methods=['post', 'delete'],
@@ -139,27 +394,65 @@ class RecipeViewSet(viewsets.ModelViewSet):
             )
     @transaction.atomic
     def favorite(self, request, pk=None):
-        return self.recipe_relation(request, pk, FavoriteSerializer, Favorite)
+        return self.recipe_relation(request, pk, Favorite)
 
     @action(detail=True,
-            methods=['post', 'delete'],
+            methods=['post', 'patch', 'delete'],
             permission_classes=[IsAuthenticated],
             )
     @transaction.atomic
     def shopping_cart(self, request, pk=None):
-        return self.recipe_relation(
-            request, pk, ShoppingListSerializer, ShoppingList
-        )
+        if request.method == 'DELETE':
+            return self.recipe_relation(request, pk, ShoppingList)
+        serializer = ShoppingCartSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if request.method == 'POST':
+            return self.recipe_relation(request, pk, ShoppingList,
+                                        **serializer.validated_data)
+        if not ShoppingList.objects.filter(
+                user=request.user, recipe=pk
+        ).update(**serializer.validated_data):
+            get_object_or_404(Recipe, id=pk)
+            raise ValidationError(
+                {'errors': 'Рецепт не был добавлен в список покупок'}
+            )
+        return Response(serializer.data)
 
     @action(detail=False, permission_classes=[IsAuthenticated])
     def download_shopping_cart(self, request):
-        shopping_list = IngredientInRecipe.objects.filter(
-            recipe__shopping_list__user=request.user
-        ).values_list(
-            'ingredient__name', 'ingredient__measurement_unit'
-        ).annotate(
-            total_amount=Sum('amount')
+        serializer = ShoppingCartDownloadSerializer(
+            data=request.query_params, context={'request': request}
         )
+        serializer.is_valid(raise_exception=True)
+        household = serializer.validated_data.get('household')
+        unit = F('ingredient__measurement_unit')
+        factor = Value(1)
+        if household is None:
+            lookup = {'recipe__shopping_list__user': request.user}
+        else:
+            # В общем списке одни продукты могут быть указаны в разных
+            # единицах, поэтому они приводятся к меньшей.
+            lookup = {'recipe__shopping_list__user__households': household}
+            unit = Case(
+                *(When(ingredient__measurement_unit=source,
+                       then=Value(target))
+                  for source, (target, _) in UNIT_CONVERSIONS.items()),
+                default=unit,
+            )
+            factor = Case(
+                *(When(ingredient__measurement_unit=source,
+                       then=Value(multiplier))
+                  for source, (_, multiplier) in UNIT_CONVERSIONS.items()),
+                default=factor,
+            )
+        shopping_list = IngredientInRecipe.objects.filter(
+            recipe__deleted_at__isnull=True, **lookup
+        ).annotate(unit=unit).values_list(
+            'ingredient__name', 'unit'
+        ).annotate(total_amount=Sum(
+            Cast('amount', BigIntegerField())
+            * F('recipe__shopping_list__servings') * factor
+        )).order_by('ingredient__name', 'unit')
         data = 'Список покупок:\n'
         for name, measurement_unit, total_amount in shopping_list:
             data += f'{name} - {total_amount} ({measurement_unit})\n'
@@ -168,6 +461,69 @@ class RecipeViewSet(viewsets.ModelViewSet):
             'Content-Disposition': 'attachment; filename="shopping_list.txt"'
         })
 
+    def export_lines(self, queryset, context):
+        prefetch = queryset._prefetch_related_lookups
+        recipes = queryset.prefetch_related(None).order_by('id').iterator(
+            chunk_size=EXPORT_CHUNK_SIZE
+        )
+        serializer = self.get_serializer_class()(context=context)
+        while True:
+            chunk = list(islice(recipes, EXPORT_CHUNK_SIZE))
+            if not chunk:
+                return
+            prefetch_related_objects(chunk, *prefetch)
+            for recipe in chunk:
+                yield json.dumps(serializer.to_representation(recipe),
+                                 ensure_ascii=False) + '\n'
+
+    @action(detail=False, permission_classes=[IsAuthenticated])
+    def export(self, request):
+        return StreamingHttpResponse(
+            self.export_lines(self.filter_queryset(self.get_queryset()),
+                              self.get_serializer_context()),
+            content_type='application/x-ndjson',
+            headers={'Content-Disposition':
+                     'attachment; filename="recipes.ndjson"'},
+        )
+
+    @action(detail=True)
+    def similar(self, request, pk=None):
+        recipe = get_object_or_404(Recipe, id=pk)
+        similar_ids = recipe_index.similar(recipe.id, SIMILAR_RECIPES_LIMIT)
+        recipes = Recipe.objects.in_bulk(similar_ids)
+        serializer = RecipeShortSerializer(
+            [recipes[id] for id in similar_ids if id in recipes],
+            many=True,
+            context={'request': request},
+        )
+        return Response(serializer.data)
+
+    @action(detail=False)
+    def pantry(self, request):
+        try:
+            ingredients = [
+                int(ingredient)
+                for ingredient in request.query_params.getlist('ingredients')
+            ]
+            min_coverage = float(request.query_params.get(
+                'min_coverage', PANTRY_MIN_COVERAGE
+            ))
+        except ValueError:
+            raise ValidationError(
+                {'errors': 'Ингредиенты и доля совпадения задаются числами'}
+            )
+        page = self.paginate_queryset(
+            recipe_index.pantry(ingredients, min_coverage)
+        )
+        coverage = dict(page)
+        recipes = Recipe.objects.in_bulk(coverage)
+        serializer = PantryRecipeSerializer(
+            [recipes[id] for id in coverage if id in recipes],
+            many=True,
+            context={'request': request, 'coverage': coverage},
+        )
+        return self.get_paginated_response(serializer.data)
+
     @action(detail=True, url_path='get-link')
     def get_link(self, request, pk=None):
         get_object_or_404(Recipe, id=pk)
@@ -0,0 +1,89 @@
+import fcntl
+import os
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.http import JsonResponse
+
+from api import metrics
+
+
+class AdmissionMiddleware:
+    """Ограничивает число одновременно выполняемых запросов к API.
+
+    Слоты — файлы с блокировкой flock в общем каталоге, поэтому лимит
+    действует на все процессы на машине, а слот упавшего воркера
+    освобождается сам. Если свободного слота нет дольше
+    ADMISSION_TIMEOUT, запрос отклоняется с кодом 503.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.lock = threading.Lock()
+        self.free = set(range(settings.ADMISSION_MAX_REQUESTS))
+        self.files = {}
+        os.makedirs(settings.ADMISSION_LOCK_DIR, exist_ok=True)
+        metrics.register_gauge(
+            'admission.busy',
+            lambda: settings.ADMISSION_MAX_REQUESTS - len(self.free)
+        )
+
+    def try_acquire(self):
+        with self.lock:
+            slots = list(self.free)
+        random.shuffle(slots)
+        for slot in slots:
+            with self.lock:
+                if slot not in self.free:
+                    continue
+                self.free.discard(slot)
+                if slot not in self.files:
+                    self.files[slot] = open(os.path.join(
+                        settings.ADMISSION_LOCK_DIR, f'{slot}.lock'
+                    ), 'w')
+            try:
+                fcntl.flock(self.files[slot], fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return slot
+            except BlockingIOError:
+                with self.lock:
+                    self.free.add(slot)
+        return None
+
+    def acquire(self):
+        deadline = time.monotonic() + settings.ADMISSION_TIMEOUT
+        while True:
+            slot = self.try_acquire()
+            if slot is not None or time.monotonic() >= deadline:
+                return slot
+            time.sleep(random.uniform(0.005, 0.02))
+
+    def release(self, slot):
+        fcntl.flock(self.files[slot], fcntl.LOCK_UN)
+        with self.lock:
+            self.free.add(slot)
+
+    def __call__(self, request):
+        if not request.path.startswith('/api/'):
+            return self.get_response(request)
+        slot = self.acquire()
+        if slot is None:
+            metrics.increment('admission.rejected')
+            return JsonResponse(
+                {'detail': 'Сервер перегружен, повторите запрос позже.'},
+                status=503,
+                headers={'Retry-After': str(settings.ADMISSION_RETRY_AFTER)},
+            )
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            self.release(slot)
+            raise
+        if response.streaming:
+            # Тело потокового ответа формируется уже после выхода из
+            # middleware, поэтому слот держится до закрытия ответа.
+            response._resource_closers.append(lambda: self.release(slot))
+        else:
+            self.release(slot)
+        return response
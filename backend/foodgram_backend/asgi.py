@@ -13,4 +13,12 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram_backend.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from api.events import events_application  # noqa: E402
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and scope['path'].startswith('/api/events/'):
+        return await events_application(scope, receive, send)
+    return await django_application(scope, receive, send)
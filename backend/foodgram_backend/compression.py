@@ -0,0 +1,111 @@
+import hashlib
+import zlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/x-ndjson',
+                      'application/javascript')
+
+
+def compressor(encoding):
+    if encoding == 'br':
+        stream = brotli.Compressor(quality=settings.BROTLI_QUALITY)
+        return stream.process, stream.finish
+    stream = zlib.compressobj(settings.GZIP_LEVEL, zlib.DEFLATED, 31)
+    return stream.compress, stream.flush
+
+
+def compress(content, encoding):
+    process, finish = compressor(encoding)
+    return process(content) + finish()
+
+
+def compress_stream(chunks, encoding):
+    process, finish = compressor(encoding)
+    for chunk in chunks:
+        data = process(chunk)
+        if data:
+            yield data
+    yield finish()
+
+
+class CompressionMiddleware:
+    """Сжимает ответы в brotli или gzip в зависимости от Accept-Encoding.
+
+    Сжатые тела кешируемых анонимных ответов хранятся в кеше по хешу
+    содержимого, чтобы одна и та же страница не сжималась повторно.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def negotiate(self, request):
+        accepted = {}
+        for item in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+            name, _, params = item.strip().partition(';')
+            quality = params.strip().partition('q=')[2]
+            try:
+                accepted[name.strip().lower()] = float(quality or 1)
+            except ValueError:
+                continue
+        for encoding in ('br', 'gzip'):
+            if encoding == 'br' and brotli is None:
+                continue
+            if accepted.get(encoding, 0) > 0:
+                return encoding
+        return None
+
+    def is_cacheable(self, request, response):
+        return (
+            request.method in ('GET', 'HEAD')
+            and response.status_code == 200
+            and 'HTTP_AUTHORIZATION' not in request.META
+            and not response.cookies
+            and 'private' not in response.get('Cache-Control', '')
+            and 'no-store' not in response.get('Cache-Control', '')
+        )
+
+    def compress_content(self, request, response, encoding):
+        if not self.is_cacheable(request, response):
+            return compress(response.content, encoding)
+        key = (f'compressed:{encoding}:'
+               f'{hashlib.sha256(response.content).hexdigest()}')
+        content = cache.get(key)
+        if content is None:
+            content = compress(response.content, encoding)
+            cache.set(key, content, settings.COMPRESSION_CACHE_SECONDS)
+        return content
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if (response.has_header('Content-Encoding')
+                or not response.get('Content-Type', '').startswith(
+                    COMPRESSIBLE_TYPES)):
+            return response
+        if not response.streaming and (
+                len(response.content) < settings.COMPRESSION_MIN_SIZE):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = self.negotiate(request)
+        if encoding is None:
+            return response
+        if response.streaming:
+            response.streaming_content = compress_stream(
+                response.streaming_content, encoding
+            )
+            del response['Content-Length']
+        else:
+            content = self.compress_content(request, response, encoding)
+            if len(content) >= len(response.content):
+                return response
+            response.content = content
+            response['Content-Length'] = str(len(content))
+        response['Content-Encoding'] = encoding
+        return response
@@ -0,0 +1,70 @@
+import random
+from contextvars import ContextVar
+from hashlib import sha256
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.permissions import SAFE_METHODS
+
+# Реплика, выбранная для текущего запроса, или None для основной базы.
+read_alias = ContextVar('read_alias', default=None)
+
+
+def pin_key(request):
+    client = (request.META.get('HTTP_AUTHORIZATION')
+              or request.META.get('REMOTE_ADDR', ''))
+    return 'replica-pin:' + sha256(client.encode()).hexdigest()
+
+
+def reset(token):
+    try:
+        read_alias.reset(token)
+    except ValueError:
+        # close() вызван в другом контексте, например под ASGI.
+        read_alias.set(None)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+
+class ReplicaRoutingMiddleware:
+    """Отправляет безопасные запросы к API на реплики.
+
+    Реплика выбирается одна на весь запрос, чтобы его чтения были
+    согласованы. После записи клиент закрепляется за основной базой на
+    REPLICA_PIN_SECONDS, чтобы сразу видеть свои изменения.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not request.path.startswith('/api/'):
+            return self.get_response(request)
+        key = pin_key(request)
+        safe = request.method in SAFE_METHODS
+        alias = None
+        if safe and settings.DATABASE_REPLICAS and not cache.get(key):
+            alias = random.choice(settings.DATABASE_REPLICAS)
+        token = read_alias.set(alias)
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            read_alias.reset(token)
+            raise
+        if not safe and response.status_code < 400:
+            cache.set(key, True, settings.REPLICA_PIN_SECONDS)
+        if response.streaming:
+            # Тело читает базу уже после возврата из middleware.
+            response._resource_closers.append(lambda: reset(token))
+        else:
+            reset(token)
+        return response
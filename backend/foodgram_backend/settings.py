@@ -1,4 +1,5 @@
 import os
+import tempfile
 from pathlib import Path
 
 from django.core.management.utils import get_random_secret_key
@@ -34,6 +35,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'foodgram_backend.admission.AdmissionMiddleware',
+    'foodgram_backend.compression.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     # 'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -41,6 +44,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'foodgram_backend.db_router.ReplicaRoutingMiddleware',
 ]
 
 # CORS_ORIGIN_ALLOW_ALL = True
@@ -78,6 +82,48 @@ DATABASES = {
     }
 }
 
+# Реплики задаются списком host[:port][/name] через запятую.
+DATABASE_REPLICAS = []
+
+for number, replica in enumerate(
+        filter(None, os.getenv('DB_REPLICAS', '').split(',')), start=1):
+    address, _, name = replica.partition('/')
+    host, _, port = address.partition(':')
+    alias = f'replica_{number}'
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'HOST': host or DATABASES['default']['HOST'],
+        'PORT': port or DATABASES['default']['PORT'],
+        'NAME': name or DATABASES['default']['NAME'],
+        # В тестах реплика читает тестовую базу основного подключения.
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['foodgram_backend.db_router.ReplicaRouter']
+
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', 10))
+
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSION_CACHE_SECONDS = 60 * 60
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+ADMISSION_MAX_REQUESTS = int(os.getenv('ADMISSION_MAX_REQUESTS', 16))
+ADMISSION_TIMEOUT = float(os.getenv('ADMISSION_TIMEOUT', 0.5))
+ADMISSION_RETRY_AFTER = 1
+ADMISSION_LOCK_DIR = os.getenv(
+    'ADMISSION_LOCK_DIR',
+    os.path.join(tempfile.gettempdir(), 'foodgram-admission')
+)
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('CACHE_LOCATION', BASE_DIR / 'cache'),
+    }
+}
+
 
 AUTH_USER_MODEL = 'recipes.FoodgramUser'
 
@@ -120,6 +166,30 @@ STATIC_ROOT = BASE_DIR / 'collected_static'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+DEFAULT_FILE_STORAGE = 'foodgram_backend.storage.ContentAddressedStorage'
+
+RECIPE_INDEX_PATH = os.getenv('RECIPE_INDEX_PATH',
+                              BASE_DIR / 'index' / 'recipes.pickle')
+
+EXPORT_ROOT = os.getenv('EXPORT_ROOT', BASE_DIR / 'exports')
+
+BUNDLE_ROOT = os.getenv('BUNDLE_ROOT', BASE_DIR / 'bundles')
+BUNDLE_URL = '/bundles/'
+
+# Сколько дней хранить записи списка покупок и избранного до переноса
+# в архив; 0 — хранить всегда.
+SHOPPING_LIST_RETENTION_DAYS = int(
+    os.getenv('SHOPPING_LIST_RETENTION_DAYS', 60)) or None
+FAVORITE_RETENTION_DAYS = int(os.getenv('FAVORITE_RETENTION_DAYS', 0)) or None
+RELATION_ARCHIVE_RETENTION_DAYS = int(
+    os.getenv('RELATION_ARCHIVE_RETENTION_DAYS', 0)) or None
+RELATION_ARCHIVE_PARTITIONED = os.getenv(
+    'RELATION_ARCHIVE_PARTITIONED', 'false').lower() == 'true'
+
+# Сколько дней ленте изменений помнить удалённые объекты. Клиент с более
+# старым токеном должен начать синхронизацию заново.
+TOMBSTONE_RETENTION_DAYS = int(os.getenv('TOMBSTONE_RETENTION_DAYS', 30))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
@@ -134,6 +204,15 @@ REST_FRAMEWORK = {
         'rest_framework.authentication.TokenAuthentication',
     ],
 
+    'DEFAULT_THROTTLE_CLASSES': [
+        'api.throttling.CostThrottle',
+    ],
+
+    'DEFAULT_THROTTLE_RATES': {
+        'user': os.getenv('THROTTLE_USER_RATE', '300/min'),
+        'anon': os.getenv('THROTTLE_ANON_RATE', '120/min'),
+    },
+
     'SEARCH_PARAM': 'name'
 }
 
@@ -0,0 +1,43 @@
+import hashlib
+import os
+import re
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+HASHED_NAME = re.compile(r'(^|/)[0-9a-f]{2}/[0-9a-f]{64}(\.\w+)?$')
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранит файлы под именем из хеша содержимого.
+
+    Одинаковые загрузки попадают в один файл, поэтому раздавать их можно
+    с неограниченным сроком кеширования.
+    """
+
+    def hashed_name(self, name, content):
+        digest = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        digest = digest.hexdigest()
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        return os.path.join(directory, digest[:2], digest + extension)
+
+    def is_hashed(self, name):
+        return HASHED_NAME.search(name) is not None
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.hashed_name(name, content)
+        if self.exists(name):
+            # Обновляем mtime, чтобы cleanmedia --grace не счёл файл,
+            # на который только что сослались, старым и неиспользуемым.
+            os.utime(self.path(name))
+            return name
+        return super().save(name, content, max_length)
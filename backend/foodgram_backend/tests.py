@@ -0,0 +1,128 @@
+import tempfile
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import router
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from recipes.models import Recipe
+
+from .admission import AdmissionMiddleware
+from .db_router import ReplicaRoutingMiddleware
+
+LOCMEM_CACHE = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+}
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], REPLICA_PIN_SECONDS=10,
+                   CACHES=LOCMEM_CACHE)
+class ReplicaRoutingTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+
+    def route(self, method, path='/api/recipes/', streaming=False,
+              client='Token client'):
+        """Выполняет запрос и возвращает базы для чтения и записи,
+        выбранные внутри view."""
+        seen = {}
+
+        def view(request):
+            seen['read'] = router.db_for_read(Recipe)
+            seen['write'] = router.db_for_write(Recipe)
+            if streaming:
+                return StreamingHttpResponse(
+                    router.db_for_read(Recipe) for _ in range(1)
+                )
+            return HttpResponse()
+
+        request = getattr(self.factory, method)(
+            path, HTTP_AUTHORIZATION=client
+        )
+        response = ReplicaRoutingMiddleware(view)(request)
+        if streaming:
+            seen['stream'] = b''.join(response).decode()
+            response.close()
+        return seen
+
+    def test_reads_go_to_replica(self):
+        self.assertEqual(self.route('get')['read'], 'replica')
+
+    def test_writes_go_to_primary(self):
+        seen = self.route('post')
+        self.assertEqual(seen['read'], 'default')
+        self.assertEqual(seen['write'], 'default')
+
+    def test_non_api_reads_stay_on_primary(self):
+        self.assertEqual(self.route('get', '/admin/')['read'], 'default')
+
+    def test_reads_after_write_are_pinned(self):
+        self.route('post')
+        self.assertEqual(self.route('get')['read'], 'default')
+
+    def test_pin_is_per_client(self):
+        self.route('post')
+        self.assertEqual(self.route('get', client='Token other')['read'],
+                         'replica')
+
+    def test_pin_expires(self):
+        self.route('post')
+        with mock.patch('time.time', return_value=10 ** 10):
+            self.assertEqual(self.route('get')['read'], 'replica')
+
+    @override_settings(DATABASE_REPLICAS=['replica_1', 'replica_2'])
+    def test_one_replica_per_request(self):
+        seen = set()
+
+        def view(request):
+            aliases = {router.db_for_read(Recipe) for _ in range(10)}
+            self.assertEqual(len(aliases), 1)
+            seen.update(aliases)
+            return HttpResponse()
+
+        middleware = ReplicaRoutingMiddleware(view)
+        for choice in ('replica_1', 'replica_2'):
+            with mock.patch('random.choice', return_value=choice):
+                middleware(self.factory.get('/api/recipes/'))
+        self.assertEqual(seen, {'replica_1', 'replica_2'})
+        self.assertEqual(router.db_for_read(Recipe), 'default')
+
+    def test_streaming_body_keeps_routing(self):
+        self.assertEqual(self.route('get', streaming=True)['stream'],
+                         'replica')
+        self.route('post')
+        self.assertEqual(self.route('get', streaming=True)['stream'],
+                         'default')
+        self.assertEqual(router.db_for_read(Recipe), 'default')
+
+
+class AdmissionTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(ADMISSION_MAX_REQUESTS=1,
+                                     ADMISSION_TIMEOUT=0.01,
+                                     ADMISSION_LOCK_DIR=directory.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.middleware = AdmissionMiddleware(
+            lambda request: StreamingHttpResponse(iter([b'data']))
+            if request.path.endswith('stream/') else HttpResponse()
+        )
+        self.factory = RequestFactory()
+
+    def request(self, path):
+        return self.middleware(self.factory.get(path))
+
+    def test_plain_response_releases_slot(self):
+        self.assertEqual(self.request('/api/recipes/').status_code, 200)
+        self.assertEqual(self.request('/api/recipes/').status_code, 200)
+
+    def test_streaming_response_holds_slot_until_closed(self):
+        response = self.request('/api/stream/')
+        self.assertEqual(self.request('/api/recipes/').status_code, 503)
+        self.assertEqual(b''.join(response), b'data')
+        response.close()
+        self.assertEqual(self.request('/api/recipes/').status_code, 200)
@@ -5,7 +5,8 @@ from django.contrib import admin
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
-from api.views import (FoodgramUserViewSet, IngredientViewSet,
+from api.views import (BundleViewSet, ChangesViewSet, FoodgramUserViewSet,
+                       HouseholdViewSet, IngredientViewSet, MetricsViewSet,
                        RecipeViewSet, TagViewSet)
 
 router = DefaultRouter()
@@ -13,6 +14,10 @@ router.register(r'ingredients', IngredientViewSet)
 router.register(r'tags', TagViewSet)
 router.register(r'recipes', RecipeViewSet)
 router.register(r'users', FoodgramUserViewSet)
+router.register(r'households', HouseholdViewSet, basename='households')
+router.register(r'changes', ChangesViewSet, basename='changes')
+router.register(r'metrics', MetricsViewSet, basename='metrics')
+router.register(r'bundles', BundleViewSet, basename='bundles')
 
 urlpatterns = [
     path('admin/', admin.site.urls),
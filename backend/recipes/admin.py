@@ -1,7 +1,21 @@
 from django.contrib import admin
 
-from .models import (Favorite, FoodgramUser, Ingredient, IngredientInRecipe,
-                     Recipe, ShoppingList, Subscription, Tag)
+from .models import (ArchivedRelation, DataExport, Favorite, FoodgramUser,
+                     Household, Ingredient, IngredientInRecipe, PurgeJob,
+                     Recipe, ShoppingList, Subscription, Tag, tags_mask)
+from .purge import soft_delete
+
+
+class SoftDeleteMixin:
+    def get_deleted_objects(self, objs, request):
+        return [str(obj) for obj in objs], {}, set(), []
+
+    def delete_model(self, request, obj):
+        soft_delete(obj)
+
+    def delete_queryset(self, request, queryset):
+        for obj in queryset:
+            soft_delete(obj)
 
 
 @admin.register(Tag)
@@ -18,13 +32,13 @@ class IngredientAdmin(admin.ModelAdmin):
 
 @admin.register(Favorite)
 class FavoriteAdmin(admin.ModelAdmin):
-    list_display = ('user', 'recipe')
+    list_display = ('user', 'recipe', 'added_at')
     list_filter = ('user', 'recipe')
 
 
 @admin.register(ShoppingList)
 class ShoppingListAdmin(admin.ModelAdmin):
-    list_display = ('user', 'recipe')
+    list_display = ('user', 'recipe', 'servings', 'added_at')
     list_filter = ('user', 'recipe')
 
 
@@ -35,20 +49,27 @@ class IngridientInline(admin.TabularInline):
 
 
 @admin.register(Recipe)
-class RecipeAdmin(admin.ModelAdmin):
+class RecipeAdmin(SoftDeleteMixin, admin.ModelAdmin):
     list_display = ('name', 'author', 'count_favorites')
     list_filter = ('tags', )
     search_fields = ('name', 'author__username')
     filter_horizontal = ('ingredients',)
     inlines = (IngridientInline,)
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        recipe = form.instance
+        recipe.tags_mask = tags_mask(recipe.tags.all())
+        recipe.save(update_fields=('tags_mask',))
+
     def count_favorites(self, obj):
         return obj.favorites.count()
 
 
 @admin.register(FoodgramUser)
-class FoodgramUserAdmin(admin.ModelAdmin):
+class FoodgramUserAdmin(SoftDeleteMixin, admin.ModelAdmin):
     list_display = ('username', 'email', 'first_name', 'last_name', 'password')
+    list_filter = ('is_active',)
     search_fields = ('username', 'email')
 
 
@@ -56,3 +77,30 @@ class FoodgramUserAdmin(admin.ModelAdmin):
 class SubscriptionAdmin(admin.ModelAdmin):
     list_display = ('user', 'author')
     search_fields = ('user', 'author')
+
+
+@admin.register(Household)
+class HouseholdAdmin(admin.ModelAdmin):
+    list_display = ('name', 'author')
+    search_fields = ('name', 'author__email')
+    filter_horizontal = ('members',)
+
+
+@admin.register(PurgeJob)
+class PurgeJobAdmin(admin.ModelAdmin):
+    list_display = ('model', 'object_id', 'deleted', 'created_at',
+                    'updated_at', 'finished_at')
+    list_filter = ('model',)
+
+
+@admin.register(DataExport)
+class DataExportAdmin(admin.ModelAdmin):
+    list_display = ('user', 'size', 'created_at', 'finished_at')
+    search_fields = ('user__email', 'user__username')
+
+
+@admin.register(ArchivedRelation)
+class ArchivedRelationAdmin(admin.ModelAdmin):
+    list_display = ('model', 'user_id', 'recipe_id', 'added_at',
+                    'archived_at')
+    list_filter = ('model',)
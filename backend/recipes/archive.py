@@ -0,0 +1,133 @@
+from datetime import datetime
+
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from . import trending
+from .constants import ARCHIVE_BATCH_SIZE
+from .db import delete_rows
+from .models import ArchivedRelation
+
+
+def archive_connection():
+    return connections[router.db_for_write(ArchivedRelation)]
+
+
+def is_partitioned(connection):
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT 1 FROM pg_partitioned_table '
+            'WHERE partrelid = %s::regclass',
+            [ArchivedRelation._meta.db_table],
+        )
+        return cursor.fetchone() is not None
+
+
+def month_start(moment, months=0):
+    month = moment.year * 12 + moment.month - 1 + months
+    return datetime(month // 12, month % 12 + 1, 1, tzinfo=moment.tzinfo)
+
+
+def ensure_partition(connection, moment):
+    """Создаёт секцию архива за месяц moment.
+
+    Строки этого месяца, которые уже попали в секцию по умолчанию,
+    например после restore, переносятся в новую секцию.
+    """
+    table = ArchivedRelation._meta.db_table
+    start = month_start(moment)
+    partition = f'{table}_{start:%Y%m}'
+    quote = connection.ops.quote_name
+    with transaction.atomic(using=connection.alias), \
+            connection.cursor() as cursor:
+        cursor.execute('SELECT to_regclass(%s)', [partition])
+        if cursor.fetchone()[0] is not None:
+            return
+        bounds = [start, month_start(start, 1)]
+        cursor.execute(f'CREATE TABLE {quote(partition)} '
+                       f'(LIKE {quote(table)} INCLUDING ALL)')
+        cursor.execute(
+            f'WITH moved AS (DELETE FROM {quote(table + "_default")} '
+            f'WHERE archived_at >= %s AND archived_at < %s RETURNING *) '
+            f'INSERT INTO {quote(partition)} SELECT * FROM moved',
+            bounds,
+        )
+        cursor.execute(
+            f'ALTER TABLE {quote(table)} ATTACH PARTITION {quote(partition)} '
+            f'FOR VALUES FROM (%s) TO (%s)',
+            bounds,
+        )
+
+
+def archive(model, cutoff, batch_size=ARCHIVE_BATCH_SIZE):
+    """Переносит записи model, добавленные раньше cutoff, в архив.
+
+    Каждая пачка переносится в своей транзакции, поэтому прерванный
+    запуск просто продолжается при следующем.
+    """
+    connection = archive_connection()
+    extra = ['servings'] if hasattr(model, 'servings') else []
+    rows = model.objects.filter(added_at__lt=cutoff).order_by('pk').values(
+        'pk', 'user_id', 'recipe_id', 'added_at', *extra
+    )
+    partitioned = is_partitioned(connection)
+    total = 0
+    while True:
+        now = timezone.now()
+        if partitioned:
+            ensure_partition(connection, now)
+        with transaction.atomic():
+            batch = list(rows.select_for_update()[:batch_size])
+            ArchivedRelation.objects.bulk_create([
+                ArchivedRelation(
+                    model=model._meta.model_name,
+                    user_id=row['user_id'],
+                    recipe_id=row['recipe_id'],
+                    servings=row.get('servings'),
+                    added_at=row['added_at'],
+                    archived_at=now,
+                )
+                for row in batch
+            ])
+            total += delete_rows(model, [row['pk'] for row in batch])
+            trending.recompute({row['recipe_id'] for row in batch})
+        if len(batch) < batch_size:
+            return total
+
+
+def expire(cutoff, batch_size=ARCHIVE_BATCH_SIZE):
+    """Удаляет из архива записи, перенесённые раньше cutoff.
+
+    Помесячные секции, целиком лежащие до cutoff, удаляются сразу.
+    """
+    connection = archive_connection()
+    table = ArchivedRelation._meta.db_table
+    total = 0
+    if is_partitioned(connection):
+        quote = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT inhrelid::regclass::text FROM pg_inherits '
+                'WHERE inhparent = %s::regclass',
+                [table],
+            )
+            partitions = [name for name, in cursor.fetchall()
+                          if name != f'{table}_default']
+            for partition in partitions:
+                start = datetime.strptime(
+                    partition.rsplit('_', 1)[1], '%Y%m'
+                ).replace(tzinfo=cutoff.tzinfo)
+                if month_start(start, 1) <= cutoff:
+                    cursor.execute(f'SELECT count(*) FROM {quote(partition)}')
+                    total += cursor.fetchone()[0]
+                    cursor.execute(f'DROP TABLE {quote(partition)}')
+    pks = ArchivedRelation.objects.filter(
+        archived_at__lt=cutoff
+    ).order_by('pk').values_list('pk', flat=True)
+    while True:
+        deleted = delete_rows(ArchivedRelation, list(pks[:batch_size]))
+        total += deleted
+        if deleted < batch_size:
+            return total
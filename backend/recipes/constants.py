@@ -4,5 +4,35 @@ MAX_LENGTH_TAG = 32
 MAX_LENGTH_NAME = 128
 MAX_LENGTH_UNIT = 64
 MAX_LENGTH_RECIPE_NAME = 256
+MAX_LENGTH_MODEL_NAME = 32
+MAX_LENGTH_HOUSEHOLD_CODE = 32
+MAX_LENGTH_THROTTLE_KEY = 255
 MIN_VALUE = 1
 MAX_VALUE = 32000
+MAX_TAGS = 63
+SIMILAR_RECIPES_LIMIT = 6
+PANTRY_MIN_COVERAGE = 0.5
+SYNC_OVERLAP_SECONDS = 60
+CHANGES_PAGE_SIZE = 500
+TOMBSTONE_BATCH_SIZE = 1000
+MULTI_GET_MAX_IDS = 100
+EVENTS_QUEUE_SIZE = 100
+EVENTS_HEARTBEAT_SECONDS = 15
+EVENTS_TICKET_SECONDS = 60
+TRENDING_FAVORITE_WEIGHT = 2
+TRENDING_SHOPPING_LIST_WEIGHT = 1
+TRENDING_HALF_LIFE_HOURS = 72
+TRENDING_MIN_SCORE = 0.01
+TRENDING_BATCH_SIZE = 1000
+PURGE_BATCH_SIZE = 1000
+SNAPSHOT_BATCH_SIZE = 5000
+MAX_PAGE_SIZE = 100
+EXPORT_CHUNK_SIZE = 500
+DOCUMENTS_CHUNK_SIZE = 500
+DATA_EXPORT_CHUNK_SIZE = 500
+DATA_EXPORT_COPY_BUFFER = 1024 * 1024
+UNIT_CONVERSIONS = {'кг': ('г', 1000), 'л': ('мл', 1000)}
+HOUSEHOLD_CODE_BYTES = 16
+BUNDLE_VERSION_LENGTH = 12
+ARCHIVE_BATCH_SIZE = 1000
+RECIPE_INDEX_LOG_LIMIT = 1000
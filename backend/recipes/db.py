@@ -0,0 +1,106 @@
+from django.db import connections, router
+
+
+def delete_rows(model, ids):
+    """Удаляет строки по ключам без сигналов и сбора связанных объектов."""
+    if not ids:
+        return 0
+    connection = connections[router.db_for_write(model)]
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {quote(model._meta.db_table)} '
+            f'WHERE {quote(model._meta.pk.column)} '
+            f'IN ({", ".join(["%s"] * len(ids))})',
+            ids,
+        )
+        return cursor.rowcount
+
+
+def insert_or_ignore(model, **values):
+    """Вставляет строку, если она не нарушает ограничений уникальности.
+
+    Возвращает первичный ключ новой строки или None, если такая строка
+    уже есть.
+    """
+    connection = connections[router.db_for_write(model)]
+    quote = connection.ops.quote_name
+    instance = model(**values)
+    fields = [field for field in model._meta.concrete_fields
+              if field is not model._meta.auto_field]
+    params = [field.get_db_prep_save(field.pre_save(instance, True),
+                                     connection)
+              for field in fields]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {quote(model._meta.db_table)} '
+            f'({", ".join(quote(field.column) for field in fields)}) '
+            f'VALUES ({", ".join(["%s"] * len(fields))}) '
+            f'ON CONFLICT DO NOTHING '
+            f'RETURNING {quote(model._meta.pk.column)}',
+            params,
+        )
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def delete_returning(model, returning, **values):
+    """Удаляет строки с заданными значениями полей одним запросом.
+
+    Возвращает значения поля returning удалённых строк, поэтому
+    параллельные запросы не могут удалить одну строку дважды.
+    """
+    connection = connections[router.db_for_write(model)]
+    quote = connection.ops.quote_name
+    fields = [model._meta.get_field(name) for name in values]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {quote(model._meta.db_table)} WHERE '
+            + ' AND '.join(f'{quote(field.column)} = %s' for field in fields)
+            + f' RETURNING {quote(model._meta.get_field(returning).column)}',
+            [field.get_db_prep_value(value, connection)
+             for field, value in zip(fields, values.values())],
+        )
+        column = model._meta.get_field(returning).get_col(
+            model._meta.db_table
+        )
+        converters = (connection.ops.get_db_converters(column)
+                      + column.get_db_converters(connection))
+        rows = []
+        for value, in cursor.fetchall():
+            for converter in converters:
+                value = converter(value, column, connection)
+            rows.append(value)
+    return rows
+
+
+def take_tokens(key, capacity, refill, cost, now):
+    """Списывает cost токенов из корзины key одним запросом.
+
+    Корзина наполняется со скоростью refill токенов в секунду до
+    capacity. Возвращает остаток токенов и признак того, что их
+    хватило. Параллельные запросы не теряют списания друг друга.
+    """
+    from .models import ThrottleBucket
+
+    connection = connections[router.db_for_write(ThrottleBucket)]
+    quote = connection.ops.quote_name
+    table = quote(ThrottleBucket._meta.db_table)
+    tokens = f'{table}.tokens + (%s - {table}.updated) * %s'
+    refilled = f'CASE WHEN {tokens} < %s THEN {tokens} ELSE %s END'
+    refilled_params = [now, refill, capacity, now, refill, capacity]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} ({quote("key")}, tokens, updated, allowed) '
+            f'VALUES (%s, %s, %s, %s) '
+            f'ON CONFLICT ({quote("key")}) DO UPDATE SET '
+            f'tokens = {refilled} - CASE WHEN {refilled} >= %s '
+            f'THEN %s ELSE 0 END, '
+            f'updated = %s, allowed = {refilled} >= %s '
+            f'RETURNING tokens, allowed',
+            [key, capacity - cost, now, True,
+             *refilled_params, *refilled_params, cost, cost,
+             now, *refilled_params, cost],
+        )
+        tokens, allowed = cursor.fetchone()
+    return tokens, bool(allowed)
@@ -0,0 +1,365 @@
+import fcntl
+import heapq
+import io
+import logging
+import os
+import pickle
+import threading
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .constants import RECIPE_INDEX_LOG_LIMIT
+
+logger = logging.getLogger(__name__)
+
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+
+def replace_file(path, data):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as file:
+        file.write(data)
+    os.replace(tmp_path, path)
+
+
+def read_records(file):
+    while True:
+        try:
+            yield pickle.load(file)
+        except EOFError:
+            return
+
+
+def to_bits(recipes):
+    buffer = bytearray(max(recipes, default=0) // 8 + 1)
+    for recipe in recipes:
+        buffer[recipe >> 3] |= 1 << (recipe & 7)
+    return int.from_bytes(buffer, 'little')
+
+
+def count_bits(bits):
+    return bin(bits).count('1')
+
+
+class PantryResult:
+    """Рецепты, сгруппированные по доле совпадения, в виде битовых масок.
+
+    Позволяет пагинатору узнать количество и взять срез, не раскладывая
+    все маски в список.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = [
+            (coverage, bits, count_bits(bits))
+            for coverage, _, bits in buckets
+        ]
+
+    def __len__(self):
+        return sum(size for _, _, size in self.buckets)
+
+    def __getitem__(self, page):
+        start, stop, _ = page.indices(len(self))
+        skip, need = start, stop - start
+        result = []
+        for coverage, bits, size in self.buckets:
+            if need <= 0:
+                break
+            if skip >= size:
+                skip -= size
+                continue
+            while bits and need:
+                lowest = bits & -bits
+                bits ^= lowest
+                if skip:
+                    skip -= 1
+                    continue
+                result.append((lowest.bit_length() - 1, coverage))
+                need -= 1
+        return result
+
+
+class RecipeIndex:
+    """Разреженные матрицы рецепт×ингредиент и рецепт×тег в памяти.
+
+    Матрицы хранятся в файле-снимке, а изменения дописываются в журнал
+    рядом с ним. Каждый воркер при обращении дочитывает из журнала только
+    новые записи. Когда записей накапливается RECIPE_INDEX_LOG_LIMIT,
+    журнал сворачивается в новый снимок. Файлы меняются под блокировкой
+    flock, общей для всех процессов. Снимок строит команда rebuildindex.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self.loaded = False
+        self.generation = None
+        self.log_offset = 0
+        self.log_records = 0
+        self._clear()
+
+    @property
+    def log_path(self):
+        return f'{self.path}.log'
+
+    @contextmanager
+    def file_lock(self, operation, name='lock'):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(f'{self.path}.{name}', 'w') as file:
+            fcntl.flock(file, operation)
+            yield
+
+    def _clear(self):
+        self.ingredients = {}
+        self.tags = {}
+        self.by_ingredient = {}
+        self.ingredient_bits = None
+        self.size_bits = None
+
+    def _apply(self, records):
+        for recipe, ingredients, tags in records:
+            self._remove(recipe)
+            if ingredients is not None:
+                self._add(recipe, ingredients, tags)
+
+    def _read_snapshot(self):
+        self._clear()
+        try:
+            file = open(self.path, 'rb')
+        except FileNotFoundError:
+            logger.warning('Индекс рецептов %s не построен, выполните '
+                           'rebuildindex', self.path)
+            return
+        with file:
+            ingredients, tags = pickle.load(file)
+        for recipe, row in ingredients.items():
+            self._add(recipe, row, tags[recipe])
+
+    def _load(self):
+        """Дочитывает изменения из файлов, вызывается под flock.
+
+        Журнал начинается с номера поколения, который меняется при каждой
+        записи нового снимка: тогда снимок перечитывается целиком.
+        """
+        try:
+            file = open(self.log_path, 'rb')
+        except FileNotFoundError:
+            file = io.BytesIO()
+        with file:
+            generation = next(read_records(file), None)
+            if self.loaded and generation == self.generation:
+                file.seek(self.log_offset)
+            else:
+                self._read_snapshot()
+                self.loaded = True
+                self.generation = generation
+                self.log_records = 0
+            records = list(read_records(file))
+            self.log_offset = file.tell()
+        self._apply(records)
+        self.log_records += len(records)
+
+    def _write(self, records):
+        """Применяет изменения и дописывает их в журнал."""
+        with self.lock, self.file_lock(fcntl.LOCK_EX):
+            self._load()
+            self._apply(records)
+            if (self.log_records + len(records) >= RECIPE_INDEX_LOG_LIMIT
+                    and os.path.exists(self.path) and self._compact()):
+                return
+            with open(self.log_path, 'ab') as file:
+                if self.generation is None:
+                    self.generation = uuid.uuid4().hex
+                    pickle.dump(self.generation, file)
+                for record in records:
+                    pickle.dump(record, file,
+                                protocol=pickle.HIGHEST_PROTOCOL)
+                self.log_offset = file.tell()
+            self.log_records += len(records)
+
+    def _compact(self):
+        """Сворачивает журнал в снимок, если не идёт перестроение."""
+        try:
+            with self.file_lock(fcntl.LOCK_EX | fcntl.LOCK_NB, 'rebuild'):
+                self._dump()
+        except BlockingIOError:
+            return False
+        return True
+
+    def _dump(self, log=b''):
+        replace_file(self.path, pickle.dumps(
+            (
+                {recipe: tuple(row)
+                 for recipe, row in self.ingredients.items()},
+                {recipe: tuple(row) for recipe, row in self.tags.items()},
+            ),
+            protocol=pickle.HIGHEST_PROTOCOL,
+        ))
+        self.generation = uuid.uuid4().hex
+        header = pickle.dumps(self.generation)
+        replace_file(self.log_path, header + log)
+        self.loaded = True
+        self.log_offset = len(header)
+        self.log_records = 0
+
+    def _remove(self, recipe):
+        row = self.ingredients.pop(recipe, ())
+        if self.ingredient_bits is not None and row:
+            mask = ~(1 << recipe)
+            for ingredient in row:
+                self.ingredient_bits[ingredient] &= mask
+            self.size_bits[len(row)] &= mask
+        for ingredient in row:
+            postings = self.by_ingredient.get(ingredient)
+            if postings is not None:
+                postings.discard(recipe)
+                if not postings:
+                    del self.by_ingredient[ingredient]
+        self.tags.pop(recipe, None)
+
+    def _add(self, recipe, ingredients, tags):
+        self.ingredients[recipe] = frozenset(ingredients)
+        self.tags[recipe] = frozenset(tags)
+        for ingredient in ingredients:
+            self.by_ingredient.setdefault(ingredient, set()).add(recipe)
+        if self.ingredient_bits is not None and self.ingredients[recipe]:
+            bit = 1 << recipe
+            for ingredient in self.ingredients[recipe]:
+                self.ingredient_bits[ingredient] = (
+                    self.ingredient_bits.get(ingredient, 0) | bit
+                )
+            size = len(self.ingredients[recipe])
+            self.size_bits[size] = self.size_bits.get(size, 0) | bit
+
+    def build(self, rows):
+        """Записывает новый снимок из строк (рецепт, ингредиенты, теги).
+
+        rows читаются без блокировки записи в журнал. Записи журнала,
+        появившиеся за это время, сохраняются: они могли не попасть в rows.
+        """
+        with self.file_lock(fcntl.LOCK_EX, 'rebuild'):
+            with self.file_lock(fcntl.LOCK_SH):
+                start = file_size(self.log_path)
+            rows = list(rows)
+            with self.lock, self.file_lock(fcntl.LOCK_EX):
+                self._clear()
+                for recipe, ingredients, tags in rows:
+                    self._add(recipe, ingredients, tags)
+                log = b''
+                if os.path.exists(self.log_path):
+                    with open(self.log_path, 'rb') as file:
+                        next(read_records(file))
+                        file.seek(max(start, file.tell()))
+                        log = file.read()
+                self._dump(log)
+                if log:
+                    self.loaded = False
+                    self._load()
+
+    def rebuild(self):
+        from .models import IngredientInRecipe, Recipe
+
+        def database_rows():
+            rows = {recipe: ([], []) for recipe in
+                    Recipe.objects.values_list('id', flat=True).iterator()}
+            for recipe, ingredient in IngredientInRecipe.objects.values_list(
+                    'recipe_id', 'ingredient_id').iterator():
+                if recipe in rows:
+                    rows[recipe][0].append(ingredient)
+            for recipe, tag in Recipe.tags.through.objects.values_list(
+                    'recipe_id', 'tag_id').iterator():
+                if recipe in rows:
+                    rows[recipe][1].append(tag)
+            for recipe, (ingredients, tags) in rows.items():
+                yield recipe, ingredients, tags
+
+        self.build(database_rows())
+
+    def refresh(self, recipe):
+        from .models import IngredientInRecipe, Recipe
+
+        ingredients = list(IngredientInRecipe.objects.filter(
+            recipe_id=recipe).values_list('ingredient_id', flat=True))
+        tags = list(Recipe.tags.through.objects.filter(
+            recipe_id=recipe).values_list('tag_id', flat=True))
+        self._write([(recipe, tuple(ingredients), tuple(tags))])
+
+    def discard(self, *recipes):
+        self._write([(recipe, None, None) for recipe in recipes])
+
+    def sync(self):
+        with self.file_lock(fcntl.LOCK_SH):
+            self._load()
+
+    def similar(self, recipe, limit):
+        with self.lock:
+            self.sync()
+            ingredients = self.ingredients.get(recipe)
+            if not ingredients:
+                return []
+            tags = self.tags[recipe]
+            common = Counter()
+            for ingredient in ingredients:
+                common.update(self.by_ingredient[ingredient])
+            del common[recipe]
+            size = len(ingredients) + len(tags)
+            scores = []
+            for candidate, shared in common.items():
+                candidate_tags = self.tags[candidate]
+                shared += len(tags & candidate_tags)
+                union = (size + len(self.ingredients[candidate])
+                         + len(candidate_tags) - shared)
+                scores.append((shared / union, candidate))
+        return [candidate for _, candidate in heapq.nlargest(limit, scores)]
+
+    def bitsets(self):
+        """Битовые маски рецептов по ингредиентам и по их количеству."""
+        if self.ingredient_bits is None:
+            self.ingredient_bits = {
+                ingredient: to_bits(recipes)
+                for ingredient, recipes in self.by_ingredient.items()
+            }
+            sizes = {}
+            for recipe, row in self.ingredients.items():
+                sizes.setdefault(len(row), []).append(recipe)
+            self.size_bits = {
+                size: to_bits(recipes) for size, recipes in sizes.items()
+            }
+        return self.ingredient_bits, self.size_bits
+
+    def pantry(self, ingredients, min_coverage):
+        with self.lock:
+            self.sync()
+            ingredient_bits, size_bits = self.bitsets()
+            slices = []
+            for ingredient in set(ingredients):
+                carry = ingredient_bits.get(ingredient, 0)
+                for position, bits in enumerate(slices):
+                    if not carry:
+                        break
+                    slices[position], carry = bits ^ carry, bits & carry
+                if carry:
+                    slices.append(carry)
+            size_bits = list(size_bits.items())
+        buckets = []
+        for size, members in size_bits:
+            for count in range(min(size, 2 ** len(slices) - 1), 0, -1):
+                if count / size < min_coverage:
+                    break
+                recipes = members
+                for position, bits in enumerate(slices):
+                    recipes &= bits if count >> position & 1 else ~bits
+                if recipes:
+                    buckets.append((count / size, count, recipes))
+        buckets.sort(key=lambda bucket: bucket[:2], reverse=True)
+        return PantryResult(buckets)
+
+
+recipe_index = RecipeIndex(str(settings.RECIPE_INDEX_PATH))
@@ -0,0 +1,119 @@
+import gzip
+import hashlib
+import json
+import re
+import secrets
+from datetime import datetime
+from functools import lru_cache
+from urllib.parse import parse_qsl, unquote, urlencode, urlsplit
+
+from django.core.management.base import BaseCommand
+from django.urls import Resolver404, resolve
+
+# Формат combined, к которому формат timed из nginx.conf добавляет
+# $request_time и $msec.
+LINE_RE = re.compile(
+    r'\S+ \S+ \S+ \[(?P<time>[^\]]+)\] '
+    r'"(?P<method>[A-Z]+) (?P<target>\S+) [^"]*" (?P<status>\d{3}) '
+    r'\S+ "[^"]*" "[^"]*"'
+    r'(?: (?P<duration>[\d.]+) (?P<msec>[\d.]+))?'
+)
+BACKEND_PREFIXES = ('/api/', '/s/')
+SKIPPED_PREFIXES = ('/api/docs/', '/api/events/')
+REPLAY_METHODS = ('GET', 'HEAD')
+PUBLIC_PARAMS = ('page', 'limit', 'tags', 'tags_mode', 'ordering', 'author',
+                 'is_favorited', 'is_in_shopping_cart', 'recipes_limit',
+                 'fields', 'expand', 'ids', 'since', 'ingredients',
+                 'min_coverage', 'household')
+
+
+def open_log(path, mode='rt'):
+    opener = gzip.open if path.endswith('.gz') else open
+    return opener(path, mode, encoding='utf-8', errors='replace')
+
+
+@lru_cache(maxsize=4096)
+def route(path):
+    try:
+        return resolve(unquote(path)).view_name
+    except Resolver404:
+        return 'unknown'
+
+
+class Command(BaseCommand):
+    help = ('Превращает access-логи nginx в обезличенную трассу '
+            'GET-запросов к бэкенду для команды replay.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('logs', nargs='+',
+                            help='Файлы access.log, можно .gz.')
+        parser.add_argument('--output', required=True,
+                            help='Файл трассы, можно .gz.')
+        parser.add_argument('--keep', action='append', default=[],
+                            help='Ещё один параметр запроса, значение '
+                                 'которого не нужно скрывать.')
+
+    def anonymize(self, query):
+        return urlencode([
+            (key, value if key in self.public else hashlib.sha256(
+                f'{self.salt}{value}'.encode()
+            ).hexdigest()[:12])
+            for key, value in parse_qsl(query, keep_blank_values=True)
+        ])
+
+    def entries(self, paths):
+        """Разбирает строки логов и раскладывает запросы одной секунды
+        равномерно, если в логе нет $msec."""
+        second, pending = None, []
+        for path in paths:
+            with open_log(path) as log:
+                for line in log:
+                    match = LINE_RE.match(line)
+                    if not match:
+                        self.skipped += 1
+                        continue
+                    if match['msec']:
+                        yield float(match['msec']) - float(
+                            match['duration']
+                        ), match
+                        continue
+                    time = datetime.strptime(
+                        match['time'], '%d/%b/%Y:%H:%M:%S %z'
+                    ).timestamp()
+                    if time != second:
+                        yield from self.spread(second, pending)
+                        second, pending = time, []
+                    pending.append(match)
+        yield from self.spread(second, pending)
+
+    def spread(self, second, matches):
+        for number, match in enumerate(matches):
+            yield second + number / len(matches), match
+
+    def handle(self, *args, **options):
+        self.public = set(PUBLIC_PARAMS) | set(options['keep'])
+        self.salt = secrets.token_hex(16)
+        self.skipped = written = 0
+        start = None
+        with open_log(options['output'], 'wt') as output:
+            for time, match in self.entries(options['logs']):
+                target = urlsplit(match['target'])
+                if (match['method'] not in REPLAY_METHODS
+                        or not target.path.startswith(BACKEND_PREFIXES)
+                        or target.path.startswith(SKIPPED_PREFIXES)):
+                    self.skipped += 1
+                    continue
+                start = time if start is None else start
+                query = self.anonymize(target.query)
+                output.write(json.dumps({
+                    'offset': round(time - start, 3),
+                    'method': match['method'],
+                    'target': target.path + (f'?{query}' if query else ''),
+                    'route': route(target.path),
+                    'status': int(match['status']),
+                    'duration': (float(match['duration'])
+                                 if match['duration'] else None),
+                }) + '\n')
+                written += 1
+        self.stdout.write(f'Записано запросов: {written}, '
+                          f'пропущено строк: {self.skipped}')
@@ -0,0 +1,40 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from recipes import archive
+from recipes.constants import ARCHIVE_BATCH_SIZE
+from recipes.models import Favorite, ShoppingList
+
+
+class Command(BaseCommand):
+    help = ('Переносит старые записи списка покупок и избранного в архив '
+            'и удаляет из архива записи старше срока хранения.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int,
+                            default=ARCHIVE_BATCH_SIZE,
+                            help='Сколько строк переносить за одну '
+                                 'транзакцию.')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        for model, days in (
+            (ShoppingList, settings.SHOPPING_LIST_RETENTION_DAYS),
+            (Favorite, settings.FAVORITE_RETENTION_DAYS),
+        ):
+            if days is None:
+                continue
+            archived = archive.archive(model, now - timedelta(days=days),
+                                       options['batch_size'])
+            self.stdout.write(
+                f'{model._meta.verbose_name}: в архив перенесено {archived}'
+            )
+        if settings.RELATION_ARCHIVE_RETENTION_DAYS is not None:
+            expired = archive.expire(
+                now - timedelta(days=settings.RELATION_ARCHIVE_RETENTION_DAYS),
+                options['batch_size'],
+            )
+            self.stdout.write(f'Из архива удалено {expired}')
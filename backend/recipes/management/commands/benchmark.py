@@ -0,0 +1,86 @@
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from recipes.index import RecipeIndex
+
+
+class Command(BaseCommand):
+    help = 'Замеряет скорость поиска по синтетическим данным.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', choices=('pantry', 'fields'),
+                            help='Что замерять.')
+        parser.add_argument('--recipes', type=int, default=100_000,
+                            help='Количество рецептов.')
+        parser.add_argument('--ingredients', type=int, default=2200,
+                            help='Количество ингредиентов.')
+        parser.add_argument('--repeat', type=int, default=200,
+                            help='Количество запросов.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--limit', type=int, default=24,
+                            help='Размер страницы рецептов.')
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        getattr(self, f'benchmark_{options["scenario"]}')(options)
+
+    def report(self, label, timings, details=''):
+        timings = sorted(timings)
+        self.stdout.write(
+            f'{label}: среднее {statistics.mean(timings) * 1000:.3f} мс, '
+            f'p95 {timings[int(len(timings) * 0.95)] * 1000:.3f} мс{details}'
+        )
+
+    def benchmark_pantry(self, options):
+        ingredients = range(1, options['ingredients'] + 1)
+        weights = [1 / ingredient for ingredient in ingredients]
+        with tempfile.TemporaryDirectory() as directory:
+            index = RecipeIndex(os.path.join(directory, 'recipes.pickle'))
+            start = time.perf_counter()
+            index.build(
+                (recipe,
+                 set(random.choices(ingredients, weights,
+                                    k=random.randint(3, 15))),
+                 (random.randint(1, 3),))
+                for recipe in range(1, options['recipes'] + 1)
+            )
+            index.bitsets()
+            self.stdout.write(
+                f'Рецептов: {options["recipes"]}, индекс построен за '
+                f'{time.perf_counter() - start:.2f} с, файл '
+                f'{os.path.getsize(index.path) // 1024} КБ'
+            )
+            timings = []
+            for _ in range(options['repeat']):
+                pantry = random.choices(ingredients, weights, k=20)
+                start = time.perf_counter()
+                index.pantry(pantry, 0.5)[:6]
+                timings.append(time.perf_counter() - start)
+            self.report('Поиск по продуктам', timings)
+
+    def benchmark_fields(self, options):
+        client = Client(HTTP_HOST='localhost')
+        for label, params in (
+            ('все поля', ''),
+            ('плитка', '&fields=id,name,image,cooking_time'),
+            ('карточка', '&fields=id,name,image,cooking_time,author,tags'),
+            ('карточка с автором',
+             '&fields=id,name,image,cooking_time,author,tags&expand=author'),
+        ):
+            url = f'/api/recipes/?limit={options["limit"]}{params}'
+            timings = []
+            for _ in range(options['repeat']):
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    response = client.get(url)
+                    timings.append(time.perf_counter() - start)
+            self.report(label, timings, f', {len(response.content)} байт, '
+                                        f'{len(queries)} запросов к БД')
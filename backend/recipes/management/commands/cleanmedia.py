@@ -0,0 +1,73 @@
+import os
+import time
+
+from django.apps import apps
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import models
+
+
+class Command(BaseCommand):
+    help = ('Переименовывает медиафайлы по хешу содержимого '
+            'и удаляет файлы, на которые не ссылаются модели.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только показать, что будет сделано.')
+        parser.add_argument('--grace', type=int, default=60,
+                            help='Не удалять файлы моложе стольких минут.')
+
+    def file_fields(self):
+        for model in apps.get_models():
+            for field in model._meta.concrete_fields:
+                if isinstance(field, models.FileField):
+                    yield model, field
+
+    def is_referenced(self, name):
+        """Проверяет ссылки на файл заново перед удалением: строка могла
+        сослаться на него уже после того, как был собран список ссылок."""
+        return any(
+            model._base_manager.filter(**{field.name: name}).exists()
+            for model, field in self.file_fields()
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        referenced = set()
+        directories = set()
+        renamed = 0
+        for model, field in self.file_fields():
+            if isinstance(field.upload_to, str):
+                directories.add(field.upload_to)
+            rows = model._base_manager.filter(
+                **{f'{field.name}__gt': ''}
+            ).values_list('pk', field.name)
+            for pk, name in rows.iterator():
+                if (not default_storage.is_hashed(name)
+                        and default_storage.exists(name)):
+                    renamed += 1
+                    if not dry_run:
+                        with default_storage.open(name) as content:
+                            name = default_storage.save(name, content)
+                        model._base_manager.filter(pk=pk).update(
+                            **{field.name: name}
+                        )
+                referenced.add(name)
+        deleted = 0
+        deadline = time.time() - options['grace'] * 60
+        for directory in directories:
+            for root, _, files in os.walk(default_storage.path(directory)):
+                for file in files:
+                    path = os.path.join(root, file)
+                    name = os.path.relpath(path, default_storage.location)
+                    name = name.replace(os.sep, '/')
+                    if (name in referenced
+                            or os.path.getmtime(path) > deadline
+                            or self.is_referenced(name)):
+                        continue
+                    deleted += 1
+                    if not dry_run:
+                        default_storage.delete(name)
+        self.stdout.write(
+            f'Переименовано: {renamed}, удалено неиспользуемых: {deleted}'
+        )
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from recipes import trending
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает популярность рецептов по записям избранного '
+            'и списков покупок с периодом полураспада '
+            'TRENDING_HALF_LIFE_HOURS.')
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f'Популярность пересчитана у {trending.recompute()} рецептов'
+        )
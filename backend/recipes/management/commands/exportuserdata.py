@@ -0,0 +1,25 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from recipes import exports
+from recipes.models import DataExport
+
+
+class Command(BaseCommand):
+    help = ('Собирает архивы с данными пользователей, запрошенные '
+            'через API, и удаляет архивы удалённых пользователей.')
+
+    def handle(self, *args, **options):
+        for job in DataExport.objects.filter(
+                finished_at__isnull=True).select_related('user'):
+            exports.run(job)
+            self.stdout.write(f'{job}: {job.size} байт')
+        if not os.path.isdir(settings.EXPORT_ROOT):
+            return
+        paths = set(os.path.basename(job.path)
+                    for job in DataExport.objects.only('pk').iterator())
+        for name in os.listdir(settings.EXPORT_ROOT):
+            if name.endswith('.zip') and name not in paths:
+                os.remove(os.path.join(settings.EXPORT_ROOT, name))
@@ -3,7 +3,8 @@ import json
 from django.contrib.auth import get_user_model
 from django.core.management.base import BaseCommand
 
-from ....recipes.models import Ingredient
+from api import bundles
+from recipes.models import Ingredient
 
 User = get_user_model()
 
@@ -20,3 +21,4 @@ class Command(BaseCommand):
         with open(json_file, 'r', encoding='utf-8') as file:
             data = json.load(file)
             Ingredient.objects.bulk_create(Ingredient(**item) for item in data)
+        bundles.publish()
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from api import throttling
+
+
+class Command(BaseCommand):
+    help = 'Удаляет наполнившиеся корзины ограничения частоты запросов.'
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Удалено корзин: {throttling.prune()}')
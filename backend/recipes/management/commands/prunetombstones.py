@@ -0,0 +1,28 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from recipes.constants import TOMBSTONE_BATCH_SIZE
+from recipes.db import delete_rows
+from recipes.models import Tombstone
+
+
+class Command(BaseCommand):
+    help = ('Удаляет записи об удалённых объектах старше '
+            'TOMBSTONE_RETENTION_DAYS.')
+
+    def handle(self, *args, **options):
+        pks = Tombstone.objects.filter(
+            deleted_at__lt=timezone.now()
+            - timedelta(days=settings.TOMBSTONE_RETENTION_DAYS)
+        ).order_by('pk').values_list('pk', flat=True)
+        total = 0
+        while True:
+            deleted = delete_rows(Tombstone,
+                                  list(pks[:TOMBSTONE_BATCH_SIZE]))
+            total += deleted
+            if deleted < TOMBSTONE_BATCH_SIZE:
+                break
+        self.stdout.write(f'Удалено записей: {total}')
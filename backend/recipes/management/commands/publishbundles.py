@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from api import bundles
+
+
+class Command(BaseCommand):
+    help = ('Публикует справочники тегов и ингредиентов в BUNDLE_ROOT '
+            'для раздачи шлюзом.')
+
+    def handle(self, *args, **options):
+        for name, bundle in bundles.publish().items():
+            self.stdout.write(f'{name}: {bundle["url"]}, '
+                              f'{bundle["size"]} байт')
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from recipes import purge
+from recipes.constants import PURGE_BATCH_SIZE
+from recipes.models import PurgeJob
+
+
+class Command(BaseCommand):
+    help = ('Пачками удаляет скрытые рецепты и пользователей вместе со '
+            'связанными строками.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int,
+                            default=PURGE_BATCH_SIZE,
+                            help='Сколько строк удалять за один запрос.')
+
+    def handle(self, *args, **options):
+        for job in PurgeJob.objects.filter(finished_at__isnull=True):
+            purge.run(job, options['batch_size'])
+            self.stdout.write(
+                f'{job}: удалено строк {job.deleted}'
+            )
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from api.serializers import refresh_documents
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает готовые документы рецептов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--missing', action='store_true',
+                            help='Собрать только отсутствующие документы.')
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.all()
+        if options['missing']:
+            recipes = recipes.filter(document__isnull=True)
+        count = recipes.count()
+        refresh_documents(recipes)
+        self.stdout.write(f'Пересобрано документов: {count}')
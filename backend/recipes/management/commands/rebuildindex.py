@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from recipes.index import recipe_index
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает индекс ингредиентов и тегов рецептов.'
+
+    def handle(self, *args, **options):
+        recipe_index.rebuild()
+        self.stdout.write(
+            f'Проиндексировано рецептов: {len(recipe_index.ingredients)}'
+        )
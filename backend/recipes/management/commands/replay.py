@@ -0,0 +1,235 @@
+import asyncio
+import json
+import ssl
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+from .anonymizelog import open_log
+
+READ_SIZE = 64 * 1024
+
+
+def percentile(values, share):
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+class Connection:
+    """HTTP/1.1-соединение с keep-alive, тело ответа читается и
+    отбрасывается."""
+
+    def __init__(self, url, headers):
+        self.url = url
+        self.headers = ''.join(f'{name}: {value}\r\n'
+                               for name, value in headers.items())
+        self.reader = self.writer = None
+
+    async def open(self):
+        self.reader, self.writer = await asyncio.open_connection(
+            self.url.hostname,
+            self.url.port or (443 if self.url.scheme == 'https' else 80),
+            ssl=ssl.create_default_context()
+            if self.url.scheme == 'https' else None,
+        )
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    async def request(self, method, target):
+        reused = self.writer is not None
+        if not reused:
+            await self.open()
+        self.writer.write(f'{method} {target} HTTP/1.1\r\n{self.headers}\r\n'
+                          .encode())
+        await self.writer.drain()
+        status_line = await self.reader.readline()
+        if not status_line and reused:
+            # Сервер закрыл простаивавшее соединение.
+            self.close()
+            return await self.request(method, target)
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip().lower()
+        if method == 'HEAD' or status in (204, 304) or status < 200:
+            pass
+        elif headers.get('transfer-encoding') == 'chunked':
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                if not size:
+                    while await self.reader.readline() not in (b'\r\n', b''):
+                        pass
+                    break
+                await self.reader.readexactly(size + 2)
+        elif 'content-length' in headers:
+            left = int(headers['content-length'])
+            while left:
+                left -= len(await self.reader.readexactly(
+                    min(left, READ_SIZE)
+                ))
+        else:
+            while await self.reader.read(READ_SIZE):
+                pass
+            headers['connection'] = 'close'
+        if headers.get('connection') == 'close':
+            self.close()
+        return status
+
+
+class RouteStats:
+    def __init__(self):
+        self.timings = []
+        self.production = []
+        self.errors = self.mismatches = 0
+
+    def add(self, timing, status, entry):
+        self.timings.append(timing)
+        if entry['duration'] is not None:
+            self.production.append(entry['duration'])
+        if status is None or status >= 500:
+            self.errors += 1
+        if status is None or status // 100 != entry['status'] // 100:
+            self.mismatches += 1
+
+
+class Command(BaseCommand):
+    help = ('Воспроизводит трассу команды anonymizelog на запущенном '
+            'бэкенде и печатает задержки и ошибки по маршрутам.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('trace', help='Файл трассы, можно .gz.')
+        parser.add_argument('--base-url', default='http://localhost:8000',
+                            help='Адрес проверяемой сборки.')
+        parser.add_argument('--host',
+                            help='Заголовок Host, если он должен '
+                                 'отличаться от адреса.')
+        parser.add_argument('--token',
+                            help='Токен, с которым отправлять все запросы.')
+        parser.add_argument('--speed', type=float, default=1,
+                            help='Ускорение относительно лога, 0 — '
+                                 'без пауз.')
+        parser.add_argument('--concurrency', type=int, default=16,
+                            help='Число одновременных соединений.')
+        parser.add_argument('--timeout', type=float, default=30,
+                            help='Таймаут запроса в секундах.')
+        parser.add_argument('--limit', type=int,
+                            help='Воспроизвести только первые N запросов.')
+        parser.add_argument('--max-error-rate', type=float,
+                            help='Завершиться с ошибкой, если доля ошибок '
+                                 'больше этой, например 0.01.')
+        parser.add_argument('--max-p95', type=float,
+                            help='Завершиться с ошибкой, если общий p95 '
+                                 'больше этого числа миллисекунд.')
+
+    def entries(self, path, limit):
+        with open_log(path) as trace:
+            for number, line in enumerate(trace):
+                if number == limit:
+                    return
+                yield json.loads(line)
+
+    async def worker(self, queue, options):
+        url = urlsplit(options['base_url'])
+        headers = {'Host': options['host'] or url.netloc,
+                   'User-Agent': 'foodgram-replay'}
+        if options['token']:
+            headers['Authorization'] = f'Token {options["token"]}'
+        connection = Connection(url, headers)
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await queue.get()
+            if item is None:
+                connection.close()
+                return
+            entry, scheduled = item
+            start = loop.time()
+            self.lags.append(start - scheduled)
+            try:
+                status = await asyncio.wait_for(
+                    connection.request(entry['method'], entry['target']),
+                    options['timeout'],
+                )
+            except (OSError, ValueError, IndexError, asyncio.TimeoutError,
+                    asyncio.IncompleteReadError):
+                connection.close()
+                status = None
+            self.stats[entry['route']].add(loop.time() - start, status,
+                                           entry)
+
+    async def replay(self, options):
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(options['concurrency'])
+        workers = [asyncio.create_task(self.worker(queue, options))
+                   for _ in range(options['concurrency'])]
+        begin = loop.time()
+        for entry in self.entries(options['trace'], options['limit']):
+            scheduled = loop.time()
+            if options['speed']:
+                scheduled = begin + entry['offset'] / options['speed']
+                if scheduled > loop.time():
+                    await asyncio.sleep(scheduled - loop.time())
+            await queue.put((entry, scheduled))
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+        return loop.time() - begin
+
+    def report(self, elapsed):
+        self.stdout.write(
+            f'{"маршрут":<40} {"запросов":>8} {"в сек":>7} {"p50":>7} '
+            f'{"p95":>7} {"p99":>7} {"прод p95":>8} {"ошибки":>7} '
+            f'{"другой код":>10}'
+        )
+        total = RouteStats()
+        for name, stats in sorted(self.stats.items(),
+                                  key=lambda item: -len(item[1].timings)):
+            self.write_row(name, stats, elapsed)
+            total.timings += stats.timings
+            total.production += stats.production
+            total.errors += stats.errors
+            total.mismatches += stats.mismatches
+        self.write_row('всего', total, elapsed)
+        self.lags.sort()
+        self.stdout.write(
+            f'Длительность {elapsed:.1f} с, отставание от расписания '
+            f'p95 {percentile(self.lags, 0.95) * 1000:.0f} мс'
+        )
+        return total
+
+    def write_row(self, name, stats, elapsed):
+        stats.timings.sort()
+        stats.production.sort()
+        count = len(stats.timings)
+        production = (f'{percentile(stats.production, 0.95) * 1000:.0f}'
+                      if stats.production else '-')
+        self.stdout.write(
+            f'{name[:40]:<40} {count:>8} {count / elapsed:>7.1f} '
+            + ' '.join(f'{percentile(stats.timings, share) * 1000:>7.0f}'
+                       for share in (0.5, 0.95, 0.99))
+            + f' {production:>8} {stats.errors / count:>7.1%} '
+            f'{stats.mismatches / count:>10.1%}'
+        )
+
+    def handle(self, *args, **options):
+        self.stats = defaultdict(RouteStats)
+        self.lags = []
+        elapsed = asyncio.run(self.replay(options))
+        if not self.lags:
+            raise CommandError('В трассе нет запросов')
+        total = self.report(elapsed)
+        error_rate = total.errors / len(total.timings)
+        if (options['max_error_rate'] is not None
+                and error_rate > options['max_error_rate']):
+            raise CommandError(f'Доля ошибок {error_rate:.2%} больше '
+                               f'{options["max_error_rate"]:.2%}')
+        p95 = percentile(total.timings, 0.95) * 1000
+        if options['max_p95'] is not None and p95 > options['max_p95']:
+            raise CommandError(f'p95 {p95:.0f} мс больше '
+                               f'{options["max_p95"]:.0f} мс')
@@ -0,0 +1,134 @@
+import csv
+import json
+import tarfile
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from api import bundles
+from recipes.constants import SNAPSHOT_BATCH_SIZE
+from recipes.index import recipe_index
+from recipes.snapshot import NULL, schema_version, snapshot_models
+
+
+class Command(BaseCommand):
+    help = ('Заменяет данные приложения recipes содержимым архива, '
+            'сохранённого командой snapshot.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл архива .tar.gz.')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def check_manifest(self, manifest, connection, models):
+        leaves, unapplied = schema_version(connection)
+        if unapplied:
+            raise CommandError(
+                f'Не применены миграции: {", ".join(unapplied)}'
+            )
+        if manifest['migrations'] != leaves:
+            raise CommandError(
+                f'Снимок сделан на миграциях '
+                f'{", ".join(manifest["migrations"])}, а в проекте '
+                f'{", ".join(leaves)}. Сделайте новый снимок.'
+            )
+        for table, model in models.items():
+            columns = [field.column for field in model._meta.concrete_fields]
+            if manifest['tables'].get(table, {}).get('columns') != columns:
+                raise CommandError(
+                    f'Столбцы таблицы {table} не совпадают с моделью'
+                )
+
+    def clear_tables(self, cursor, connection, models):
+        """Очищает только таблицы снимка.
+
+        TRUNCATE ... CASCADE задел бы и таблицы других приложений,
+        например токены, поэтому строки удаляются через DELETE, а после
+        загрузки из внешних таблиц удаляются только строки, ссылающиеся
+        на исчезнувшие объекты.
+        """
+        quote = connection.ops.quote_name
+        for table in models:
+            cursor.execute(f'DELETE FROM {quote(table)}')
+
+    def delete_orphans(self, cursor, connection, models):
+        quote = connection.ops.quote_name
+        snapshot = set(models.values())
+        for model in apps.get_models(include_auto_created=True):
+            if model in snapshot:
+                continue
+            for field in model._meta.concrete_fields:
+                if field.is_relation and field.related_model in snapshot:
+                    target = field.target_field
+                    cursor.execute(
+                        f'DELETE FROM {quote(model._meta.db_table)} '
+                        f'WHERE {quote(field.column)} IS NOT NULL '
+                        f'AND {quote(field.column)} NOT IN ('
+                        f'SELECT {quote(target.column)} FROM '
+                        f'{quote(field.related_model._meta.db_table)})'
+                    )
+
+    def load_table(self, cursor, connection, model, file, columns, convert):
+        quote = connection.ops.quote_name
+        table = quote(model._meta.db_table)
+        if connection.vendor == 'postgresql':
+            # Порядок столбцов в файле — порядок полей модели, а не
+            # физический порядок столбцов таблицы.
+            cursor.copy_expert(
+                f'COPY {table} '
+                f'({", ".join(quote(column) for column in columns)}) '
+                f"FROM STDIN WITH (FORMAT csv, HEADER, NULL '{NULL}')",
+                file,
+            )
+            return
+        reader = csv.reader(line.decode() for line in file)
+        columns = next(reader)
+        fields = model._meta.concrete_fields
+        sql = (f'INSERT INTO {table} '
+               f'({", ".join(quote(column) for column in columns)}) '
+               f'VALUES ({", ".join(["%s"] * len(columns))})')
+        batch = []
+        for row in reader:
+            row = [None if value == NULL else value for value in row]
+            if convert:
+                row = [field.get_db_prep_save(field.to_python(value),
+                                              connection)
+                       for field, value in zip(fields, row)]
+            batch.append(row)
+            if len(batch) == SNAPSHOT_BATCH_SIZE:
+                cursor.executemany(sql, batch)
+                batch = []
+        if batch:
+            cursor.executemany(sql, batch)
+
+    def handle(self, *args, **options):
+        database = options['database']
+        connection = connections[database]
+        models = {model._meta.db_table: model for model in snapshot_models()}
+        with tarfile.open(options['path'], 'r|gz') as archive:
+            members = iter(archive)
+            manifest = json.load(archive.extractfile(next(members)))
+            self.check_manifest(manifest, connection, models)
+            with connection.constraint_checks_disabled(), \
+                    transaction.atomic(using=database), \
+                    connection.cursor() as cursor:
+                self.clear_tables(cursor, connection, models)
+                for member in members:
+                    table = member.name[:-len('.csv')]
+                    self.load_table(
+                        cursor, connection, models[table],
+                        archive.extractfile(member),
+                        manifest['tables'][table]['columns'],
+                        manifest['vendor'] != connection.vendor,
+                    )
+                    self.stdout.write(
+                        f'{table}: {manifest["tables"][table]["rows"]}'
+                    )
+                self.delete_orphans(cursor, connection, models)
+                connection.check_constraints()
+                for sql in connection.ops.sequence_reset_sql(
+                        no_style(), models.values()):
+                    cursor.execute(sql)
+        recipe_index.rebuild()
+        bundles.publish()
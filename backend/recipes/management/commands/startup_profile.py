@@ -0,0 +1,112 @@
+import json
+import statistics
+import subprocess
+import sys
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+PROBE = '''
+import json
+import sys
+import time
+from wsgiref.util import setup_testing_defaults
+
+start = time.perf_counter()
+from django.core.wsgi import get_wsgi_application
+
+application = get_wsgi_application()
+booted = time.perf_counter()
+timings = {'boot': booted - start}
+statuses = []
+for label in ('first_request', 'second_request'):
+    environ = {'PATH_INFO': sys.argv[1], 'HTTP_HOST': sys.argv[2]}
+    setup_testing_defaults(environ)
+    started = time.perf_counter()
+    response = application(
+        environ, lambda status, headers: statuses.append(status)
+    )
+    b''.join(response)
+    response.close()
+    timings[label] = time.perf_counter() - started
+timings['statuses'] = statuses
+print(json.dumps(timings))
+'''
+
+
+def parse_importtime(output):
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, total, name = line[len('import time:'):].split('|')
+        modules.append((name.strip(), int(own), int(total)))
+    return modules
+
+
+class Command(BaseCommand):
+    help = ('Замеряет холодный старт воркера: время импорта модулей '
+            'и время до первого ответа.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/api/tags/',
+                            help='Адрес первого запроса.')
+        parser.add_argument('--repeat', type=int, default=3,
+                            help='Количество запусков воркера.')
+        parser.add_argument('--top', type=int, default=15,
+                            help='Сколько самых медленных пакетов показать.')
+        parser.add_argument('--budget', type=float,
+                            help='Допустимое время от запуска до первого '
+                                 'ответа в миллисекундах.')
+
+    def probe(self, path):
+        hosts = [host.lstrip('.') for host in settings.ALLOWED_HOSTS
+                 if host != '*']
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', PROBE, path,
+             hosts[0] if hosts else 'localhost'],
+            cwd=settings.BASE_DIR, capture_output=True, text=True,
+        )
+        if result.returncode:
+            raise CommandError(result.stderr.strip().splitlines()[-1])
+        return (json.loads(result.stdout.strip().splitlines()[-1]),
+                parse_importtime(result.stderr))
+
+    def handle(self, *args, **options):
+        runs = [self.probe(options['path'])
+                for _ in range(options['repeat'])]
+        failed = [status for run in runs for status in run[0]['statuses']
+                  if not status.startswith('2')]
+        if failed:
+            raise CommandError(
+                f'Запрос {options["path"]} вернул {failed[0]}'
+            )
+        modules = runs[-1][1]
+        packages = Counter()
+        for name, own, _ in modules:
+            packages[name.partition('.')[0]] += own
+        self.stdout.write(
+            f'Импортировано модулей: {len(modules)}, '
+            f'{sum(packages.values()) / 1000:.1f} мс'
+        )
+        for package, own in packages.most_common(options['top']):
+            self.stdout.write(f'  {package}: {own / 1000:.1f} мс')
+        timings = {
+            label: statistics.median(run[0][label] for run in runs) * 1000
+            for label in ('boot', 'first_request', 'second_request')
+        }
+        startup = timings['boot'] + timings['first_request']
+        status = runs[-1][0]['statuses'][0]
+        self.stdout.write(
+            f'Загрузка приложения: {timings["boot"]:.1f} мс\n'
+            f'Первый запрос {options["path"]} ({status}): '
+            f'{timings["first_request"]:.1f} мс\n'
+            f'Второй запрос: {timings["second_request"]:.1f} мс\n'
+            f'До первого ответа: {startup:.1f} мс'
+        )
+        if options['budget'] is not None and startup > options['budget']:
+            raise CommandError(
+                f'Холодный старт {startup:.1f} мс превышает бюджет '
+                f'{options["budget"]:.0f} мс'
+            )
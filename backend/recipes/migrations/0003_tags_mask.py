@@ -0,0 +1,88 @@
+# Generated by Django 3.2.3 on 2026-10-19 10:39
+
+import django.core.validators
+from django.db import migrations, models
+
+from recipes.constants import MAX_TAGS
+
+
+def fill_tags_mask(apps, schema_editor):
+    Tag = apps.get_model('recipes', 'Tag')
+    Recipe = apps.get_model('recipes', 'Recipe')
+    if Tag.objects.count() > MAX_TAGS:
+        raise ValueError(
+            f'В маске помещается не больше {MAX_TAGS} тегов, '
+            'удалите лишние теги перед миграцией'
+        )
+    bits = {}
+    for bit, tag in enumerate(Tag.objects.order_by('id')):
+        tag.bit = bit
+        tag.save(update_fields=['bit'])
+        bits[tag.id] = bit
+    masks = {}
+    for recipe, tag in Recipe.tags.through.objects.values_list(
+            'recipe_id', 'tag_id'):
+        masks[recipe] = masks.get(recipe, 0) | 1 << bits[tag]
+    for recipe, mask in masks.items():
+        Recipe.objects.filter(id=recipe).update(tags_mask=mask)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0002_auto_20240611_1646'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='favorite',
+            options={'default_related_name': 'favorites', 'ordering': ('user',), 'verbose_name': 'Избранное', 'verbose_name_plural': 'Избранное'},
+        ),
+        migrations.AlterModelOptions(
+            name='ingredient',
+            options={'ordering': ('name',), 'verbose_name': 'Ингредиент', 'verbose_name_plural': 'Ингредиенты'},
+        ),
+        migrations.AlterModelOptions(
+            name='ingredientinrecipe',
+            options={'default_related_name': 'ingridients_in_recipe', 'ordering': ('recipe',), 'verbose_name': 'Ингредиенты рецепта', 'verbose_name_plural': 'Ингредиенты рецептов'},
+        ),
+        migrations.AlterModelOptions(
+            name='shoppinglist',
+            options={'default_related_name': 'shopping_list', 'ordering': ('user',), 'verbose_name': 'Список покупок', 'verbose_name_plural': 'Список покупок'},
+        ),
+        migrations.AlterModelOptions(
+            name='tag',
+            options={'ordering': ('name',), 'verbose_name': 'Тег', 'verbose_name_plural': 'Теги'},
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='tags_mask',
+            field=models.BigIntegerField(default=0, editable=False, verbose_name='Маска тегов'),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='bit',
+            field=models.PositiveSmallIntegerField(editable=False, null=True, unique=True, verbose_name='Бит в маске тегов'),
+        ),
+        migrations.RunPython(fill_tags_mask, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='tag',
+            name='bit',
+            field=models.PositiveSmallIntegerField(editable=False, unique=True, verbose_name='Бит в маске тегов'),
+        ),
+        migrations.AlterField(
+            model_name='foodgramuser',
+            name='email',
+            field=models.EmailField(max_length=256, unique=True, verbose_name='@'),
+        ),
+        migrations.AlterField(
+            model_name='ingredientinrecipe',
+            name='amount',
+            field=models.PositiveSmallIntegerField(validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(32000)], verbose_name='Количество'),
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='cooking_time',
+            field=models.PositiveSmallIntegerField(validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(32000)], verbose_name='Время приготовления'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 3.2.3 on 2026-10-19 10:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0003_tags_mask'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=32, verbose_name='Модель')),
+                ('object_id', models.BigIntegerField(verbose_name='ID объекта')),
+                ('deleted_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата удаления')),
+            ],
+            options={
+                'verbose_name': 'Удалённый объект',
+                'verbose_name_plural': 'Удалённые объекты',
+                'ordering': ('deleted_at',),
+            },
+        ),
+        migrations.AddField(
+            model_name='ingredient',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, verbose_name='Дата изменения'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, verbose_name='Дата изменения'),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, verbose_name='Дата изменения'),
+        ),
+        migrations.AddIndex(
+            model_name='tombstone',
+            index=models.Index(fields=['model', 'deleted_at'], name='tombstone_model_deleted_at'),
+        ),
+    ]
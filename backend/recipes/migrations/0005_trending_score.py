@@ -0,0 +1,22 @@
+# Generated by Django 3.2.3 on 2026-10-19 10:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_sync'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='trending_score',
+            field=models.FloatField(default=0, editable=False, verbose_name='Популярность'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-trending_score', '-pub_date'], name='recipe_trending'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 3.2.3 on 2026-10-19 10:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_trending_score'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PurgeJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=32, verbose_name='Модель')),
+                ('object_id', models.BigIntegerField(verbose_name='ID объекта')),
+                ('deleted', models.PositiveBigIntegerField(default=0, verbose_name='Удалено строк')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата изменения')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Дата завершения')),
+            ],
+            options={
+                'verbose_name': 'Фоновое удаление',
+                'verbose_name_plural': 'Фоновые удаления',
+                'ordering': ('created_at',),
+            },
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Дата удаления'),
+        ),
+    ]
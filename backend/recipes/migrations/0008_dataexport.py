@@ -0,0 +1,30 @@
+# Generated by Django 3.2.3 on 2026-10-19 11:19
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_recipe_document'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataExport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('size', models.PositiveBigIntegerField(default=0, verbose_name='Размер архива')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Дата завершения')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='data_exports', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Выгрузка данных',
+                'verbose_name_plural': 'Выгрузки данных',
+                'ordering': ('-created_at',),
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 3.2.3 on 2026-10-19 11:22
+
+from django.conf import settings
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+import recipes.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_dataexport'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shoppinglist',
+            name='servings',
+            field=models.PositiveSmallIntegerField(default=1, validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(32000)], verbose_name='Множитель порций'),
+        ),
+        migrations.CreateModel(
+            name='Household',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=128, verbose_name='Название')),
+                ('code', models.CharField(default=recipes.models.household_code, max_length=32, unique=True, verbose_name='Код приглашения')),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='own_households', to=settings.AUTH_USER_MODEL, verbose_name='Создатель')),
+                ('members', models.ManyToManyField(related_name='households', to=settings.AUTH_USER_MODEL, verbose_name='Участники')),
+            ],
+            options={
+                'verbose_name': 'Общий список покупок',
+                'verbose_name_plural': 'Общие списки покупок',
+                'ordering': ('name',),
+            },
+        ),
+    ]
@@ -0,0 +1,94 @@
+# Generated by Django 3.2.3 on 2026-10-19 11:29
+
+from django.conf import settings
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def create_archive(apps, schema_editor):
+    """На PostgreSQL по RELATION_ARCHIVE_PARTITIONED создаёт архив,
+    разбитый на помесячные секции по archived_at.
+
+    Живые таблицы избранного и списка покупок не секционируются:
+    для этого нужен составной первичный ключ.
+    """
+    model = apps.get_model('recipes', 'ArchivedRelation')
+    if not (schema_editor.connection.vendor == 'postgresql'
+            and settings.RELATION_ARCHIVE_PARTITIONED):
+        schema_editor.create_model(model)
+        return
+    quote = schema_editor.quote_name
+    table = model._meta.db_table
+    columns = []
+    for field in model._meta.local_fields:
+        definition, _ = schema_editor.column_sql(model, field)
+        definition = definition.replace(' PRIMARY KEY', '')
+        check = field.db_parameters(schema_editor.connection)['check']
+        if check:
+            definition += f' CHECK ({check})'
+        columns.append(f'{quote(field.column)} {definition}')
+    schema_editor.execute(
+        f'CREATE TABLE {quote(table)} ({", ".join(columns)}, '
+        f'PRIMARY KEY ({quote("id")}, {quote("archived_at")})) '
+        f'PARTITION BY RANGE ({quote("archived_at")})'
+    )
+    schema_editor.execute(
+        f'CREATE TABLE {quote(table + "_default")} '
+        f'PARTITION OF {quote(table)} DEFAULT'
+    )
+
+
+def delete_archive(apps, schema_editor):
+    schema_editor.delete_model(apps.get_model('recipes', 'ArchivedRelation'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_household'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='ArchivedRelation',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('model', models.CharField(max_length=32, verbose_name='Модель')),
+                        ('user_id', models.BigIntegerField(verbose_name='ID пользователя')),
+                        ('recipe_id', models.BigIntegerField(verbose_name='ID рецепта')),
+                        ('servings', models.PositiveSmallIntegerField(null=True, verbose_name='Множитель порций')),
+                        ('added_at', models.DateTimeField(verbose_name='Дата добавления')),
+                        ('archived_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата архивации')),
+                    ],
+                    options={
+                        'verbose_name': 'Архивная запись',
+                        'verbose_name_plural': 'Архив избранного и списков покупок',
+                        'ordering': ('archived_at',),
+                    },
+                ),
+            ],
+        ),
+        migrations.RunPython(create_archive, delete_archive),
+        migrations.AddField(
+            model_name='favorite',
+            name='added_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now, verbose_name='Дата добавления'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='shoppinglist',
+            name='added_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now, verbose_name='Дата добавления'),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='favorite',
+            index=models.Index(fields=['added_at'], name='favorite_added_at'),
+        ),
+        migrations.AddIndex(
+            model_name='shoppinglist',
+            index=models.Index(fields=['added_at'], name='shoppinglist_added_at'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 3.2.3 on 2026-10-19 12:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_relation_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ThrottleBucket',
+            fields=[
+                ('key', models.CharField(max_length=255, primary_key=True, serialize=False, verbose_name='Ключ')),
+                ('tokens', models.FloatField(verbose_name='Токены')),
+                ('updated', models.FloatField(verbose_name='Время обновления')),
+                ('allowed', models.BooleanField(verbose_name='Последний запрос пропущен')),
+            ],
+            options={
+                'verbose_name': 'Корзина токенов',
+                'verbose_name_plural': 'Корзины токенов',
+            },
+        ),
+    ]
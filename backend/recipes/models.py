@@ -1,12 +1,21 @@
+import os
+import secrets
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AbstractUser
+from django.core.exceptions import ValidationError
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.utils import timezone
 
-from .constants import (MAX_LENGTH_MAIL, MAX_LENGTH_NAME,
-                        MAX_LENGTH_RECIPE_NAME, MAX_LENGTH_TAG,
-                        MAX_LENGTH_UNIT, MAX_LENGTH_USER_NAME, MAX_VALUE,
-                        MIN_VALUE)
+from .constants import (HOUSEHOLD_CODE_BYTES, MAX_LENGTH_HOUSEHOLD_CODE,
+                        MAX_LENGTH_MAIL, MAX_LENGTH_MODEL_NAME,
+                        MAX_LENGTH_NAME, MAX_LENGTH_RECIPE_NAME,
+                        MAX_LENGTH_TAG, MAX_LENGTH_THROTTLE_KEY,
+                        MAX_LENGTH_UNIT, MAX_LENGTH_USER_NAME, MAX_TAGS,
+                        MAX_VALUE, MIN_VALUE, TRENDING_FAVORITE_WEIGHT,
+                        TRENDING_SHOPPING_LIST_WEIGHT)
 
 
 class FoodgramUser(AbstractUser):
@@ -33,6 +42,8 @@ class Ingredient(models.Model):
     name = models.CharField('Название', max_length=MAX_LENGTH_NAME)
     measurement_unit = models.CharField('Единица измерения',
                                         max_length=MAX_LENGTH_UNIT)
+    updated_at = models.DateTimeField('Дата изменения', auto_now=True,
+                                      db_index=True)
 
     class Meta:
         verbose_name = 'Ингредиент'
@@ -46,6 +57,10 @@ class Ingredient(models.Model):
 class Tag(models.Model):
     name = models.CharField('Тег', max_length=MAX_LENGTH_TAG, unique=True)
     slug = models.SlugField('Слаг', max_length=MAX_LENGTH_TAG, unique=True)
+    bit = models.PositiveSmallIntegerField('Бит в маске тегов', unique=True,
+                                           editable=False)
+    updated_at = models.DateTimeField('Дата изменения', auto_now=True,
+                                      db_index=True)
 
     class Meta:
         verbose_name = 'Тег'
@@ -55,6 +70,46 @@ class Tag(models.Model):
     def __str__(self):
         return self.name
 
+    @property
+    def mask(self):
+        return 1 << self.bit
+
+    @classmethod
+    def free_bits(cls):
+        return set(range(MAX_TAGS)).difference(
+            cls.objects.values_list('bit', flat=True)
+        )
+
+    def save(self, *args, **kwargs):
+        if self.bit is not None:
+            return super().save(*args, **kwargs)
+        # Параллельно создаваемый тег может занять выбранный бит раньше,
+        # тогда выбирается следующий свободный.
+        while True:
+            free_bits = Tag.free_bits()
+            if not free_bits:
+                raise ValidationError(
+                    f'Можно создать не больше {MAX_TAGS} тегов'
+                )
+            self.bit = min(free_bits)
+            try:
+                with transaction.atomic():
+                    return super().save(*args, **kwargs)
+            except IntegrityError:
+                taken = Tag.objects.filter(bit=self.bit).exists()
+                self.bit = None
+                if not taken:
+                    raise
+
+
+def tags_mask(tags):
+    return sum(tag.mask for tag in tags)
+
+
+class VisibleRecipeManager(models.Manager):
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
 
 class Recipe(models.Model):
     ingredients = models.ManyToManyField(
@@ -76,17 +131,51 @@ class Recipe(models.Model):
         on_delete=models.CASCADE,
     )
     pub_date = models.DateTimeField('Дата публикации', auto_now_add=True)
+    updated_at = models.DateTimeField('Дата изменения', auto_now=True,
+                                      db_index=True)
+    tags_mask = models.BigIntegerField('Маска тегов', default=0,
+                                       editable=False)
+    trending_score = models.FloatField('Популярность', default=0,
+                                       editable=False)
+    deleted_at = models.DateTimeField('Дата удаления', null=True,
+                                      blank=True, editable=False)
+
+    objects = VisibleRecipeManager()
+    all_objects = models.Manager()
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         default_related_name = 'recipes'
         ordering = ('-pub_date',)
+        indexes = [
+            models.Index(fields=['-trending_score', '-pub_date'],
+                         name='recipe_trending')
+        ]
 
     def __str__(self):
         return self.name
 
 
+class RecipeDocument(models.Model):
+    recipe = models.OneToOneField(
+        Recipe,
+        verbose_name='Рецепт',
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='document',
+    )
+    data = models.JSONField('Представление рецепта')
+    updated_at = models.DateTimeField('Дата изменения', auto_now=True)
+
+    class Meta:
+        verbose_name = 'Документ рецепта'
+        verbose_name_plural = 'Документы рецептов'
+
+    def __str__(self):
+        return str(self.recipe_id)
+
+
 class IngredientInRecipe(models.Model):
     recipe = models.ForeignKey(
         Recipe,
@@ -162,6 +251,7 @@ class BaseRelation(models.Model):
         verbose_name='Рецепт',
         on_delete=models.CASCADE,
     )
+    added_at = models.DateTimeField('Дата добавления', auto_now_add=True)
 
     class Meta:
         abstract = True
@@ -171,12 +261,17 @@ class BaseRelation(models.Model):
                 fields=['user', 'recipe'], name='unique_%(class)s'
             )
         ]
+        indexes = [
+            models.Index(fields=['added_at'], name='%(class)s_added_at')
+        ]
 
     def __str__(self):
         return f'{self.user} {self.recipe}'
 
 
 class Favorite(BaseRelation):
+    trending_weight = TRENDING_FAVORITE_WEIGHT
+
     class Meta(BaseRelation.Meta):
         verbose_name = 'Избранное'
         verbose_name_plural = 'Избранное'
@@ -184,7 +279,140 @@ class Favorite(BaseRelation):
 
 
 class ShoppingList(BaseRelation):
+    trending_weight = TRENDING_SHOPPING_LIST_WEIGHT
+
+    servings = models.PositiveSmallIntegerField(
+        'Множитель порций',
+        default=1,
+        validators=[MinValueValidator(MIN_VALUE), MaxValueValidator(MAX_VALUE)]
+    )
+
     class Meta(BaseRelation.Meta):
         verbose_name = 'Список покупок'
         verbose_name_plural = 'Список покупок'
         default_related_name = 'shopping_list'
+
+
+class Tombstone(models.Model):
+    model = models.CharField('Модель', max_length=MAX_LENGTH_MODEL_NAME)
+    object_id = models.BigIntegerField('ID объекта')
+    deleted_at = models.DateTimeField('Дата удаления', auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Удалённый объект'
+        verbose_name_plural = 'Удалённые объекты'
+        ordering = ('deleted_at',)
+        indexes = [
+            models.Index(fields=['model', 'deleted_at'],
+                         name='tombstone_model_deleted_at')
+        ]
+
+    def __str__(self):
+        return f'{self.model} {self.object_id}'
+
+
+class ArchivedRelation(models.Model):
+    model = models.CharField('Модель', max_length=MAX_LENGTH_MODEL_NAME)
+    user_id = models.BigIntegerField('ID пользователя')
+    recipe_id = models.BigIntegerField('ID рецепта')
+    servings = models.PositiveSmallIntegerField('Множитель порций',
+                                                null=True)
+    added_at = models.DateTimeField('Дата добавления')
+    archived_at = models.DateTimeField('Дата архивации', default=timezone.now)
+
+    class Meta:
+        verbose_name = 'Архивная запись'
+        verbose_name_plural = 'Архив избранного и списков покупок'
+        ordering = ('archived_at',)
+
+    def __str__(self):
+        return f'{self.model} {self.user_id} {self.recipe_id}'
+
+
+def household_code():
+    return secrets.token_urlsafe(HOUSEHOLD_CODE_BYTES)
+
+
+class Household(models.Model):
+    name = models.CharField('Название', max_length=MAX_LENGTH_NAME)
+    code = models.CharField('Код приглашения',
+                            max_length=MAX_LENGTH_HOUSEHOLD_CODE,
+                            unique=True,
+                            default=household_code)
+    author = models.ForeignKey(
+        User,
+        verbose_name='Создатель',
+        on_delete=models.CASCADE,
+        related_name='own_households'
+    )
+    members = models.ManyToManyField(
+        User,
+        verbose_name='Участники',
+        related_name='households'
+    )
+
+    class Meta:
+        verbose_name = 'Общий список покупок'
+        verbose_name_plural = 'Общие списки покупок'
+        ordering = ('name',)
+
+    def __str__(self):
+        return self.name
+
+
+class PurgeJob(models.Model):
+    model = models.CharField('Модель', max_length=MAX_LENGTH_MODEL_NAME)
+    object_id = models.BigIntegerField('ID объекта')
+    deleted = models.PositiveBigIntegerField('Удалено строк', default=0)
+    created_at = models.DateTimeField('Дата создания', auto_now_add=True)
+    updated_at = models.DateTimeField('Дата изменения', auto_now=True)
+    finished_at = models.DateTimeField('Дата завершения', null=True,
+                                       blank=True)
+
+    class Meta:
+        verbose_name = 'Фоновое удаление'
+        verbose_name_plural = 'Фоновые удаления'
+        ordering = ('created_at',)
+
+    def __str__(self):
+        return f'{self.model} {self.object_id}'
+
+
+class ThrottleBucket(models.Model):
+    key = models.CharField('Ключ', max_length=MAX_LENGTH_THROTTLE_KEY,
+                           primary_key=True)
+    tokens = models.FloatField('Токены')
+    updated = models.FloatField('Время обновления')
+    allowed = models.BooleanField('Последний запрос пропущен')
+
+    class Meta:
+        verbose_name = 'Корзина токенов'
+        verbose_name_plural = 'Корзины токенов'
+
+    def __str__(self):
+        return self.key
+
+
+class DataExport(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='data_exports',
+        verbose_name='Пользователь'
+    )
+    size = models.PositiveBigIntegerField('Размер архива', default=0)
+    created_at = models.DateTimeField('Дата создания', auto_now_add=True)
+    finished_at = models.DateTimeField('Дата завершения', null=True,
+                                       blank=True)
+
+    class Meta:
+        verbose_name = 'Выгрузка данных'
+        verbose_name_plural = 'Выгрузки данных'
+        ordering = ('-created_at',)
+
+    def __str__(self):
+        return f'{self.user} {self.created_at:%Y-%m-%d %H:%M}'
+
+    @property
+    def path(self):
+        return os.path.join(settings.EXPORT_ROOT, f'{self.pk}.zip')
@@ -0,0 +1,78 @@
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.db import models, transaction
+from django.db.models import F
+from django.db.models.deletion import get_candidate_relations_to_delete
+from django.utils import timezone
+
+from .constants import PURGE_BATCH_SIZE
+from .db import delete_rows
+from .index import recipe_index
+from .models import ArchivedRelation, PurgeJob, Recipe, Tombstone
+
+User = get_user_model()
+# В архиве id хранятся без внешних ключей, поэтому каскад их не видит.
+ARCHIVED_COLUMNS = {Recipe: 'recipe_id', User: 'user_id'}
+
+
+def hide_recipes(recipes):
+    ids = list(recipes.values_list('id', flat=True))
+    now = timezone.now()
+    recipes.update(deleted_at=now, updated_at=now)
+    Tombstone.objects.bulk_create(
+        [Tombstone(model=Recipe._meta.model_name, object_id=id)
+         for id in ids],
+        batch_size=PURGE_BATCH_SIZE,
+    )
+    transaction.on_commit(lambda: recipe_index.discard(*ids))
+
+
+@transaction.atomic
+def soft_delete(instance):
+    """Сразу скрывает рецепт или пользователя и ставит в очередь
+    удаление связанных строк командой purge."""
+    if isinstance(instance, Recipe):
+        hide_recipes(Recipe.objects.filter(pk=instance.pk))
+    else:
+        User.objects.filter(pk=instance.pk).update(is_active=False)
+        hide_recipes(Recipe.objects.filter(author=instance))
+    return PurgeJob.objects.create(model=instance._meta.model_name,
+                                   object_id=instance.pk)
+
+
+def purge_rows(job, model, batch_size, **lookup):
+    pks = model._base_manager.filter(**lookup).values_list('pk', flat=True)
+    while True:
+        ids = list(pks[:batch_size])
+        if not ids:
+            return
+        for relation in get_candidate_relations_to_delete(model._meta):
+            lookup = {f'{relation.field.name}__in': ids}
+            if relation.on_delete == models.CASCADE:
+                purge_rows(job, relation.related_model, batch_size, **lookup)
+            elif relation.on_delete == models.SET_NULL:
+                relation.related_model._base_manager.filter(
+                    **lookup
+                ).update(**{relation.field.name: None})
+        with transaction.atomic():
+            if model in ARCHIVED_COLUMNS:
+                ArchivedRelation.objects.filter(
+                    **{f'{ARCHIVED_COLUMNS[model]}__in': ids}
+                ).delete()
+            deleted = delete_rows(model, ids)
+            PurgeJob.objects.filter(pk=job.pk).update(
+                deleted=F('deleted') + deleted
+            )
+        job.deleted += deleted
+
+
+def run(job, batch_size=PURGE_BATCH_SIZE):
+    """Удаляет объект задания и всё, что от него каскадно зависит.
+
+    Каждая пачка коммитится отдельно, поэтому прерванное задание
+    продолжается с того места, где остановилось.
+    """
+    model = apps.get_model(PurgeJob._meta.app_label, job.model)
+    purge_rows(job, model, batch_size, pk=job.object_id)
+    job.finished_at = timezone.now()
+    job.save(update_fields=('finished_at', 'updated_at'))
@@ -0,0 +1,57 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .index import recipe_index
+from .models import Ingredient, Recipe, Tag, Tombstone
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=Recipe)
+def refresh_recipe_index(sender, instance, **kwargs):
+    transaction.on_commit(lambda: recipe_index.refresh(instance.id))
+
+
+@receiver(post_delete, sender=Recipe)
+def discard_recipe_index(sender, instance, **kwargs):
+    transaction.on_commit(lambda: recipe_index.discard(instance.id))
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_save, sender=Tag)
+@receiver(pre_delete, sender=Ingredient)
+def touch_related_recipes(sender, instance, created=False, **kwargs):
+    """Рецепты со встроенным тегом или ингредиентом считаются
+    изменёнными, чтобы лента изменений отдала их заново."""
+    if not created:
+        Recipe.all_objects.filter(**{
+            'tags' if sender is Tag else 'ingredients': instance
+        }).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=User)
+def touch_author_recipes(sender, instance, created, update_fields, **kwargs):
+    if not created and update_fields != frozenset(('last_login',)):
+        Recipe.all_objects.filter(author=instance).update(
+            updated_at=timezone.now()
+        )
+
+
+@receiver(post_delete, sender=Tag)
+def clear_tags_mask(sender, instance, **kwargs):
+    Recipe.objects.alias(
+        tag_bit=F('tags_mask').bitand(instance.mask)
+    ).exclude(tag_bit=0).update(tags_mask=F('tags_mask') - instance.mask,
+                                updated_at=timezone.now())
+
+
+@receiver(post_delete, sender=Ingredient)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Tag)
+def create_tombstone(sender, instance, **kwargs):
+    Tombstone.objects.create(model=sender._meta.model_name,
+                             object_id=instance.pk)
@@ -0,0 +1,28 @@
+from django.apps import apps
+from django.db.migrations.loader import MigrationLoader
+
+APP_LABEL = 'recipes'
+NULL = '\\N'
+
+
+def snapshot_models():
+    """Таблицы приложения, включая промежуточные таблицы ManyToMany,
+    которые ссылаются только на таблицы этого же приложения."""
+    models = list(apps.get_app_config(APP_LABEL).get_models(
+        include_auto_created=True
+    ))
+    return [
+        model for model in models
+        if all(field.related_model in models
+               for field in model._meta.concrete_fields if field.is_relation)
+    ]
+
+
+def schema_version(connection):
+    loader = MigrationLoader(connection)
+    unapplied = sorted(
+        name for app, name in loader.graph.nodes
+        if app == APP_LABEL and (app, name) not in loader.applied_migrations
+    )
+    leaves = sorted(name for _, name in loader.graph.leaf_nodes(APP_LABEL))
+    return leaves, unapplied
@@ -0,0 +1,494 @@
+import io
+import os
+import tempfile
+from datetime import timedelta
+from importlib import import_module
+from unittest import mock, skipUnless
+
+from django.apps import apps
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from . import archive, purge, trending
+from .index import RecipeIndex, recipe_index
+from .models import (ArchivedRelation, DataExport, Favorite, FoodgramUser,
+                     Household, Ingredient, IngredientInRecipe, PurgeJob,
+                     Recipe, ShoppingList, Subscription, Tag, tags_mask)
+
+
+class TemporaryFilesMixin:
+    """Направляет индекс рецептов и справочники во временный каталог."""
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        patcher = mock.patch.object(
+            recipe_index, 'path', os.path.join(self.directory, 'index.pickle')
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        settings = override_settings(
+            BUNDLE_ROOT=os.path.join(self.directory, 'bundles')
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+
+class SnapshotRestoreTests(TemporaryFilesMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = FoodgramUser.objects.create(
+            email='author@example.com', username='author',
+            first_name='Автор', last_name='Автор',
+        )
+        self.reader = FoodgramUser.objects.create(
+            email='reader@example.com', username='reader',
+            first_name='Читатель', last_name='Читатель',
+        )
+        self.token = Token.objects.create(user=self.reader)
+        tag = Tag.objects.create(name='Завтрак', slug='breakfast')
+        ingredient = Ingredient.objects.create(name='Мука',
+                                               measurement_unit='г')
+        # Рецептов больше, чем пользователей, чтобы id не совпадали.
+        for number in range(3):
+            self.recipe = Recipe.objects.create(
+                author=self.author, name=f'Рецепт {number}', text='Текст',
+                cooking_time=10, image='recipes/image.png',
+                tags_mask=tags_mask([tag]),
+            )
+        self.recipe.tags.add(tag)
+        IngredientInRecipe.objects.create(recipe=self.recipe,
+                                          ingredient=ingredient, amount=200)
+        ShoppingList.objects.create(user=self.reader, recipe=self.recipe,
+                                    servings=3)
+        self.path = os.path.join(self.directory, 'snapshot.tar.gz')
+        call_command('snapshot', self.path, stdout=io.StringIO())
+
+    def restore(self):
+        call_command('restore', self.path, stdout=io.StringIO())
+
+    def test_round_trip(self):
+        Recipe.objects.filter(pk=self.recipe.pk).update(name='Изменён')
+        ShoppingList.objects.all().delete()
+        self.restore()
+        recipe = Recipe.objects.get(pk=self.recipe.pk)
+        self.assertEqual(recipe.name, 'Рецепт 2')
+        self.assertEqual(recipe.author, self.author)
+        self.assertEqual(recipe.tags_mask, 1)
+        self.assertEqual(list(recipe.tags.values_list('slug', flat=True)),
+                         ['breakfast'])
+        self.assertEqual(
+            list(ShoppingList.objects.values_list('user', 'recipe',
+                                                  'servings')),
+            [(self.reader.pk, self.recipe.pk, 3)],
+        )
+
+    def test_keeps_tokens_of_restored_users(self):
+        stranger = FoodgramUser.objects.create(
+            email='stranger@example.com', username='stranger',
+            first_name='Гость', last_name='Гость',
+        )
+        Token.objects.create(user=stranger)
+        self.restore()
+        self.assertEqual(list(Token.objects.values_list('user', flat=True)),
+                         [self.reader.pk])
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.assertEqual(client.get('/api/users/me/').status_code, 200)
+
+
+class TrendingTests(TemporaryFilesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.users = [
+            FoodgramUser.objects.create(
+                email=f'user{number}@example.com', username=f'user{number}',
+                first_name='Имя', last_name='Фамилия',
+            )
+            for number in range(2)
+        ]
+        self.recipe = Recipe.objects.create(
+            author=self.users[0], name='Рецепт', text='Текст',
+            cooking_time=10, image='recipes/image.png',
+        )
+        self.client = APIClient()
+
+    def favorite(self, user, method='post'):
+        self.client.force_authenticate(user)
+        return getattr(self.client, method)(
+            f'/api/recipes/{self.recipe.pk}/favorite/'
+        )
+
+    def score(self):
+        self.recipe.refresh_from_db()
+        return self.recipe.trending_score
+
+    def test_removal_subtracts_decayed_contribution(self):
+        self.favorite(self.users[0])
+        Favorite.objects.filter(user=self.users[0]).update(
+            added_at=timezone.now() - timedelta(days=10)
+        )
+        self.favorite(self.users[1])
+        trending.recompute()
+        self.assertAlmostEqual(
+            self.score(),
+            Favorite.trending_weight * (1 + 0.5 ** (240 / 72)), places=3,
+        )
+        self.assertEqual(self.favorite(self.users[0], 'delete').status_code,
+                         204)
+        self.assertAlmostEqual(self.score(), Favorite.trending_weight,
+                               places=3)
+
+    def test_repeated_removal_subtracts_once(self):
+        self.favorite(self.users[0])
+        self.favorite(self.users[1])
+        self.assertEqual(self.favorite(self.users[0], 'delete').status_code,
+                         204)
+        self.assertEqual(self.favorite(self.users[0], 'delete').status_code,
+                         400)
+        self.assertAlmostEqual(self.score(), Favorite.trending_weight,
+                               places=3)
+
+    def test_recompute_drops_removed_rows(self):
+        self.favorite(self.users[0])
+        Favorite.objects.all().delete()
+        trending.recompute()
+        self.assertEqual(self.score(), 0)
+
+
+class TagBitTests(TestCase):
+    def test_taken_bit_is_retried(self):
+        Tag.objects.create(name='Завтрак', slug='breakfast')
+        free_bits = Tag.free_bits
+        stale = [{0}]
+
+        def race():
+            # Первый выбор сделан до того, как другой тег занял бит 0.
+            return stale.pop() if stale else free_bits()
+
+        with mock.patch.object(Tag, 'free_bits', race):
+            tag = Tag.objects.create(name='Ужин', slug='dinner')
+        self.assertEqual(tag.bit, 1)
+
+    def test_other_integrity_errors_are_raised(self):
+        Tag.objects.create(name='Завтрак', slug='breakfast')
+        with self.assertRaises(IntegrityError):
+            Tag.objects.create(name='Завтрак', slug='dinner')
+
+
+class PurgeTests(TemporaryFilesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.author, self.reader = [
+            FoodgramUser.objects.create(
+                email=f'{name}@example.com', username=name,
+                first_name='Имя', last_name='Фамилия',
+            )
+            for name in ('author', 'reader')
+        ]
+        self.tag = Tag.objects.create(name='Завтрак', slug='breakfast')
+        self.ingredient = Ingredient.objects.create(name='Мука',
+                                                    measurement_unit='г')
+        self.recipes = [self.create_recipe(self.author) for _ in range(2)]
+        self.kept = self.create_recipe(self.reader)
+        for user, recipe in ((self.reader, self.recipes[0]),
+                             (self.author, self.kept)):
+            Favorite.objects.create(user=user, recipe=recipe)
+            ShoppingList.objects.create(user=user, recipe=recipe)
+        Subscription.objects.create(user=self.reader, author=self.author)
+        Subscription.objects.create(user=self.author, author=self.reader)
+        household = Household.objects.create(name='Дом', author=self.reader)
+        household.members.set([self.author, self.reader])
+        Token.objects.create(user=self.author)
+        DataExport.objects.create(user=self.author)
+        ArchivedRelation.objects.create(
+            model='favorite', user_id=self.reader.id,
+            recipe_id=self.recipes[1].id, added_at=timezone.now(),
+        )
+
+    def create_recipe(self, author):
+        recipe = Recipe.objects.create(
+            author=author, name='Рецепт', text='Текст', cooking_time=10,
+            image='recipes/image.png',
+        )
+        recipe.tags.add(self.tag)
+        IngredientInRecipe.objects.create(recipe=recipe,
+                                          ingredient=self.ingredient,
+                                          amount=100)
+        return recipe
+
+    def references(self, model, ids):
+        """Строки любых таблиц, ссылающиеся на объекты model из ids."""
+        found = {}
+        for related in apps.get_models(include_auto_created=True):
+            for field in related._meta.concrete_fields:
+                if field.is_relation and field.related_model is model:
+                    count = related._base_manager.filter(
+                        **{f'{field.name}__in': ids}
+                    ).count()
+                    if count:
+                        found[f'{related.__name__}.{field.name}'] = count
+        return found
+
+    def total_rows(self):
+        return sum(
+            model._base_manager.count()
+            for model in apps.get_models(include_auto_created=True)
+            if not model._meta.proxy
+            and model not in (ArchivedRelation, PurgeJob)
+        )
+
+    def assert_purged(self):
+        recipes = [recipe.id for recipe in self.recipes]
+        self.assertFalse(Recipe.all_objects.filter(id__in=recipes).exists())
+        self.assertFalse(FoodgramUser.objects.filter(
+            id=self.author.id).exists())
+        self.assertEqual(self.references(Recipe, recipes), {})
+        self.assertEqual(self.references(FoodgramUser, [self.author.id]), {})
+        self.assertFalse(ArchivedRelation.objects.filter(
+            recipe_id__in=recipes).exists())
+        self.assertEqual(
+            list(Recipe.all_objects.values_list('id', flat=True)),
+            [self.kept.id],
+        )
+        self.assertEqual(self.kept.tags.get(), self.tag)
+        self.assertTrue(self.kept.ingridients_in_recipe.exists())
+        self.assertFalse(Favorite.objects.filter(user=self.reader).exists())
+        self.assertEqual(
+            list(self.reader.households.values_list('members', flat=True)),
+            [self.reader.id],
+        )
+
+    def test_user_purge_removes_all_dependent_rows(self):
+        job = purge.soft_delete(self.author)
+        self.assertFalse(Recipe.objects.filter(author=self.author).exists())
+        rows = self.total_rows()
+        call_command('purge', stdout=io.StringIO())
+        self.assert_purged()
+        job.refresh_from_db()
+        self.assertIsNotNone(job.finished_at)
+        self.assertEqual(job.deleted, rows - self.total_rows())
+
+    def test_interrupted_job_resumes(self):
+        purge.soft_delete(self.author)
+        deleted = []
+        delete_rows = purge.delete_rows
+
+        def failing_delete_rows(model, ids):
+            if len(deleted) == 5:
+                raise RuntimeError('Прервано')
+            deleted.append(delete_rows(model, ids))
+            return deleted[-1]
+
+        with mock.patch.object(purge, 'delete_rows', failing_delete_rows):
+            with self.assertRaises(RuntimeError):
+                call_command('purge', batch_size=1, stdout=io.StringIO())
+            job = PurgeJob.objects.get()
+            self.assertIsNone(job.finished_at)
+            self.assertEqual(job.deleted, 5)
+            deleted.append(None)
+            call_command('purge', batch_size=1, stdout=io.StringIO())
+        self.assert_purged()
+        job.refresh_from_db()
+        self.assertIsNotNone(job.finished_at)
+        self.assertEqual(job.deleted, sum(filter(None, deleted)))
+
+
+class MediaStorageTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(MEDIA_ROOT=directory.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.author = FoodgramUser.objects.create(
+            email='author@example.com', username='author',
+            first_name='Имя', last_name='Фамилия',
+        )
+
+    def write(self, name, content, age=0):
+        """Кладёт файл в обход хранилища и состаривает его на age минут."""
+        path = default_storage.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file:
+            file.write(content)
+        mtime = timezone.now().timestamp() - age * 60
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def create_recipe(self, image):
+        return Recipe.objects.create(
+            author=self.author, name='Рецепт', text='Текст', cooking_time=10,
+            image=image,
+        )
+
+    def cleanmedia(self):
+        call_command('cleanmedia', '--grace', '60', stdout=io.StringIO())
+
+    def test_identical_uploads_share_file(self):
+        first = default_storage.save('recipes/a.png', ContentFile(b'image'))
+        path = default_storage.path(first)
+        os.utime(path, (0, 0))
+        second = default_storage.save('recipes/b.PNG', ContentFile(b'image'))
+        self.assertEqual(first, second)
+        self.assertTrue(default_storage.is_hashed(first))
+        self.assertTrue(first.endswith('.png'))
+        self.assertEqual(os.listdir(os.path.dirname(path)),
+                         [os.path.basename(path)])
+        self.assertGreater(os.path.getmtime(path), 0)
+        other = default_storage.save('recipes/c.png', ContentFile(b'other'))
+        self.assertNotEqual(first, other)
+
+    def test_cleanmedia_renames_and_deletes_stale_files(self):
+        recipe = self.create_recipe('recipes/legacy.png')
+        self.write('recipes/legacy.png', b'legacy', age=120)
+        stale = self.write('recipes/stale.png', b'stale', age=120)
+        fresh = self.write('recipes/fresh.png', b'fresh')
+        self.cleanmedia()
+        recipe.refresh_from_db()
+        self.assertTrue(default_storage.is_hashed(recipe.image.name))
+        self.assertTrue(default_storage.exists(recipe.image.name))
+        self.assertFalse(default_storage.exists('recipes/legacy.png'))
+        self.assertFalse(os.path.exists(stale))
+        self.assertTrue(os.path.exists(fresh))
+
+    def test_cleanmedia_rechecks_references_before_delete(self):
+        name = default_storage.save('recipes/a.png', ContentFile(b'image'))
+        path = default_storage.path(name)
+        os.utime(path, (0, 0))
+        getmtime = os.path.getmtime
+
+        def reference_then_getmtime(checked):
+            # Строка ссылается на файл после того, как ссылки собраны.
+            if not Recipe.objects.filter(image=name).exists():
+                self.create_recipe(name)
+            return getmtime(checked)
+
+        with mock.patch('os.path.getmtime', reference_then_getmtime):
+            self.cleanmedia()
+        self.assertTrue(os.path.exists(path))
+        self.cleanmedia()
+        self.assertTrue(os.path.exists(path))
+
+
+class RecipeIndexTests(TemporaryFilesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        author = FoodgramUser.objects.create(
+            email='author@example.com', username='author',
+            first_name='Имя', last_name='Фамилия',
+        )
+        self.ingredients = [
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('Мука', 'Сахар')
+        ]
+        self.recipes = []
+        for _ in range(2):
+            recipe = Recipe.objects.create(
+                author=author, name='Рецепт', text='Текст', cooking_time=10,
+                image='recipes/image.png',
+            )
+            IngredientInRecipe.objects.create(
+                recipe=recipe, ingredient=self.ingredients[0], amount=1
+            )
+            self.recipes.append(recipe.id)
+        self.path = os.path.join(self.directory, 'recipes.pickle')
+
+    def worker(self):
+        """Отдельный экземпляр индекса, как в другом процессе."""
+        return RecipeIndex(self.path)
+
+    def rows(self, index):
+        index.sync()
+        return {recipe: set(row) for recipe, row in index.ingredients.items()}
+
+    def test_workers_share_changes(self):
+        first, second = self.worker(), self.worker()
+        first.rebuild()
+        IngredientInRecipe.objects.create(
+            recipe_id=self.recipes[0], ingredient=self.ingredients[1],
+            amount=1,
+        )
+        first.refresh(self.recipes[0])
+        second.discard(self.recipes[1])
+        expected = {self.recipes[0]: {ingredient.id
+                                      for ingredient in self.ingredients}}
+        for index in (first, second, self.worker()):
+            self.assertEqual(self.rows(index), expected)
+
+    def test_log_is_compacted(self):
+        first, second = self.worker(), self.worker()
+        first.rebuild()
+        self.rows(second)
+        with mock.patch('recipes.index.RECIPE_INDEX_LOG_LIMIT', 2):
+            first.discard(self.recipes[0])
+            size = os.path.getsize(first.log_path)
+            first.discard(self.recipes[1])
+        self.assertLess(os.path.getsize(first.log_path), size)
+        self.assertEqual(self.rows(second), {})
+        self.assertEqual(self.rows(self.worker()), {})
+
+    def test_build_from_rows(self):
+        self.worker().build([(1, (10, 20), (1,)), (2, (10,), (1,)),
+                             (3, (30,), ())])
+        index = self.worker()
+        self.assertEqual(index.similar(1, 6), [2])
+        self.assertEqual(index.pantry([10], 1)[:3], [(2, 1.0)])
+
+    def test_missing_index_is_not_built_in_request(self):
+        index = self.worker()
+        with self.assertNumQueries(0), self.assertLogs('recipes.index'):
+            self.assertEqual(index.similar(self.recipes[0], 6), [])
+        self.assertFalse(os.path.exists(self.path))
+
+
+@skipUnless(connection.vendor == 'postgresql',
+            'Секционирование есть только в PostgreSQL')
+class PartitionedArchiveTests(TemporaryFilesMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        migration = import_module('recipes.migrations.0010_relation_archive')
+        with override_settings(RELATION_ARCHIVE_PARTITIONED=True):
+            self.relayout(migration.create_archive)
+        self.addCleanup(self.relayout, migration.create_archive)
+        user = FoodgramUser.objects.create(
+            email='user@example.com', username='user',
+            first_name='Имя', last_name='Фамилия',
+        )
+        self.recipe = Recipe.objects.create(
+            author=user, name='Рецепт', text='Текст', cooking_time=10,
+            image='recipes/image.png',
+        )
+        Favorite.objects.create(user=user, recipe=self.recipe)
+        Favorite.objects.update(added_at=timezone.now() - timedelta(days=1))
+        trending.recompute()
+
+    def relayout(self, create_archive):
+        with connection.schema_editor() as editor:
+            editor.delete_model(ArchivedRelation)
+            create_archive(apps, editor)
+
+    def test_archive_snapshot_and_expire(self):
+        self.assertEqual(archive.archive(Favorite, timezone.now()), 1)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.trending_score, 0)
+        path = os.path.join(self.directory, 'snapshot.tar.gz')
+        call_command('snapshot', path, stdout=io.StringIO())
+        call_command('restore', path, stdout=io.StringIO())
+        self.assertEqual(
+            list(ArchivedRelation.objects.values_list('model', 'recipe_id')),
+            [('favorite', self.recipe.pk)],
+        )
+        self.assertEqual(
+            archive.expire(timezone.now() + timedelta(days=62)), 1
+        )
+        self.assertFalse(ArchivedRelation.objects.exists())
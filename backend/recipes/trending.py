@@ -0,0 +1,56 @@
+import math
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .constants import (TRENDING_BATCH_SIZE, TRENDING_HALF_LIFE_HOURS,
+                        TRENDING_MIN_SCORE)
+from .models import Favorite, Recipe, ShoppingList
+
+MODELS = (Favorite, ShoppingList)
+
+
+def contribution(model, added_at, now):
+    """Текущий вклад одной записи избранного или списка покупок."""
+    hours = (now - added_at).total_seconds() / 3600
+    return model.trending_weight * 0.5 ** (hours / TRENDING_HALF_LIFE_HOURS)
+
+
+def horizon(now):
+    """Записи старше этого момента дают вклад меньше TRENDING_MIN_SCORE."""
+    weight = max(model.trending_weight for model in MODELS)
+    return now - timedelta(hours=TRENDING_HALF_LIFE_HOURS * math.log2(
+        weight / TRENDING_MIN_SCORE
+    ))
+
+
+@transaction.atomic
+def recompute(recipes=None):
+    """Пересчитывает популярность по живым записям с учётом их возраста.
+
+    Без recipes пересчитываются все рецепты. Читаются только записи
+    моложе horizon(), поэтому объём работы зависит от активности
+    пользователей, а не от размера таблиц.
+    """
+    now = timezone.now()
+    scores = defaultdict(float)
+    for model in MODELS:
+        rows = model.objects.filter(added_at__gt=horizon(now))
+        if recipes is not None:
+            rows = rows.filter(recipe__in=recipes)
+        for recipe, added_at in rows.values_list(
+                'recipe_id', 'added_at').iterator():
+            scores[recipe] += contribution(model, added_at, now)
+    stale = Recipe.all_objects.filter(trending_score__gt=0)
+    if recipes is not None:
+        stale = stale.filter(id__in=recipes)
+    stale.update(trending_score=0)
+    Recipe.all_objects.bulk_update(
+        [Recipe(id=recipe, trending_score=score)
+         for recipe, score in scores.items() if score >= TRENDING_MIN_SCORE],
+        ['trending_score'],
+        batch_size=TRENDING_BATCH_SIZE,
+    )
+    return len(scores)